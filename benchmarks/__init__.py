@@ -0,0 +1,6 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" benchmarks for iot_control, run 'python -m benchmarks.runtime_benchmark --help'
+
+"""
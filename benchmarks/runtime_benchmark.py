@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" end-to-end benchmark of IoTRuntime with simulated devices, the real MQTT and
+    InfluxDB backends and in-process stand-ins for their servers. It measures
+
+      - readings per second through regular_update() and the values arriving at the
+        MQTT broker and InfluxDB. With the default interval the devices are only read
+        that often, 'reads_ratio' tells which fraction of the expected reads was done.
+        A tiny '--interval' like 0.001 reads them as fast as possible and measures the
+        capacity instead
+      - command-to-GPIO latency: from the broker sending a command until the simulated
+        GPIO pin changes, through mqtt_callback_message() and set_state()
+      - trigger-to-publish latency: from an edge on a simulated GPIO input until the
+        new state arrives at the broker
+      - CPU usage and RSS of the process
+
+    Every device count runs in a process of its own, the results are written as JSON
+    and can be compared with an earlier run:
+
+      python -m benchmarks.runtime_benchmark --devices 10,50,100 --output before.json
+      python -m benchmarks.runtime_benchmark --devices 10,50,100 --compare before.json
+
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import queue
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import yaml
+
+# the switch and the binary sensor used for the latencies
+SWITCH_PIN = 5
+BINARY_SENSOR_PIN = 6
+SWITCH_ID = "bench_switch"
+BINARY_SENSOR_ID = "bench_contact"
+DISCOVERY_PREFIX = "homeassistant"
+
+# (key, True if higher is better) for --compare
+COMPARED = (("reads_ratio", True), ("cpu_percent", False), ("rss_mb", False),
+            ("command_latency_ms.p95", False), ("trigger_latency_ms.p95", False))
+
+
+def _sensor(device: int, name: str, device_class: str, unit: str) -> dict:
+    """ private helper, config of one sensor entry """
+    return {"name": "bench {} {}".format(device, name),
+            "unique_id": "bench_{}_{}".format(device, name),
+            "device_class": device_class, "unit_of_measurement": unit,
+            "expire_after": 3600}
+
+
+def make_config(args, devices: int, mqtt_address, influx_address) -> dict:
+    """ the config for IoTRuntime with the given number of simulated I2C sensors, a
+        switch and a binary sensor. Four sensors share a bus, like two BME280 and two
+        BH1750 on their two addresses each.
+    """
+    conf = {
+        "name": "benchmark",
+        "runtime": {
+            "polling": args.polling,
+            "trigger_window": 0.0,
+            "hardware": {"mode": "simulated", "seed": args.seed, "i2c_clock": args.i2c_clock},
+        },
+        "backends": {
+            "mqtt_hass": {
+                "server": mqtt_address[0], "port": mqtt_address[1],
+                "hass_discovery_prefix": DISCOVERY_PREFIX,
+                "online_payload": "online", "offline_payload": "offline",
+                "payload_on": "on", "payload_off": "off",
+            },
+            "influx": {
+                "server": influx_address[0], "port": influx_address[1],
+                "user": "bench", "password": "bench", "database": "bench",
+            },
+        },
+        "devices": {
+            "raspi-gpio%bench": {
+                "payload_on": "on", "payload_off": "off",
+                "switches": {SWITCH_ID: {"name": "bench switch", "unique_id": SWITCH_ID,
+                                         "pin": SWITCH_PIN}},
+            },
+            "raspi-binary-sensor%bench": {
+                "payload_on": "ON", "payload_off": "OFF",
+                "binary-sensors": {BINARY_SENSOR_ID: {
+                    "name": "bench contact", "unique_id": BINARY_SENSOR_ID,
+                    "pin": BINARY_SENSOR_PIN, "device_class": "door"}},
+            },
+        },
+    }
+    if args.synthetic:
+        conf["devices"]["synthetic%bench"] = {
+            "entity": "sensor", "count": args.synthetic, "prefix": "bench_synthetic",
+            "seed": args.seed}
+    for i in range(devices):
+        port = 10 + i // 4
+        if 0 == i % 2:
+            conf["devices"]["bme280%{}".format(i)] = {
+                "port": port, "i2c_address": 0x76 + (i // 2) % 2,
+                "sensors": {
+                    "temperature": _sensor(i, "temperature", "temperature", "°C"),
+                    "humidity": _sensor(i, "humidity", "humidity", "%"),
+                    "pressure": _sensor(i, "pressure", "pressure", "hPa"),
+                }}
+        else:
+            conf["devices"]["bh1750%{}".format(i)] = {
+                "port": port, "i2c_address": (0x23, 0x5C)[(i // 2) % 2],
+                "sensors": {
+                    "illuminance": _sensor(i, "illuminance", "illuminance", "lx"),
+                }}
+    return conf
+
+
+def summarize(latencies: list, lost: int) -> dict:
+    """ statistics of latencies in seconds, in milliseconds """
+    if not latencies:
+        return {"samples": 0, "lost": lost}
+    ordered = sorted(latencies)
+
+    def percentile(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000.0
+
+    return {"samples": len(ordered), "lost": lost,
+            "min": ordered[0] * 1000.0, "median": statistics.median(ordered) * 1000.0,
+            "p95": percentile(0.95), "p99": percentile(0.99), "max": ordered[-1] * 1000.0}
+
+
+def rss_mb() -> float:
+    """ current resident set size of the process in MiB, like peak_rss_mb """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1048576.0
+    except OSError:
+        return float("nan")
+
+
+class RuntimeBenchmark:
+    """ one run: starts the stand-ins and the runtime in this process, measures from a
+        second thread while the event loop runs in the main thread (it needs the main
+        thread for its signal handlers)
+
+    Args:
+        args: the parsed command line
+        devices (int): number of simulated I2C sensors
+    """
+
+    def __init__(self, args, devices: int):
+        self.args = args
+        self.devices = devices
+        self.results = {}
+        self.runtime = None
+        self.broker = None
+        self.influx = None
+
+    def __reads(self):
+        """ private helper, number of reads and their total duration so far """
+        metrics = self.runtime.metrics
+        with metrics.lock:
+            histograms = list(metrics.values.get("iot_read_seconds", {}).values())
+            return sum(h.count for h in histograms), sum(h.sum for h in histograms)
+
+    def run(self) -> dict:
+        """ run the benchmark, returns the results """
+        from benchmarks.standins import MqttBroker, InfluxServer
+        from iot_control.iotruntime import IoTRuntime
+
+        self.broker = MqttBroker()
+        self.broker.start()
+        self.influx = InfluxServer()
+        self.influx.start()
+
+        cwd = os.getcwd()
+        workdir = tempfile.mkdtemp(prefix="iot_control_benchmark_")
+        try:
+            configfile = os.path.join(workdir, "setup.yaml")
+            with open(configfile, "w") as f:
+                yaml.safe_dump(make_config(self.args, self.devices, self.broker.address,
+                                           self.influx.address), f)
+            # the runtime writes its log and config cache to the current directory
+            os.chdir(workdir)
+            start = time.monotonic()
+            self.runtime = IoTRuntime(configfile, logging.WARNING)
+            self.results["startup_seconds"] = time.monotonic() - start
+            self.runtime.set_intervall(self.args.interval)
+
+            driver = threading.Thread(target=self.__measure, name="benchmark_driver")
+            driver.start()
+            self.runtime.loop_forever()
+            driver.join()
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        scheduler = self.runtime.scheduler
+        self.results["max_drift_seconds"] = scheduler.max_drift if scheduler else None
+        self.results["missed_updates"] = scheduler.missed if scheduler else None
+        self.broker.stop()
+        self.influx.stop()
+        return self.results
+
+    def __measure(self) -> None:
+        """ private thread doing the measurements while the event loop runs """
+        try:
+            while self.runtime.loop is None or not self.runtime.loop.is_running():
+                time.sleep(0.01)
+            command_topic = "{}/switch/{}/command".format(DISCOVERY_PREFIX, SWITCH_ID)
+            if not self.broker.wait_for_subscription(command_topic):
+                logging.getLogger("iot_control").error("benchmark: no subscription to %s",
+                                                       command_topic)
+            time.sleep(self.args.warmup)
+            self.__throughput()
+            self.__command_latency()
+            self.__trigger_latency()
+        finally:
+            self.runtime.loop.call_soon_threadsafe(self.runtime.loop.stop)
+
+    def __throughput(self) -> None:
+        """ private helper, readings per second, CPU and memory while polling """
+        reads, read_time = self.__reads()
+        messages, points = self.broker.messages, self.influx.points
+        cpu = os.times()
+        start = time.monotonic()
+        time.sleep(self.args.duration)
+        wall = time.monotonic() - start
+        cpu_end = os.times()
+        reads_end, read_time_end = self.__reads()
+        done = reads_end - reads
+        expected = (self.devices + 2 + (1 if self.args.synthetic else 0)) / self.args.interval
+        self.results.update({
+            "duration": wall,
+            "reads_per_second": done / wall,
+            "expected_reads_per_second": expected,
+            # 1.0 if the runtime keeps up with the configured intervals
+            "reads_ratio": done / wall / expected,
+            "read_seconds_mean": (read_time_end - read_time) / done if done else None,
+            "mqtt_messages_per_second": (self.broker.messages - messages) / wall,
+            "influx_points_per_second": (self.influx.points - points) / wall,
+            "cpu_percent": 100.0 * ((cpu_end.user - cpu.user) + (cpu_end.system - cpu.system)) / wall,
+            "rss_mb": rss_mb(),
+            # ru_maxrss is in KiB on Linux
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        })
+
+    def __command_latency(self) -> None:
+        """ private helper, time from a command at the broker until the GPIO pin changes """
+        from iot_control.iothardware import IoTHardware
+        changes = queue.Queue()
+        IoTHardware.simulation.gpio.add_output_listener(
+            lambda pin, value, timestamp: changes.put((value, timestamp))
+            if SWITCH_PIN == pin else None)
+        topic = "{}/switch/{}/command".format(DISCOVERY_PREFIX, SWITCH_ID)
+        latencies = []
+        lost = 0
+        for i in range(self.args.samples):
+            level = 1 - i % 2
+            sent = self.broker.publish(topic, "on" if level else "off")
+            end = sent + 2.0
+            while True:
+                try:
+                    value, timestamp = changes.get(timeout=max(0.0, end - time.monotonic()))
+                except queue.Empty:
+                    lost += 1
+                    break
+                if value == level and timestamp >= sent:
+                    latencies.append(timestamp - sent)
+                    break
+            time.sleep(self.args.spacing)
+        self.results["command_latency_ms"] = summarize(latencies, lost)
+
+    def __trigger_latency(self) -> None:
+        """ private helper, time from a GPIO edge until the new state is at the broker """
+        from iot_control.iothardware import IoTHardware
+        gpio = IoTHardware.simulation.gpio
+        topic = "{}/binary_sensor/{}/state".format(DISCOVERY_PREFIX, BINARY_SENSOR_ID)
+        arrivals = queue.Queue()
+        self.broker.listeners.append(
+            lambda t, payload, timestamp: arrivals.put(timestamp) if t == topic else None)
+        latencies = []
+        lost = 0
+        # longer than the bouncetime of the binary sensor
+        spacing = max(self.args.spacing, 0.15)
+        for i in range(self.args.samples):
+            sent = time.monotonic()
+            gpio.inject(BINARY_SENSOR_PIN, i % 2)
+            end = sent + 2.0
+            while True:
+                try:
+                    timestamp = arrivals.get(timeout=max(0.0, end - time.monotonic()))
+                except queue.Empty:
+                    lost += 1
+                    break
+                if timestamp >= sent:
+                    latencies.append(timestamp - sent)
+                    break
+            time.sleep(spacing)
+        self.results["trigger_latency_ms"] = summarize(latencies, lost)
+
+
+def _value(run: dict, key: str):
+    """ private helper, a possibly nested value like 'command_latency_ms.p95' """
+    for part in key.split("."):
+        if not isinstance(run, dict) or part not in run:
+            return None
+        run = run[part]
+    return run
+
+
+def compare(old: dict, new: dict, tolerance: float) -> bool:
+    """ print the changes between two results, returns False if something got worse
+        by more than tolerance (a fraction)
+    """
+    ok = True
+    old_runs = {run["devices"]: run for run in old.get("runs", [])}
+    for run in new["runs"]:
+        baseline = old_runs.get(run["devices"], None)
+        if baseline is None:
+            continue
+        print("{} devices:".format(run["devices"]))
+        for key, higher_is_better in COMPARED:
+            before, after = _value(baseline, key), _value(run, key)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            worse = -change if higher_is_better else change
+            flag = "REGRESSION" if worse > tolerance else ""
+            ok = ok and not flag
+            print("  {:<26} {:>10.2f} -> {:>10.2f} ({:+.1%}) {}".format(
+                key, before, after, change, flag))
+    return ok
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="end-to-end benchmark of IoTRuntime")
+    parser.add_argument("--devices", default="10,50,100",
+                        help="comma separated numbers of simulated I2C sensors, one run each")
+    parser.add_argument("--interval", type=float, default=1.0,
+                        help="polling interval of the devices in seconds, a tiny one "
+                             "like 0.001 measures the capacity")
+    parser.add_argument("--polling", default="concurrent", choices=("serial", "concurrent"))
+    parser.add_argument("--duration", type=float, default=20.0,
+                        help="seconds of measuring the throughput")
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--samples", type=int, default=50,
+                        help="number of commands and triggers for the latencies")
+    parser.add_argument("--spacing", type=float, default=0.05,
+                        help="seconds between two commands or triggers")
+    parser.add_argument("--i2c-clock", type=int, default=100000,
+                        help="clock of the simulated I2C buses, 0 for no transfer delays")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="number of additional synthetic sensors on one device")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare with the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="allowed relative regression for --compare")
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        # child process: one run, the results go to stdout
+        run = {"devices": int(args.devices)}
+        run.update(RuntimeBenchmark(args, int(args.devices)).run())
+        json.dump(run, sys.stdout)
+        return 0
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [root] + [p for p in [os.environ.get("PYTHONPATH", "")] if p]))
+    results = {
+        "benchmark": "runtime",
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "settings": {key: value for key, value in vars(args).items()
+                     if key not in ("output", "compare", "single", "devices")},
+        "runs": [],
+    }
+    for devices in [int(d) for d in args.devices.split(",")]:
+        print("running with {} devices ...".format(devices), file=sys.stderr)
+        command = [sys.executable, "-m", "benchmarks.runtime_benchmark", "--single",
+                   "--devices", str(devices)]
+        for key, value in results["settings"].items():
+            command += ["--" + key.replace("_", "-"), str(value)]
+        child = subprocess.run(command, stdout=subprocess.PIPE, cwd=root, env=env, check=False)
+        if child.returncode:
+            print("run with {} devices failed".format(devices), file=sys.stderr)
+            continue
+        run = json.loads(child.stdout)
+        results["runs"].append(run)
+        print("  {:.1f} reads/s ({:.0%} of the expected {:.1f}), CPU {:.1f} %, RSS {:.1f} MiB, "
+              "command p95 {:.2f} ms, trigger p95 {:.2f} ms".format(
+                  run["reads_per_second"], run["reads_ratio"],
+                  run["expected_reads_per_second"],
+                  run["cpu_percent"], run["rss_mb"],
+                  _value(run, "command_latency_ms.p95") or float("nan"),
+                  _value(run, "trigger_latency_ms.p95") or float("nan")),
+              file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            return 0 if compare(json.load(f), results, args.tolerance) else 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" in-process stand-ins for an MQTT broker and the InfluxDB HTTP API, so the real
+    backends can be benchmarked without any servers
+
+"""
+
+import json
+import socket
+import socketserver
+import struct
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# MQTT 3.1.1 packet types
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """ does a topic match a subscription with the wildcards + and # """
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for i, level in enumerate(filter_levels):
+        if "#" == level:
+            return True
+        if i >= len(topic_levels) or (level != "+" and level != topic_levels[i]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def _encode_length(length: int) -> bytes:
+    """ private helper, remaining length of a packet as variable length integer """
+    result = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        result.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(result)
+
+
+def _encode_string(text) -> bytes:
+    """ private helper, a string with its length in front """
+    data = text.encode("utf-8") if isinstance(text, str) else text
+    return struct.pack("!H", len(data)) + data
+
+
+class MqttConnection(socketserver.BaseRequestHandler):
+    """ one client of the broker, handles the packets the iot_control backend sends:
+        CONNECT, PUBLISH with QoS 0 and 1, SUBSCRIBE, UNSUBSCRIBE, PINGREQ, DISCONNECT
+    """
+
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.lock = threading.Lock()
+        self.subscriptions = set()
+        self.buffer = b""
+
+    def send(self, packet_type: int, flags: int, body: bytes) -> None:
+        """ send one packet to the client """
+        with self.lock:
+            self.request.sendall(bytes([(packet_type << 4) | flags]) +
+                                 _encode_length(len(body)) + body)
+
+    def __read(self, count: int) -> bytes:
+        """ private helper reading exactly count bytes, None if the client is gone """
+        while len(self.buffer) < count:
+            try:
+                data = self.request.recv(65536)
+            except OSError:
+                return None
+            if not data:
+                return None
+            self.buffer += data
+        result, self.buffer = self.buffer[:count], self.buffer[count:]
+        return result
+
+    def handle(self):
+        broker = self.server.broker
+        try:
+            while True:
+                header = self.__read(1)
+                if header is None:
+                    return
+                length = 0
+                multiplier = 1
+                while True:
+                    byte = self.__read(1)
+                    if byte is None:
+                        return
+                    length += (byte[0] & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte[0] & 0x80:
+                        break
+                body = self.__read(length) if length else b""
+                if body is None:
+                    return
+                packet_type, flags = header[0] >> 4, header[0] & 0x0F
+                if CONNECT == packet_type:
+                    self.send(CONNACK, 0, b"\x00\x00")
+                    broker.add_client(self)
+                elif PUBLISH == packet_type:
+                    self.__publish(flags, body)
+                elif SUBSCRIBE == packet_type:
+                    self.__subscribe(body)
+                elif UNSUBSCRIBE == packet_type:
+                    packet_id = body[:2]
+                    position = 2
+                    while position < len(body):
+                        size = struct.unpack("!H", body[position:position + 2])[0]
+                        self.subscriptions.discard(
+                            body[position + 2:position + 2 + size].decode("utf-8"))
+                        position += 2 + size
+                    self.send(UNSUBACK, 0, packet_id)
+                elif PINGREQ == packet_type:
+                    self.send(PINGRESP, 0, b"")
+                elif DISCONNECT == packet_type:
+                    return
+        finally:
+            broker.remove_client(self)
+
+    def __publish(self, flags: int, body: bytes) -> None:
+        """ private helper for a PUBLISH from the client """
+        now = time.monotonic()
+        size = struct.unpack("!H", body[:2])[0]
+        topic = body[2:2 + size].decode("utf-8")
+        position = 2 + size
+        qos = (flags >> 1) & 0x03
+        if qos:
+            self.send(PUBACK, 0, body[position:position + 2])
+            position += 2
+        self.server.broker.received(topic, body[position:], bool(flags & 0x01), now)
+
+    def __subscribe(self, body: bytes) -> None:
+        """ private helper for a SUBSCRIBE, everything is delivered with QoS 0 """
+        packet_id = body[:2]
+        position = 2
+        granted = bytearray()
+        topics = []
+        while position < len(body):
+            size = struct.unpack("!H", body[position:position + 2])[0]
+            topics.append(body[position + 2:position + 2 + size].decode("utf-8"))
+            position += 3 + size
+            granted.append(0)
+        self.subscriptions.update(topics)
+        self.send(SUBACK, 0, packet_id + bytes(granted))
+        self.server.broker.subscribed(self, topics)
+
+
+class MqttBroker:
+    """ a minimal MQTT 3.1.1 broker running in threads of this process. It records
+        every message it gets with the time it arrived and can publish messages to the
+        subscribed clients, like Home Assistant sending a command.
+
+    Args:
+        host (str): address to listen on
+        port (int): port to listen on, 0 for any free port
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.server = socketserver.ThreadingTCPServer((host, port), MqttConnection,
+                                                      bind_and_activate=False)
+        self.server.allow_reuse_address = True
+        self.server.daemon_threads = True
+        self.server.server_bind()
+        self.server.server_activate()
+        self.server.broker = self
+        self.address = self.server.server_address
+        self.lock = threading.Lock()
+        self.clients = []
+        self.retained = {}
+        self.messages = 0
+        self.listeners = []
+        self.subscription = threading.Condition(self.lock)
+        self.thread = None
+
+    def start(self) -> None:
+        """ start serving in a thread """
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True,
+                                       name="benchmark_mqtt_broker")
+        self.thread.start()
+
+    def stop(self) -> None:
+        """ stop serving """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_client(self, client: MqttConnection) -> None:
+        with self.lock:
+            self.clients.append(client)
+
+    def remove_client(self, client: MqttConnection) -> None:
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    def received(self, topic: str, payload: bytes, retain: bool, timestamp: float) -> None:
+        """ a client published a message """
+        with self.lock:
+            self.messages += 1
+            if retain:
+                self.retained[topic] = payload
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener(topic, payload, timestamp)
+        self.publish(topic, payload)
+
+    def subscribed(self, client: MqttConnection, topics: list) -> None:
+        """ a client subscribed, send it the retained messages """
+        with self.lock:
+            retained = [(topic, payload) for topic, payload in self.retained.items()
+                        if any(topic_matches(t, topic) for t in topics)]
+            self.subscription.notify_all()
+        for topic, payload in retained:
+            client.send(PUBLISH, 0x01, _encode_string(topic) + payload)
+
+    def wait_for_subscription(self, topic: str, timeout: float = 10.0) -> bool:
+        """ wait until some client subscribed to topic """
+        end = time.monotonic() + timeout
+        with self.lock:
+            while not any(topic_matches(t, topic) for c in self.clients for t in c.subscriptions):
+                left = end - time.monotonic()
+                if left <= 0:
+                    return False
+                self.subscription.wait(left)
+        return True
+
+    def publish(self, topic: str, payload) -> float:
+        """ send a message to all clients subscribed to topic, returns the time it was sent """
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        with self.lock:
+            clients = [c for c in self.clients
+                       if any(topic_matches(t, topic) for t in c.subscriptions)]
+        packet = _encode_string(topic) + payload
+        now = time.monotonic()
+        for client in clients:
+            try:
+                client.send(PUBLISH, 0, packet)
+            except OSError:
+                pass
+        return now
+
+
+class InfluxServer:
+    """ the parts of the InfluxDB 1.x HTTP API the influxdb client uses: /ping, /query
+        for SHOW DATABASES and CREATE DATABASE, and /write, which counts the points
+
+    Args:
+        host (str): address to listen on
+        port (int): port to listen on, 0 for any free port
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        influx = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """ request handler with access to the server """
+            protocol_version = "HTTP/1.1"
+
+            def __reply(self, status: int, body: bytes = b"") -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                # the client reads the version from every answer to /ping
+                self.send_header("X-Influxdb-Version", "1.8.10")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def __query(self, params: dict) -> None:
+                query = params.get("q", [""])[0].strip()
+                if query.upper().startswith("CREATE DATABASE"):
+                    influx.databases.add(query.split(None, 2)[2].strip('"'))
+                    result = {"statement_id": 0}
+                else:
+                    result = {"statement_id": 0, "series": [{
+                        "name": "databases", "columns": ["name"],
+                        "values": [[name] for name in sorted(influx.databases)]}]}
+                self.__reply(200, json.dumps({"results": [result]}).encode("utf-8"))
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                url = urllib.parse.urlsplit(self.path)
+                if "/ping" == url.path:
+                    self.__reply(204)
+                elif "/query" == url.path:
+                    self.__query(urllib.parse.parse_qs(url.query))
+                else:
+                    self.__reply(404)
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                now = time.monotonic()
+                url = urllib.parse.urlsplit(self.path)
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                params = urllib.parse.parse_qs(url.query)
+                if "/write" == url.path:
+                    points = len([line for line in body.split(b"\n") if line.strip()])
+                    influx.received(points, now)
+                    self.__reply(204)
+                elif "/query" == url.path:
+                    params.update(urllib.parse.parse_qs(body.decode("utf-8")))
+                    self.__query(params)
+                else:
+                    self.__reply(404)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.address = self.server.server_address
+        self.lock = threading.Lock()
+        self.databases = set()
+        self.writes = 0
+        self.points = 0
+        self.thread = None
+
+    def start(self) -> None:
+        """ start serving in a thread """
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True,
+                                       name="benchmark_influx")
+        self.thread.start()
+
+    def stop(self) -> None:
+        """ stop serving """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def received(self, points: int, timestamp: float) -> None:
+        """ a write with some points arrived """
+        with self.lock:
+            self.writes += 1
+            self.points += points
@@ -1,5 +1,3 @@
-from os.path import dirname, basename, isfile, join
-import glob
-modules = glob.glob(join(dirname(__file__), "*.py"))
-__all__ = [basename(f)[:-3] for f in modules if isfile(f)
-           and not f.endswith('__init__.py')]
+""" the backends, their modules are imported by IoTFactory when a backend
+    of their kind is in the config file
+"""
@@ -9,9 +9,10 @@ import datetime
 from typing import Dict
 import logging
 import influxdb
-from iot_control.iotbackendbase import IoTBackendBase
+from iot_control.iotbackendbase import IoTBackendBase, IoTBackendUnavailable
 from iot_control.iotdevicebase import IoTDeviceBase
 from iot_control.iotfactory import IoTFactory
+from iot_control.iotconfig import IoTConfigField
 
 
 @IoTFactory.register_backend("influx")
@@ -21,9 +22,19 @@ class BackendInfluxDB(IoTBackendBase):
     Args:
         IoTBackendBase: the base class
     """
+
+    config_schema = {
+        "server": IoTConfigField(str),
+        "port": IoTConfigField(int),
+        "user": IoTConfigField(str),
+        "password": IoTConfigField(str),
+        "database": IoTConfigField(str),
+    }
     devices = []
     json_templates = {}
     influx = None
+    # the database was found or created
+    database_ready = False
 
     def __connect(self):
         self.logger.info("connecting to influxdb")
@@ -40,7 +51,16 @@ class BackendInfluxDB(IoTBackendBase):
         self.config = kwargs.get("config", None)
 
         self.__connect()
-
+        try:
+            self.__check_database()
+        except Exception as error:
+            # not fatal, data waits in the spool until influx can be reached
+            self.logger.warning("cannot reach InfluxDB %s:%s: %s",
+                                self.config['server'], self.config['port'], error)
+
+    def __check_database(self):
+        """ private helper creating the database if it doesn't exist
+        """
         list= [db['name'] for db in self.influx.get_list_database()]
         #list= self.influx.get_list_database()
         self.logger.debug( "Connected to InfluxDB %s:%s", self.config['server'], self.config['port'] )
@@ -53,6 +73,7 @@ class BackendInfluxDB(IoTBackendBase):
             self.influx.create_database( self.config['database'] )
         else:
             self.logger.debug( "Influx database '%s' already present", self.config['database'] )
+        self.database_ready = True
 
 
     def register_device(self, device: IoTDeviceBase) -> None:
@@ -60,74 +81,137 @@ class BackendInfluxDB(IoTBackendBase):
         """
         self.devices.append(device)
 
+    def unregister_device(self, device: IoTDeviceBase) -> None:
+        """ forget a device and its templates
+        """
+        if device in self.devices:
+            self.devices.remove(device)
+        self.json_templates.pop(device, None)
+
     def shutdown(self):
         self.logger.info("shutdown influxdb")
         self.influx.close()
 
-    def workon(self, device: IoTDeviceBase, data: Dict):
-
-        if None == self.influx:
-            self.logger.info("Influx connection not present, try to reconnect '%s'", self.config['database'] )
-            self.__connect()
-
+    def __points(self, device: IoTDeviceBase, data: Dict, timestamp: float) -> list:
+        """ private helper creating the influx points for the data of a device
+        """
         if not device in self.json_templates:
             self.logger.error("unknown device")
-            return
+            return []
 
         json_templates= self.json_templates[device]
 
-        if None != self.influx:
+        # use the time the data was read from the device, not the time it arrives here
+        if None == timestamp:
+            time = datetime.datetime.utcnow()
+        else:
+            time = datetime.datetime.utcfromtimestamp(timestamp)
+
+        points= []
+        for entry in data:
+            if entry in json_templates:
+                self.logger.debug("influx data for field %s with value %s",
+                                entry, data[entry])
+                template= json_templates[entry][0]
+                try:
+                    value= float( data[entry] )
+                except (TypeError, ValueError):
+                    self.logger.error("influx: value %s for field %s is no number",
+                                      data[entry], entry)
+                    continue
+                points.append({
+                    "measurement": template["measurement"],
+                    "tags": template["tags"],
+                    "time": "{}".format(time),
+                    "fields": {entry: value}
+                })
+        return points
+
+    def __write(self, points: list):
+        """ private helper sending points to influx db in one request
+        """
+        if None == self.influx:
+            self.logger.info("Influx connection not present, try to reconnect '%s'", self.config['database'] )
+            self.__connect()
+
+        if None != self.influx and points:
             try:
-                for entry in data:
-                    # send to influx db
-                    if entry in json_templates:
-                        self.logger.debug("influx data for field %s with value %s",
-                                        entry, data[entry])
-                        template= json_templates[entry]
-                        template[0]["time"] = "{}".format(datetime.datetime.utcnow())
-                        template[0]["fields"][entry] = float( data[entry] )
-                        self.influx.write_points(template)
+                self.influx.write_points(points)
+            except influxdb.exceptions.InfluxDBClientError as error:
+                # the points were rejected, sending them again won't help
+                self.logger.error("influx rejected %d points: %s", len(points), error)
             except Exception as error:
                 self.logger.info("Exception %s", error )
                 self.influx = None
+                raise IoTBackendUnavailable(str(error))
+
+    def workon(self, device: IoTDeviceBase, data: Dict, timestamp: float = None):
+        self.__write(self.__points(device, data, timestamp))
+
+    def workon_many(self, readings: list):
+        """ write the points of all readings with a single request
+        """
+        points= []
+        for reading in readings:
+            points.extend(self.__points(reading.device, reading.data, reading.timestamp))
+        self.__write(points)
+
+    def is_available(self) -> bool:
+        """ reconnect and ping the server, create the database if that didn't work
+            when starting
+        """
+        try:
+            if None == self.influx:
+                self.__connect()
+            self.influx.ping()
+            if not self.database_ready:
+                self.__check_database()
+            return True
+        except Exception as error:
+            self.logger.debug("influx still not available: %s", error)
+            return False
 
     def announce(self):
         for device in self.devices:
+            self.announce_device(device)
 
-            json_templates= {}
+    def announce_device(self, device: IoTDeviceBase) -> None:
+        """ create the templates for the points of one device
+        """
+        json_templates= {}
 
-            # is it a sensor or a switch
-            if "sensors" in device.conf:
-                # get list of sensors on device
-                sensors = device.conf["sensors"]
-                # create a state topic for everyone
-                try:
-                    sensor_cfg = device.conf["sensors"]
-                    for sensor in sensors:
-                        try:
-                            self.logger.info(
-                                "influx registering sensor %s", sensor)
-                            sconf = sensor_cfg[sensor]
-                            json_template = [
-                                {
-                                    "measurement": sconf["name"],
-                                    "tags": {
-                                        "source": sconf["unique_id"],
-                                    },
-                                    "fields": {
-                                    }
+        # is it a sensor or a switch
+        if "sensors" in device.conf:
+            # get list of sensors on device
+            sensors = device.conf["sensors"]
+            # create a state topic for everyone
+            try:
+                sensor_cfg = device.conf["sensors"]
+                for sensor in sensors:
+                    try:
+                        self.logger.info(
+                            "influx registering sensor %s", sensor)
+                        sconf = sensor_cfg[sensor]
+                        json_template = [
+                            {
+                                "measurement": sconf["name"],
+                                "tags": {
+                                    "source": sconf["unique_id"],
                                 },
-                            ]
-                            json_templates[sensor] = json_template
-                        except Exception as exception:
-                            self.logger.error("config for sensor %s wrong: %s",
-                                              sensor, exception)
-                except Exception as exception:
-                    self.logger.error("error announcing sensor: %s", exception)
-            else:
-                # it is a switch
-                # - not supported here
-                pass
-
-            # finally add device's state topics list to permanent list
-            self.json_templates[device] = json_templates
+                                "fields": {
+                                }
+                            },
+                        ]
+                        json_templates[sensor] = json_template
+                    except Exception as exception:
+                        self.logger.error("config for sensor %s wrong: %s",
+                                          sensor, exception)
+            except Exception as exception:
+                self.logger.error("error announcing sensor: %s", exception)
+        else:
+            # it is a switch
+            # - not supported here
+            pass
+
+        # finally add device's state topics list to permanent list
+        self.json_templates[device] = json_templates
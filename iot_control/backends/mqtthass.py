@@ -9,9 +9,10 @@ import json
 from typing import Dict
 import logging
 import socket
-from iot_control.iotbackendbase import IoTBackendBase
+from iot_control.iotbackendbase import IoTBackendBase, IoTBackendUnavailable
 from iot_control.iotdevicebase import IoTDeviceBase
 from iot_control.iotfactory import IoTFactory
+from iot_control.iotconfig import IoTConfigField
 
 import paho.mqtt.client as mqtt
 
@@ -23,7 +24,24 @@ class BackendMqttHass(IoTBackendBase):
     Args:
         IoTBackendBase: the base class
     """
-    avail_topics = []
+
+    config_schema = {
+        "server": IoTConfigField(str),
+        "port": IoTConfigField(int),
+        "user": IoTConfigField(str, default=""),
+        "password": IoTConfigField(str, default=""),
+        "hass_discovery_prefix": IoTConfigField(str, default="homeassistant"),
+        "online_payload": IoTConfigField(str),
+        "offline_payload": IoTConfigField(str),
+        "payload_on": IoTConfigField(str),
+        "payload_off": IoTConfigField(str),
+    }
+    # MQTT has no time stamps, a replay would publish old states as the current ones,
+    # take over the client id of the daemon and change its availability and discovery
+    replayable = False
+    # topics per device
+    avail_topics = {}
+    config_topics = {}
     state_topics = {}
     command_topics = {}
     devices = []
@@ -43,22 +61,48 @@ class BackendMqttHass(IoTBackendBase):
             self.mqtt_client.username_pw_set(
                 username=config['user'], password=config['password'])
 
-        self.mqtt_client.connect(
-            self.config['server'], self.config['port'], 60)
+        try:
+            self.mqtt_client.connect(
+                self.config['server'], self.config['port'], 60)
+        except OSError as exception:
+            # the network thread keeps trying, data waits in the spool meanwhile
+            self.logger.warning("cannot reach mqtt server: %s", exception)
         self.mqtt_client.loop_start()
 
 
     def register_device(self, device: IoTDeviceBase) -> None:
         self.devices.append(device)
 
+    def unregister_device(self, device: IoTDeviceBase) -> None:
+        """ the device goes offline, its discovery config is deleted so Home Assistant
+            drops its entities and its command topics are unsubscribed
+        """
+        if device in self.devices:
+            self.devices.remove(device)
+        for avail_topic in self.avail_topics.pop(device, []):
+            self.mqtt_client.publish(avail_topic, self.config["offline_payload"], retain=True)
+        for config_topic in self.config_topics.pop(device, []):
+            # an empty retained message removes the entity from Home Assistant
+            self.mqtt_client.publish(config_topic, "", retain=True)
+        for command_topic in [topic for topic, target in self.command_topics.items()
+                              if target[0] is device]:
+            self.mqtt_client.unsubscribe(command_topic)
+            del self.command_topics[command_topic]
+        self.state_topics.pop(device, None)
+
     def shutdown(self):
         self.logger.info("shutdown mqtt connection")
-        for avail_topic in self.avail_topics:
-            self.mqtt_client.publish(avail_topic, self.config["offline_payload"], retain=True)
+        for avail_topics in self.avail_topics.values():
+            for avail_topic in avail_topics:
+                self.mqtt_client.publish(avail_topic, self.config["offline_payload"], retain=True)
         self.mqtt_client.disconnect()
         self.mqtt_client.loop_stop()
 
-    def workon(self, device: IoTDeviceBase, data: Dict):
+    def workon(self, device: IoTDeviceBase, data: Dict, timestamp: float = None):
+        # MQTT has no time stamps, the state is always the current one
+
+        if not self.mqtt_client.is_connected():
+            raise IoTBackendUnavailable("not connected to the mqtt server")
 
         if not device in self.state_topics:
             self.logger.error("unknown device")
@@ -121,391 +165,422 @@ class BackendMqttHass(IoTBackendBase):
             self.logger.error("workon(): unknown device type %s", device.conf)
 
 
-    def announce(self):
+    def workon_spooled(self, readings: list):
+        """ MQTT has no time stamps and the states are retained, so replaying every
+        spooled state would publish old ones as current. Only the newest value of
+        each entry is published.
+        """
+        newest = {}
+        for reading in readings:
+            newest.setdefault(reading.device, {}).update(reading.data)
+        for device, data in newest.items():
+            self.workon(device, data)
+
+    def is_available(self) -> bool:
+        """ the network thread of paho reconnects by itself
+        """
+        return self.mqtt_client.is_connected()
 
+    def announce(self):
         for device in self.devices:
+            self.announce_device(device)
 
-            state_topics = {}
-
-            # is it a sensor or a switch
-            if "sensors" in device.conf:
-                # get list of sensors on device
-                sensors = device.conf["sensors"]
-                # create a state topic for everyone
-                try:
-                    sensor_cfg = device.conf["sensors"]
-                    for sensor in sensors:
-                        self.logger.info("mqtt announcing sensor %s", sensor)
-                        try:
-                            sconf = sensor_cfg[sensor]
-                            config_topic = "{}/sensor/{}/{}/config".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"], sensor)
-                            state_topic = "{}/sensor/{}/state".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"])
-                            avail_topic = "{}/sensor/{}/avail".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"])
-                            self.avail_topics.append(avail_topic)
-                            state_topics[sensor] = state_topic
-                            conf_dict = {
-                                "device_class": sconf["device_class"],
-                                "name": sconf["name"],
-                                "unique_id": sconf["unique_id"],
-                                "state_topic": state_topic,
-                                "availability_topic": avail_topic,
-                                "unit_of_measurement": sconf["unit_of_measurement"],
-                                "value_template": "{{ value_json." + sensor + " }}",
-                                "expire_after": sconf["expire_after"],
-                                "payload_available": self.config["online_payload"],
-                                "payload_not_available": self.config["offline_payload"]
-                            }
-                            payload = json.dumps(conf_dict)
-                            self.logger.info("publishing: %s", payload)
-                            result = self.mqtt_client.publish(
-                                config_topic, payload, retain=True)
-                            result = self.mqtt_client.publish(
-                                avail_topic, self.config["online_payload"], retain=True)
-                        except Exception as exception:
-                            self.logger.error("problem 1 bringing sensor %s up: %s",
-                                              sensor, exception)
-                except Exception as exception:
-                    self.logger.error(
-                        "error announcing sensor: %s", exception)
-            elif "switches" in device.conf:
-
-                # get list of switches on device
-                switches = device.sensor_list()
-                # create a state topic for everyone
-                try:
-                    switches_cfg = device.conf["switches"]
-                    for switch in switches:
-                        try:
-                            self.logger.info(
-                                "mqtt announcing switch %s", switch)
-                            sconf = switches_cfg[switch]
-                            config_topic = "{}/switch/{}/{}/config".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"], switch)
-                            state_topic = "{}/switch/{}/state".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"])
-                            avail_topic = "{}/switch/{}/avail".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"])
-                            command_topic = "{}/switch/{}/command".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"])
-                            self.avail_topics.append(avail_topic)
-                            state_topics[switch] = state_topic
-                            conf_dict = {
-                                "name": sconf["name"],
-                                "unique_id": sconf["unique_id"],
-                                "state_topic": state_topic,
-                                "availability_topic": avail_topic,
-                                "command_topic": command_topic,
-                                "value_template": "{{ value_json." + switch + " }}",
-                                "payload_available": self.config["online_payload"],
-                                "payload_not_available": self.config["offline_payload"],
-                                "payload_on": self.config["payload_on"],
-                                "payload_off": self.config["payload_off"],
-                                "state_on": self.config["payload_on"],
-                                "state_off": self.config["payload_off"],
-                                "optimistic": "false",
-                                #"qos": 0,
-                                #"retain": true
-                            }
-                            payload = json.dumps(conf_dict)
-
-                            self.logger.info("publishing: %s", payload)
-                            self.mqtt_client.publish(config_topic, payload, retain=True)
-                            self.mqtt_client.publish(avail_topic,
-                                                     self.config["online_payload"], retain=True)
-
-                            # now subscribe to the command topic
-                            (result, _) = self.mqtt_client.subscribe(
-                                command_topic)
-                            self.logger.info(
-                                "subscription result: %s", result)
-                            self.command_topics[command_topic] = [
-                                device, switch, state_topic
-                            ]
-                        except Exception as exception:
-                            self.logger.error("error announcing switch %s: %s",
-                                              switch, exception)
-                except Exception as exception:
-                    self.logger.error(
-                        "error while registering switch: %s", exception)
-
-            elif "binary-sensors" in device.conf:
-
-                # get list of sensors on device
-                sensors = device.conf["binary-sensors"]
-                # create a state topic for everyone
-                try:
-                    sensor_cfg = device.conf["binary-sensors"]
-                    for sensor in sensors:
-                        self.logger.info("mqtt announcing sensor %s", sensor)
-                        try:
-                            sconf = sensor_cfg[sensor]
-                            config_topic = "{}/binary_sensor/{}/{}/config".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"], sensor)
-                            state_topic = "{}/binary_sensor/{}/state".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"])
-                            avail_topic = "{}/binary_sensor/{}/avail".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"])
-                            self.avail_topics.append(avail_topic)
-                            state_topics[sensor] = state_topic
-                            conf_dict = {
-                                "device_class": sconf["device_class"],
-                                "name": sconf["name"],
-                                "unique_id": sconf["unique_id"],
-                                "state_topic": state_topic,
-                                "availability_topic": avail_topic,
-                                "device_class": sconf["device_class"],
-                                "payload_available": self.config["online_payload"],
-                                "payload_not_available": self.config["offline_payload"]
-                            }
-                            payload = json.dumps(conf_dict)
-                            self.logger.info("publishing: %s", payload)
-                            result = self.mqtt_client.publish(
-                                config_topic, payload, retain=True)
-                            result = self.mqtt_client.publish(
-                                avail_topic, self.config["online_payload"], retain=True)
-                        except Exception as exception:
-                            self.logger.error("problem 2 bringing sensor %s up: %s",
-                                              sensor, exception)
-                except Exception as exception:
-                    self.logger.error(
-                        "error announcing sensor: %s", exception)
-
-            elif "statecovers" in device.conf:
-                # get list of covers on device
-                covers = device.conf["statecovers"]
-                # create a state topic for everyone
-                try:
-                    #cover_cfg = device.conf["statecovers"]
-                    for cover in covers:
-                        self.logger.info("MQTT announcing cover %s", cover)
-                        try:
-                            sconf = covers[cover]
-                            config_topic = "{}/cover/{}/{}/config".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"], cover)
-                            state_topic = "{}/cover/{}/state".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"])
-                            avail_topic = "{}/cover/{}/avail".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"])
-                            command_topic = "{}/cover/{}/command".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"])
-                            self.avail_topics.append(avail_topic)
-                            state_topics[cover] = state_topic
-                            conf_dict = {
-                                "name": sconf["name"],
-                                "unique_id": sconf["unique_id"],
-                                "state_topic": state_topic,
-                                "availability_topic": avail_topic,
-                                "command_topic": command_topic,
-                                "value_template": "{{ value_json." + cover + " }}",
-                                "payload_available": self.config["online_payload"],
-                                "payload_not_available": self.config["offline_payload"],
-                                "state_open": device.conf["state_open"],
-                                "state_opening": device.conf["state_opening"],
-                                "state_closed": device.conf["state_closed"],
-                                "state_closing": device.conf["state_closing"],
-                                "payload_open": device.conf["payload_open"],
-                                "payload_close": device.conf["payload_close"],
-                                "payload_stop": device.conf["payload_stop"],
-                                "optimistic": "false"
-                            }
-                            payload = json.dumps(conf_dict)
-                            self.logger.info("publishing: %s", payload)
-                            result = self.mqtt_client.publish(
-                                config_topic, payload, retain=True)
-                            result = self.mqtt_client.publish(
-                                avail_topic, self.config["online_payload"], retain=True)
-                            # now subscribe to the command topic
-                            (result, _) = self.mqtt_client.subscribe(
-                                command_topic)
-                            self.logger.info(
-                                "subscription result: %s", result)
-                            self.command_topics[command_topic] = [
-                                device, cover, state_topic
-                            ]
-
-                        except Exception as exception:
-                            self.logger.error("problem 3 bringing cover %s up: %s",
-                                              cover, exception)
-                except Exception as exception:
-                    self.logger.error(
-                        "error announcing statecovers: %s", exception)
-
-            elif "poscovers" in device.conf:
-
-                # get list of covers on device
-                covers = device.conf["poscovers"]
-                # create a state topic for everyone
-                try:
-                    #cover_cfg = device.conf["poscovers"]
-
-                    for cover in covers:
-                        self.logger.info("MQTT announcing positional cover %s", cover)
-                        try:
-                            sconf = covers[cover]
-
-                            config_topic = "{}/cover/{}/{}/config".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"], cover)
-                            state_topic = "{}/cover/{}/state".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"])
-                            position_topic = "{}/cover/{}/position".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"])
-                            set_position_topic = "{}/cover/{}/set_position".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"])
-                            avail_topic = "{}/cover/{}/avail".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"])
-                            command_topic = "{}/cover/{}/command".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"])
-                            self.avail_topics.append(avail_topic)
-                            state_topics[cover] = position_topic
-                            conf_dict = {
-                                "name": sconf["name"],
-                                "unique_id": sconf["unique_id"],
-                                "state_topic": state_topic,
-                                "position_topic": position_topic,
-                                "set_position_topic": set_position_topic,
-                                "availability_topic": avail_topic,
-                                "command_topic": command_topic,
-                                "value_template": "{{ value_json." + cover + " }}",
-                                "payload_available": self.config["online_payload"],
-                                "payload_not_available": self.config["offline_payload"],
-                                "position_open": 100,
-                                "position_closed": 0,
-                                "payload_open": sconf["payload_open"],
-                                "payload_close": sconf["payload_close"],
-                                "payload_stop": sconf["payload_stop"],
-                                "optimistic": "false"
-                            }
-                            payload = json.dumps(conf_dict)
-                            self.logger.info("publishing: %s", payload)
-                            result = self.mqtt_client.publish(
-                                config_topic, payload, retain=True)
-                            result = self.mqtt_client.publish(
-                                avail_topic, self.config["online_payload"], retain=True)
-
-                            # now subscribe to the command topic
-                            (result, _) = self.mqtt_client.subscribe(command_topic)
-                            self.logger.info("subscription result: %s", result)
-                            self.command_topics[command_topic] = [device, cover, position_topic]
-
-                            # now subscribe to the set_position topic
-                            (result, _) = self.mqtt_client.subscribe(set_position_topic)
-                            self.logger.info("subscription result: %s", result)
-                            self.command_topics[set_position_topic] = [device, cover, position_topic]
-
-                        except Exception as exception:
-                            self.logger.error("problem 4 bringing poscover %s up: %s",
-                                              cover, exception)
-                except Exception as exception:
-                    self.logger.error(
-                        "error announcing poscovers: %s", exception)
-
-            elif "pwmlights" in device.conf:
-
-                # get list of lights on device
-                lights = device.conf["pwmlights"]
-                # create a state topic for everyone
-                try:
-                    #cover_cfg = device.conf["poscovers"]
-
-                    for light in lights:
-                        self.logger.info("MQTT announcing pwm light %s", light)
-                        try:
-                            sconf = lights[light]
-
-                            config_topic = "{}/light/{}/{}/config".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"], light)
-
-                            state_topic= "{}/light/{}/status".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"])
-                            command_topic = "{}/light/{}/switch".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"])
-                            brightness_state_topic= "{}/light/{}/brightness".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"])
-                            brightness_command_topic= "{}/light/{}/brightness/set".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"])
-
-                            avail_topic = "{}/light/{}/avail".format(
-                                self.config["hass_discovery_prefix"],
-                                sconf["unique_id"])
-
-                            self.avail_topics.append(avail_topic)
-                            state_topics[light]= state_topic
-
-                            conf_dict = {
-                                "name": sconf["name"],
-                                "unique_id": sconf["unique_id"],
-                                "state_topic": state_topic,
-                                "command_topic": command_topic,
-                                "brightness_state_topic": brightness_state_topic,
-                                "brightness_command_topic": brightness_command_topic,
-                                "value_template": "{{ value_json." + light + " }}",
-                                "qos": 0,
-                                "payload_on": "ON",
-                                "payload_off": "OFF",
-                                "optimistic": "true"
-                            }
-                            payload = json.dumps(conf_dict)
-                            self.logger.info("publishing: %s", payload)
-                            result = self.mqtt_client.publish(
-                                config_topic, payload, retain=True)
-                            result = self.mqtt_client.publish(
-                                avail_topic, self.config["online_payload"], retain=True)
-
-                            # subscribe to the command topic
-                            (result, _) = self.mqtt_client.subscribe(command_topic)
-                            self.logger.info("subscription result: %s", result)
-                            self.command_topics[command_topic] = [device, light, command_topic]
-
-                            # subscribe to the brightness_state_topic
-                            (result, _) = self.mqtt_client.subscribe(brightness_state_topic)
-                            self.logger.info("subscription result: %s", result)
-                            self.command_topics[brightness_state_topic] = [device, light, brightness_state_topic]
-
-                            # subscribe to the brightness_command_topic
-                            (result, _) = self.mqtt_client.subscribe(brightness_command_topic)
-                            self.logger.info("subscription result: %s", result)
-                            self.command_topics[brightness_command_topic] = [device, light, brightness_command_topic]
-
-                        except Exception as exception:
-                            self.logger.error("problem 4 bringing pwmlight %s up: %s",
-                                              light, exception)
-                except Exception as exception:
-                    self.logger.error(
-                        "error announcing pwmlights: %s", exception)
+    def announce_device(self, device: IoTDeviceBase) -> None:
+        """ publish the discovery config of one device and subscribe to its command topics
+        """
+        state_topics = {}
+        avail_topics = []
+        config_topics = []
 
-            else:
-                self.logger.error("announce(): unknown device type %s", device.conf)
+        # is it a sensor or a switch
+        if "sensors" in device.conf:
+            # get list of sensors on device
+            sensors = device.conf["sensors"]
+            # create a state topic for everyone
+            try:
+                sensor_cfg = device.conf["sensors"]
+                for sensor in sensors:
+                    self.logger.info("mqtt announcing sensor %s", sensor)
+                    try:
+                        sconf = sensor_cfg[sensor]
+                        config_topic = "{}/sensor/{}/{}/config".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"], sensor)
+                        state_topic = "{}/sensor/{}/state".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"])
+                        avail_topic = "{}/sensor/{}/avail".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"])
+                        avail_topics.append(avail_topic)
+                        config_topics.append(config_topic)
+                        state_topics[sensor] = state_topic
+                        conf_dict = {
+                            "name": sconf["name"],
+                            "unique_id": sconf["unique_id"],
+                            "state_topic": state_topic,
+                            "availability_topic": avail_topic,
+                            "value_template": "{{ value_json." + sensor + " }}",
+                            "payload_available": self.config["online_payload"],
+                            "payload_not_available": self.config["offline_payload"]
+                        }
+                        # optional in the config, home assistant has defaults
+                        for key in ("device_class", "unit_of_measurement", "expire_after"):
+                            if key in sconf:
+                                conf_dict[key] = sconf[key]
+                        payload = json.dumps(conf_dict)
+                        self.logger.info("publishing: %s", payload)
+                        result = self.mqtt_client.publish(
+                            config_topic, payload, retain=True)
+                        result = self.mqtt_client.publish(
+                            avail_topic, self.config["online_payload"], retain=True)
+                    except Exception as exception:
+                        self.logger.error("problem 1 bringing sensor %s up: %s",
+                                          sensor, exception)
+            except Exception as exception:
+                self.logger.error(
+                    "error announcing sensor: %s", exception)
+        elif "switches" in device.conf:
+
+            # get list of switches on device
+            switches = device.sensor_list()
+            # create a state topic for everyone
+            try:
+                switches_cfg = device.conf["switches"]
+                for switch in switches:
+                    try:
+                        self.logger.info(
+                            "mqtt announcing switch %s", switch)
+                        sconf = switches_cfg[switch]
+                        config_topic = "{}/switch/{}/{}/config".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"], switch)
+                        state_topic = "{}/switch/{}/state".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"])
+                        avail_topic = "{}/switch/{}/avail".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"])
+                        command_topic = "{}/switch/{}/command".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"])
+                        avail_topics.append(avail_topic)
+                        config_topics.append(config_topic)
+                        state_topics[switch] = state_topic
+                        conf_dict = {
+                            "name": sconf["name"],
+                            "unique_id": sconf["unique_id"],
+                            "state_topic": state_topic,
+                            "availability_topic": avail_topic,
+                            "command_topic": command_topic,
+                            "value_template": "{{ value_json." + switch + " }}",
+                            "payload_available": self.config["online_payload"],
+                            "payload_not_available": self.config["offline_payload"],
+                            "payload_on": self.config["payload_on"],
+                            "payload_off": self.config["payload_off"],
+                            "state_on": self.config["payload_on"],
+                            "state_off": self.config["payload_off"],
+                            "optimistic": "false",
+                            #"qos": 0,
+                            #"retain": true
+                        }
+                        payload = json.dumps(conf_dict)
+
+                        self.logger.info("publishing: %s", payload)
+                        self.mqtt_client.publish(config_topic, payload, retain=True)
+                        self.mqtt_client.publish(avail_topic,
+                                                 self.config["online_payload"], retain=True)
+
+                        # now subscribe to the command topic
+                        (result, _) = self.mqtt_client.subscribe(
+                            command_topic)
+                        self.logger.info(
+                            "subscription result: %s", result)
+                        self.command_topics[command_topic] = [
+                            device, switch, state_topic
+                        ]
+                    except Exception as exception:
+                        self.logger.error("error announcing switch %s: %s",
+                                          switch, exception)
+            except Exception as exception:
+                self.logger.error(
+                    "error while registering switch: %s", exception)
+
+        elif "binary-sensors" in device.conf:
+
+            # get list of sensors on device
+            sensors = device.conf["binary-sensors"]
+            # create a state topic for everyone
+            try:
+                sensor_cfg = device.conf["binary-sensors"]
+                for sensor in sensors:
+                    self.logger.info("mqtt announcing sensor %s", sensor)
+                    try:
+                        sconf = sensor_cfg[sensor]
+                        config_topic = "{}/binary_sensor/{}/{}/config".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"], sensor)
+                        state_topic = "{}/binary_sensor/{}/state".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"])
+                        avail_topic = "{}/binary_sensor/{}/avail".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"])
+                        avail_topics.append(avail_topic)
+                        config_topics.append(config_topic)
+                        state_topics[sensor] = state_topic
+                        conf_dict = {
+                            "name": sconf["name"],
+                            "unique_id": sconf["unique_id"],
+                            "state_topic": state_topic,
+                            "availability_topic": avail_topic,
+                            "payload_available": self.config["online_payload"],
+                            "payload_not_available": self.config["offline_payload"]
+                        }
+                        if "device_class" in sconf:
+                            conf_dict["device_class"] = sconf["device_class"]
+                        payload = json.dumps(conf_dict)
+                        self.logger.info("publishing: %s", payload)
+                        result = self.mqtt_client.publish(
+                            config_topic, payload, retain=True)
+                        result = self.mqtt_client.publish(
+                            avail_topic, self.config["online_payload"], retain=True)
+                    except Exception as exception:
+                        self.logger.error("problem 2 bringing sensor %s up: %s",
+                                          sensor, exception)
+            except Exception as exception:
+                self.logger.error(
+                    "error announcing sensor: %s", exception)
+
+        elif "statecovers" in device.conf:
+            # get list of covers on device
+            covers = device.conf["statecovers"]
+            # create a state topic for everyone
+            try:
+                #cover_cfg = device.conf["statecovers"]
+                for cover in covers:
+                    self.logger.info("MQTT announcing cover %s", cover)
+                    try:
+                        sconf = covers[cover]
+                        config_topic = "{}/cover/{}/{}/config".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"], cover)
+                        state_topic = "{}/cover/{}/state".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"])
+                        avail_topic = "{}/cover/{}/avail".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"])
+                        command_topic = "{}/cover/{}/command".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"])
+                        avail_topics.append(avail_topic)
+                        config_topics.append(config_topic)
+                        state_topics[cover] = state_topic
+                        conf_dict = {
+                            "name": sconf["name"],
+                            "unique_id": sconf["unique_id"],
+                            "state_topic": state_topic,
+                            "availability_topic": avail_topic,
+                            "command_topic": command_topic,
+                            "value_template": "{{ value_json." + cover + " }}",
+                            "payload_available": self.config["online_payload"],
+                            "payload_not_available": self.config["offline_payload"],
+                            "state_open": device.conf["state_open"],
+                            "state_opening": device.conf["state_opening"],
+                            "state_closed": device.conf["state_closed"],
+                            "state_closing": device.conf["state_closing"],
+                            "payload_open": device.conf["payload_open"],
+                            "payload_close": device.conf["payload_close"],
+                            "payload_stop": device.conf["payload_stop"],
+                            "optimistic": "false"
+                        }
+                        payload = json.dumps(conf_dict)
+                        self.logger.info("publishing: %s", payload)
+                        result = self.mqtt_client.publish(
+                            config_topic, payload, retain=True)
+                        result = self.mqtt_client.publish(
+                            avail_topic, self.config["online_payload"], retain=True)
+                        # now subscribe to the command topic
+                        (result, _) = self.mqtt_client.subscribe(
+                            command_topic)
+                        self.logger.info(
+                            "subscription result: %s", result)
+                        self.command_topics[command_topic] = [
+                            device, cover, state_topic
+                        ]
+
+                    except Exception as exception:
+                        self.logger.error("problem 3 bringing cover %s up: %s",
+                                          cover, exception)
+            except Exception as exception:
+                self.logger.error(
+                    "error announcing statecovers: %s", exception)
+
+        elif "poscovers" in device.conf:
+
+            # get list of covers on device
+            covers = device.conf["poscovers"]
+            # create a state topic for everyone
+            try:
+                #cover_cfg = device.conf["poscovers"]
+
+                for cover in covers:
+                    self.logger.info("MQTT announcing positional cover %s", cover)
+                    try:
+                        sconf = covers[cover]
+
+                        config_topic = "{}/cover/{}/{}/config".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"], cover)
+                        state_topic = "{}/cover/{}/state".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"])
+                        position_topic = "{}/cover/{}/position".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"])
+                        set_position_topic = "{}/cover/{}/set_position".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"])
+                        avail_topic = "{}/cover/{}/avail".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"])
+                        command_topic = "{}/cover/{}/command".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"])
+                        avail_topics.append(avail_topic)
+                        config_topics.append(config_topic)
+                        state_topics[cover] = position_topic
+                        conf_dict = {
+                            "name": sconf["name"],
+                            "unique_id": sconf["unique_id"],
+                            "state_topic": state_topic,
+                            "position_topic": position_topic,
+                            "set_position_topic": set_position_topic,
+                            "availability_topic": avail_topic,
+                            "command_topic": command_topic,
+                            "value_template": "{{ value_json." + cover + " }}",
+                            "payload_available": self.config["online_payload"],
+                            "payload_not_available": self.config["offline_payload"],
+                            "position_open": 100,
+                            "position_closed": 0,
+                            "payload_open": sconf["payload_open"],
+                            "payload_close": sconf["payload_close"],
+                            "payload_stop": sconf["payload_stop"],
+                            "optimistic": "false"
+                        }
+                        payload = json.dumps(conf_dict)
+                        self.logger.info("publishing: %s", payload)
+                        result = self.mqtt_client.publish(
+                            config_topic, payload, retain=True)
+                        result = self.mqtt_client.publish(
+                            avail_topic, self.config["online_payload"], retain=True)
+
+                        # now subscribe to the command topic
+                        (result, _) = self.mqtt_client.subscribe(command_topic)
+                        self.logger.info("subscription result: %s", result)
+                        self.command_topics[command_topic] = [device, cover, position_topic]
+
+                        # now subscribe to the set_position topic
+                        (result, _) = self.mqtt_client.subscribe(set_position_topic)
+                        self.logger.info("subscription result: %s", result)
+                        self.command_topics[set_position_topic] = [device, cover, position_topic]
+
+                    except Exception as exception:
+                        self.logger.error("problem 4 bringing poscover %s up: %s",
+                                          cover, exception)
+            except Exception as exception:
+                self.logger.error(
+                    "error announcing poscovers: %s", exception)
+
+        elif "pwmlights" in device.conf:
+
+            # get list of lights on device
+            lights = device.conf["pwmlights"]
+            # create a state topic for everyone
+            try:
+                #cover_cfg = device.conf["poscovers"]
+
+                for light in lights:
+                    self.logger.info("MQTT announcing pwm light %s", light)
+                    try:
+                        sconf = lights[light]
+
+                        config_topic = "{}/light/{}/{}/config".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"], light)
+
+                        state_topic= "{}/light/{}/status".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"])
+                        command_topic = "{}/light/{}/switch".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"])
+                        brightness_state_topic= "{}/light/{}/brightness".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"])
+                        brightness_command_topic= "{}/light/{}/brightness/set".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"])
+
+                        avail_topic = "{}/light/{}/avail".format(
+                            self.config["hass_discovery_prefix"],
+                            sconf["unique_id"])
+
+                        avail_topics.append(avail_topic)
+                        config_topics.append(config_topic)
+                        state_topics[light]= state_topic
+
+                        conf_dict = {
+                            "name": sconf["name"],
+                            "unique_id": sconf["unique_id"],
+                            "state_topic": state_topic,
+                            "command_topic": command_topic,
+                            "brightness_state_topic": brightness_state_topic,
+                            "brightness_command_topic": brightness_command_topic,
+                            "value_template": "{{ value_json." + light + " }}",
+                            "qos": 0,
+                            "payload_on": "ON",
+                            "payload_off": "OFF",
+                            "optimistic": "true"
+                        }
+                        payload = json.dumps(conf_dict)
+                        self.logger.info("publishing: %s", payload)
+                        result = self.mqtt_client.publish(
+                            config_topic, payload, retain=True)
+                        result = self.mqtt_client.publish(
+                            avail_topic, self.config["online_payload"], retain=True)
+
+                        # subscribe to the command topic
+                        (result, _) = self.mqtt_client.subscribe(command_topic)
+                        self.logger.info("subscription result: %s", result)
+                        self.command_topics[command_topic] = [device, light, command_topic]
+
+                        # subscribe to the brightness_state_topic
+                        (result, _) = self.mqtt_client.subscribe(brightness_state_topic)
+                        self.logger.info("subscription result: %s", result)
+                        self.command_topics[brightness_state_topic] = [device, light, brightness_state_topic]
+
+                        # subscribe to the brightness_command_topic
+                        (result, _) = self.mqtt_client.subscribe(brightness_command_topic)
+                        self.logger.info("subscription result: %s", result)
+                        self.command_topics[brightness_command_topic] = [device, light, brightness_command_topic]
+
+                    except Exception as exception:
+                        self.logger.error("problem 4 bringing pwmlight %s up: %s",
+                                          light, exception)
+            except Exception as exception:
+                self.logger.error(
+                    "error announcing pwmlights: %s", exception)
+
+        else:
+            self.logger.error("announce(): unknown device type %s", device.conf)
 
-            # finally add device's state topics list to permanent list
-            self.state_topics[device] = state_topics
+        # finally add device's topics to the permanent lists, replacing the ones of
+        # an earlier announcement after a reconnect
+        self.state_topics[device] = state_topics
+        self.avail_topics[device] = avail_topics
+        self.config_topics[device] = config_topics
 
     # The callback for when the client receives a CONNACK response from the server.
 
@@ -523,11 +598,15 @@ class BackendMqttHass(IoTBackendBase):
         """ callback from mqtt in case message arrives
         """
 
-        if msg.topic in self.command_topics:
+        # the device might be removed meanwhile by a reload of the config
+        target = self.command_topics.get(msg.topic, None)
+        if target is not None:
             payload = msg.payload.decode("utf-8")
-            [device, switch, state_topic] = self.command_topics[msg.topic]
+            [device, switch, state_topic] = target
             self.logger.debug("calling device %s, switch %s with %s",
                               device, switch, payload)
+            if device.runtime is not None:
+                device.runtime.record_command(device, switch, payload)
             if device.set_state({switch: payload}):
                 self.mqtt_client.publish(state_topic, payload)
 
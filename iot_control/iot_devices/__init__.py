@@ -1,9 +1,3 @@
-""" trying to load all devices at once
-    not working yet
+""" the devices, their modules are imported by IoTFactory when a device
+    of their kind is in the config file
 """
-
-from os.path import dirname, basename, isfile, join
-import glob
-modules = glob.glob(join(dirname(__file__), "*.py"))
-__all__ = [basename(f)[:-3] for f in modules if isfile(f)
-           and not f.endswith('__init__.py')]
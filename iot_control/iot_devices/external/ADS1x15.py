@@ -21,8 +21,16 @@
 
 # Slightly modified by Aegidius Pluess (www.aplu.ch), to remove references to other modules
 
+import threading
 import time
-import smbus
+from iot_control.iotbus import IoTBusManager
+from iot_control.iothardware import GPIO
+
+try:
+    import numpy
+except ImportError:
+    # read_many() and to_volts() return lists then
+    numpy = None
 
 # Register and other configuration values:
 ADS1x15_DEFAULT_ADDRESS        = 0x48
@@ -31,6 +39,8 @@ ADS1x15_POINTER_CONFIG         = 0x01
 ADS1x15_POINTER_LOW_THRESHOLD  = 0x02
 ADS1x15_POINTER_HIGH_THRESHOLD = 0x03
 ADS1x15_CONFIG_OS_SINGLE       = 0x8000
+# Reading the OS bit as 1 means no conversion is running.
+ADS1x15_CONFIG_OS_READY        = 0x8000
 ADS1x15_CONFIG_MUX_OFFSET      = 12
 # Maping of gain values to config register values.
 ADS1x15_CONFIG_GAIN = {
@@ -41,6 +51,22 @@ ADS1x15_CONFIG_GAIN = {
     8:   0x0800,
     16:  0x0A00
 }
+# Full scale range in volt of the gain values.
+ADS1x15_FULL_SCALE = {
+    2/3: 6.144,
+    1:   4.096,
+    2:   2.048,
+    4:   1.024,
+    8:   0.512,
+    16:  0.256
+}
+# Differential mux values of (positive, negative) channels.
+ADS1x15_DIFFERENTIAL = {
+    (0, 1): 0,
+    (0, 3): 1,
+    (1, 3): 2,
+    (2, 3): 3
+}
 ADS1x15_CONFIG_MODE_CONTINUOUS  = 0x0000
 ADS1x15_CONFIG_MODE_SINGLE      = 0x0100
 # Mapping of data/sample rate to config register values for ADS1015 (faster).
@@ -78,9 +104,61 @@ ADS1x15_CONFIG_COMP_QUE_DISABLE = 0x0003
 class ADS1x15(object):
     """Base functionality for ADS1x15 analog to digital converters."""
 
-    def __init__(self, address = ADS1x15_DEFAULT_ADDRESS, busnum = 1):
+    def __init__(self, address = ADS1x15_DEFAULT_ADDRESS, busnum = 1,
+                 ready_pin = None, poll_ready = True):
+        """The end of a conversion is detected with the ALERT/RDY pin if it is
+        wired to the GPIO ready_pin, else by polling the OS bit of the config
+        register with poll_ready (single shot conversions only), else by
+        sleeping the nominal conversion time.
+        """
         self._address = address
-        self._bus = smbus.SMBus(busnum)
+        self._bus = IoTBusManager.bus(busnum)
+        self._poll_ready = poll_ready
+        self._ready_pin = ready_pin
+        # Set by the GPIO callback when ALERT/RDY signals a finished conversion.
+        self._ready = threading.Event()
+        # The threshold registers are set up for ALERT/RDY as ready signal.
+        self._ready_thresholds = False
+        if ready_pin is not None:
+            GPIO.setmode(GPIO.BCM)
+            GPIO.setwarnings(False)
+            # ALERT/RDY is open drain and active low by default.
+            GPIO.setup(ready_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+            GPIO.add_event_detect(ready_pin, GPIO.FALLING, callback=self._ready_edge)
+
+    def _ready_edge(self, pin):
+        """GPIO callback for the falling edge of ALERT/RDY."""
+        self._ready.set()
+
+    def _wait_ready(self, data_rate, mode, use_pin):
+        """Wait until the conversion started last is finished, by the ALERT/RDY
+        pin if use_pin, else by polling the OS bit for single shot conversions,
+        else by sleeping the conversion time plus a small offset.
+        """
+        conversion = 1.0/data_rate
+        if use_pin:
+            if self._ready.wait(2*conversion+0.01):
+                return
+            # Missed the edge, find out by polling.
+        if self._poll_ready and mode == ADS1x15_CONFIG_MODE_SINGLE:
+            # The internal oscillator may be up to 10% fast, sleep most of the
+            # conversion time and poll for the rest.
+            time.sleep(0.85*conversion)
+            deadline = time.monotonic() + 2*conversion + 0.01
+            while not self.readList(ADS1x15_POINTER_CONFIG, 2)[0] & (ADS1x15_CONFIG_OS_READY >> 8):
+                if time.monotonic() > deadline:
+                    raise TimeoutError('ADC conversion not finished in time')
+                time.sleep(0.0001)
+            return
+        # Wait for the ADC sample to finish based on the sample rate plus a
+        # small offset to be sure (0.1 millisecond).
+        time.sleep(conversion+0.0001)
+
+    def _full_scale_counts(self):
+        """Subclasses should override this function and return the value of a
+        conversion at the positive end of the full scale range.
+        """
+        raise NotImplementedError('Subclass must implement _full_scale_counts function!')
 
     def _data_rate_default(self):
         """Retrieve the default data rate for this ADC (in samples per second).
@@ -123,13 +201,22 @@ class ADS1x15(object):
         # Set the data rate (this is controlled by the subclass as it differs
         # between ADS1015 and ADS1115).
         config |= self._data_rate_config(data_rate)
-        config |= ADS1x15_CONFIG_COMP_QUE_DISABLE  # Disble comparator mode.
+        use_pin = self._ready_pin is not None
+        if use_pin:
+            if not self._ready_thresholds:
+                # A most significant bit of 1 in the high and 0 in the low
+                # threshold turns ALERT/RDY into the conversion ready signal.
+                self.writeList(ADS1x15_POINTER_HIGH_THRESHOLD, [0x80, 0x00])
+                self.writeList(ADS1x15_POINTER_LOW_THRESHOLD, [0x00, 0x00])
+                self._ready_thresholds = True
+            config |= ADS1x15_CONFIG_COMP_QUE[1]
+            self._ready.clear()
+        else:
+            config |= ADS1x15_CONFIG_COMP_QUE_DISABLE  # Disble comparator mode.
         # Send the config value to start the ADC conversion.
         # Explicitly break the 16-bit value down to a big endian pair of bytes.
         self.writeList(ADS1x15_POINTER_CONFIG, [(config >> 8) & 0xFF, config & 0xFF])
-        # Wait for the ADC sample to finish based on the sample rate plus a
-        # small offset to be sure (0.1 millisecond).
-        time.sleep(1.0/data_rate+0.0001)
+        self._wait_ready(data_rate, mode, use_pin)
         # Retrieve the result.
         result = self.readList(ADS1x15_POINTER_CONVERSION, 2)
         return self._conversion_value(result[1], result[0])
@@ -143,6 +230,7 @@ class ADS1x15(object):
         """
         assert num_readings == 1 or num_readings == 2 or num_readings == 4, 'Num readings must be 1, 2, or 4!'
         # Set high and low threshold register values.
+        self._ready_thresholds = False
         self.writeList(ADS1x15_POINTER_HIGH_THRESHOLD, [(high_threshold >> 8) & 0xFF, high_threshold & 0xFF])
         self.writeList(ADS1x15_POINTER_LOW_THRESHOLD, [(low_threshold >> 8) & 0xFF, low_threshold & 0xFF])
         # Now build up the appropriate config register value.
@@ -176,9 +264,8 @@ class ADS1x15(object):
         # Send the config value to start the ADC conversion.
         # Explicitly break the 16-bit value down to a big endian pair of bytes.
         self.writeList(ADS1x15_POINTER_CONFIG, [(config >> 8) & 0xFF, config & 0xFF])
-        # Wait for the ADC sample to finish based on the sample rate plus a
-        # small offset to be sure (0.1 millisecond).
-        time.sleep(1.0/data_rate+0.0001)
+        # The comparator drives ALERT/RDY now.
+        self._wait_ready(data_rate, mode, False)
         # Retrieve the result.
         result = self.readList(ADS1x15_POINTER_CONVERSION, 2)
         return self._conversion_value(result[1], result[0])
@@ -222,6 +309,46 @@ class ADS1x15(object):
         # as the mux value (which will enable differential mode).
         return self._read(differential, gain, data_rate, ADS1x15_CONFIG_MODE_SINGLE)
 
+    def read_many(self, channels, gain=1, data_rate=None):
+        """Read the channels in the list one after the other with single shot
+        conversions and return their voltages, as numpy array if numpy is
+        installed, else as list.  A channel is 0-3 for a single ended read, or a
+        tuple of two channels for a differential read: (0, 1), (0, 3), (1, 3) or
+        (2, 3).  gain is one gain for all channels or a list with one per channel.
+        """
+        gains = gain if isinstance(gain, (list, tuple)) else [gain] * len(channels)
+        raw = []
+        for channel, channel_gain in zip(channels, gains):
+            if isinstance(channel, tuple):
+                if channel not in ADS1x15_DIFFERENTIAL:
+                    raise ValueError('Differential must be one of: (0, 1), (0, 3), (1, 3), (2, 3)')
+                mux = ADS1x15_DIFFERENTIAL[channel]
+            else:
+                assert 0 <= channel <= 3, 'Channel must be a value within 0-3!'
+                mux = channel + 0x04
+            raw.append(self._read(mux, channel_gain, data_rate, ADS1x15_CONFIG_MODE_SINGLE))
+        return self.to_volts(raw, gains)
+
+    def to_volts(self, raw, gain=1):
+        """Convert a list of conversion results to volts in one step.  gain is
+        the gain they were read with, one for all or a list with one per value.
+        Returns a numpy array if numpy is installed, else a list.
+        """
+        counts = float(self._full_scale_counts())
+        if isinstance(gain, (list, tuple)):
+            if any(g not in ADS1x15_FULL_SCALE for g in gain):
+                raise ValueError('Gain must be one of: 2/3, 1, 2, 4, 8, 16')
+            scale = [ADS1x15_FULL_SCALE[g] / counts for g in gain]
+        else:
+            if gain not in ADS1x15_FULL_SCALE:
+                raise ValueError('Gain must be one of: 2/3, 1, 2, 4, 8, 16')
+            scale = ADS1x15_FULL_SCALE[gain] / counts
+        if numpy is not None:
+            return numpy.asarray(raw, dtype=float) * numpy.asarray(scale)
+        if isinstance(scale, list):
+            return [r * s for r, s in zip(raw, scale)]
+        return [r * scale for r in raw]
+
     def start_adc(self, channel, gain=1, data_rate=None):
         """Start continuous ADC conversions on the specified channel (0-3). Will
         return an initial conversion result, then call the get_last_result()
@@ -346,6 +473,12 @@ class ADS1x15(object):
         result = self.readList(ADS1x15_POINTER_CONVERSION, 2)
         return self._conversion_value(result[1], result[0])
 
+    def close(self):
+        """Stop watching the ALERT/RDY pin, so it can be set up again."""
+        if self._ready_pin is not None:
+            GPIO.remove_event_detect(self._ready_pin)
+            self._ready_pin = None
+
     def readList(self, register, length):
         """Read a length number of bytes from the specified register.  Results
         will be returned as a bytearray."""
@@ -373,6 +506,9 @@ class ADS1115(ADS1x15):
             raise ValueError('Data rate must be one of: 8, 16, 32, 64, 128, 250, 475, 860')
         return ADS1115_CONFIG_DR[data_rate]
 
+    def _full_scale_counts(self):
+        return 32768
+
     def _conversion_value(self, low, high):
         # Convert to 16-bit signed value.
         value = ((high & 0xFF) << 8) | (low & 0xFF)
@@ -396,6 +532,9 @@ class ADS1015(ADS1x15):
             raise ValueError('Data rate must be one of: 128, 250, 490, 920, 1600, 2400, 3300')
         return ADS1015_CONFIG_DR[data_rate]
 
+    def _full_scale_counts(self):
+        return 2048
+
     def _conversion_value(self, low, high):
         # Convert to 12-bit signed value.
         value = ((high & 0xFF) << 4) | ((low & 0xFF) >> 4)
@@ -5,40 +5,258 @@
 """
 
 from typing import Dict
-from iot_control.iotdevicebase import IoTDeviceBase
+import collections
+import logging
+import statistics
+import threading
+from iot_control.iothardware import GPIO
+from iot_control.iotdevicebase import IoTDeviceBase, IoTConfigError
 from iot_control.iotfactory import IoTFactory
-from iot_control.iot_devices.external.ADS1x15 import ADS1115
+from iot_control.iotconfig import IoTConfigField, IoTConfigEntries, SENSOR_FIELDS, NUMBER
+from iot_control.iot_devices.external.ADS1x15 import ADS1115, ADS1115_CONFIG_DR, \
+    ADS1x15_FULL_SCALE, ADS1x15_DIFFERENTIAL
+
+# gain of the driver for the full scale range in volt
+FULL_SCALE = {volts: gain for gain, volts in ADS1x15_FULL_SCALE.items()}
+AGGREGATES = {
+    "mean": statistics.fmean,
+    "median": statistics.median,
+    "last": lambda samples: samples[-1],
+}
+
+
+class IoTads1115Input:
+    """ one sampled input of the ADS1115 with a ring buffer of its last samples
+
+    Args:
+        channel (int): the input 0 to 3
+        minus (int): the negative input for a differential measurement, or None
+        full_scale (float): the full scale range in volt
+        samples (int): size of the ring buffer
+    """
+
+    def __init__(self, channel: int, minus: int, full_scale: float, samples: int):
+        # as read_many() of the driver takes it
+        self.channel = channel if minus is None else (channel, minus)
+        self.full_scale = full_scale
+        self.gain = FULL_SCALE[full_scale]
+        self.buffer = collections.deque(maxlen=samples)
 
 
 @IoTFactory.register_device("ads1115")
 class IoTads1115(IoTDeviceBase):
-    """ ADS1115 sensor class
+    """ ADS1115 sensor class. A background thread converts the inputs of all
+        sensors in turn at 'data_rate' samples per second and keeps the last
+        'samples' values of each one in a ring buffer. A read doesn't touch the bus,
+        it publishes the mean, the median or the last value of the buffer of each
+        sensor, so noisy inputs like soil moisture probes are averaged over hundreds
+        of samples without blocking the runtime.
+
+        A sensor measures 'channel' against ground or, with 'minus', the difference
+        of two inputs (0-1, 0-3, 1-3 or 2-3), in the range +/- 'full_scale' volt.
+
+        The end of a conversion is signalled by the ALERT/RDY pin if it is wired to
+        the GPIO 'alert_pin', else the driver polls the chip for it, which gets close
+        to the 860 samples per second the chip can do.
+
+        With 'mode: threshold' nothing is sampled. The chip converts the input of the
+        one sensor continuously and its comparator drives ALERT/RDY when the value
+        rises above 'high' (until it falls below 'low') or, with 'comparator: window',
+        while it is outside of 'low' to 'high'. Each change of the pin triggers an
+        update, so level or leak detectors are published when it matters without
+        polling. A read only fetches the last conversion.
     """
 
+    config_schema = {
+        "port": IoTConfigField(int, default=1),
+        "i2c_address": IoTConfigField(int, default=0x48),
+        "data_rate": IoTConfigField(int, default=128, choices=tuple(ADS1115_CONFIG_DR)),
+        "samples": IoTConfigField(int, default=100),
+        # optional pause after converting all inputs, in seconds
+        "sample_interval": IoTConfigField(NUMBER, default=0),
+        # optional GPIO pin (BCM number) ALERT/RDY is wired to
+        "alert_pin": IoTConfigField(int, required=False),
+        "mode": IoTConfigField(str, default="sampling", choices=("sampling", "threshold")),
+        "sensors": IoTConfigEntries(dict(SENSOR_FIELDS, **{
+            "channel": IoTConfigField(int, default=0, choices=(0, 1, 2, 3)),
+            "minus": IoTConfigField(int, required=False, choices=(1, 3)),
+            "full_scale": IoTConfigField(NUMBER, default=4.096, choices=tuple(FULL_SCALE)),
+            "aggregate": IoTConfigField(str, default="mean", choices=tuple(AGGREGATES)),
+            # thresholds in volt for the threshold mode
+            "high": IoTConfigField(NUMBER, required=False),
+            "low": IoTConfigField(NUMBER, required=False),
+            "comparator": IoTConfigField(str, default="traditional",
+                                         choices=("traditional", "window")),
+            # conversions beyond the threshold before the alert
+            "readings": IoTConfigField(int, default=1, choices=(1, 2, 4)),
+        })),
+    }
+
     def __init__(self, **kwargs):
         super().__init__()
         setupdata = kwargs.get("config")
         self.conf = setupdata
-        # Import the ADS1115 module.
-        self.adc = ADS1115()
+        self.logger = logging.getLogger("iot_control")
+        self.port = setupdata.get("port", 1)
+        self.alert_pin = setupdata.get("alert_pin", None)
+        self.threshold = "threshold" == setupdata.get("mode", "sampling")
+        # in threshold mode ALERT/RDY belongs to the comparator
+        self.adc = ADS1115(address=setupdata.get("i2c_address", 0x48), busnum=self.port,
+                           ready_pin=None if self.threshold else self.alert_pin)
+        self.data_rate = setupdata.get("data_rate", 128)
+        self.sample_interval = setupdata.get("sample_interval", 0)
+        samples = max(1, setupdata.get("samples", 100))
+
+        self.inputs = {}
+        self.aggregates = {}
+        for sensor, cfg in setupdata["sensors"].items():
+            channel = cfg.get("channel", 0)
+            minus = cfg.get("minus", None)
+            if minus is not None and (channel, minus) not in ADS1x15_DIFFERENTIAL:
+                raise IoTConfigError("ADS1115 sensor {} can't measure channel {} against {}"
+                                     .format(sensor, channel, minus))
+            self.inputs[sensor] = IoTads1115Input(
+                channel, minus, cfg.get("full_scale", 4.096), samples)
+            self.aggregates[sensor] = AGGREGATES[cfg.get("aggregate", "mean")]
+
+        if self.threshold:
+            self.__init_threshold()
+            return
+
+        # guards the ring buffers against the sampling thread
+        self.lock = threading.Lock()
+        # set after the first round of conversions
+        self.ready = threading.Event()
+        self.stopped = threading.Event()
+        self.error = None
+        self.errors = 0
+        # one round of conversions in the order of the sensors
+        self.channels = [sampled.channel for sampled in self.inputs.values()]
+        self.gains = [sampled.gain for sampled in self.inputs.values()]
+        self.thread = threading.Thread(target=self.__sample, daemon=True,
+                                       name="iot_control_ads1115")
+        self.thread.start()
+
+    def bus_id(self):
+        return super().bus_id() or "i2c-{}".format(self.port)
+
+    def __init_threshold(self) -> None:
+        """ private helper setting up the threshold mode """
+        if 1 != len(self.inputs):
+            raise IoTConfigError("ADS1115 in threshold mode needs exactly one sensor")
+        if self.alert_pin is None:
+            raise IoTConfigError("ADS1115 in threshold mode needs the alert_pin")
+        self.sensor, cfg = next(iter(self.conf["sensors"].items()))
+        if "high" not in cfg:
+            raise IoTConfigError("ADS1115 sensor {} needs 'high' in threshold mode"
+                                 .format(self.sensor))
+        self.watched = self.inputs[self.sensor]
+        self.high = self.__raw(cfg["high"])
+        self.low = self.__raw(cfg.get("low", cfg["high"]))
+        self.window = "window" == cfg.get("comparator", "traditional")
+        self.readings = cfg.get("readings", 1)
+        self.alerts = 0
+        # the comparator is started on the first read if the chip isn't there now
+        self.watching = False
+
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+        # ALERT/RDY is open drain and active low
+        GPIO.setup(self.alert_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        GPIO.add_event_detect(self.alert_pin, GPIO.BOTH, callback=self.__alert)
+        try:
+            self.__watch()
+        except OSError as exception:
+            self.logger.error("cannot start the ADS1115 comparator: %s", exception)
+
+    def __raw(self, volts: float) -> int:
+        """ private helper, a threshold in volt as value of a conversion """
+        return max(-32768, min(32767, int(round(volts / self.watched.full_scale * 32768))))
+
+    def __watch(self) -> None:
+        """ private helper starting continuous conversions with the comparator """
+        options = dict(gain=self.watched.gain, data_rate=self.data_rate,
+                       traditional=not self.window, num_readings=self.readings)
+        if isinstance(self.watched.channel, tuple):
+            self.adc.start_adc_difference_comparator(
+                ADS1x15_DIFFERENTIAL[self.watched.channel], self.high, self.low, **options)
+        else:
+            self.adc.start_adc_comparator(self.watched.channel, self.high, self.low, **options)
+        self.watching = True
+
+    def __alert(self, pin) -> None:
+        """ GPIO callback, the comparator changed ALERT/RDY """
+        self.alerts += 1
+        if self.runtime is not None:
+            self.runtime.trigger_for_device(self)
+
+    def __sample(self) -> None:
+        """ private thread converting all inputs in turn until shutdown """
+        if not self.inputs:
+            # nothing to sample
+            self.ready.set()
+            return
+        while not self.stopped.is_set():
+            try:
+                volts = self.adc.read_many(self.channels, self.gains, self.data_rate)
+                self.error = None
+            except OSError as exception:
+                if self.error is None:
+                    self.logger.error("ADS1115 conversion failed: %s", exception)
+                self.error = exception
+                self.errors += 1
+                # give the bus some time
+                self.stopped.wait(0.1)
+                continue
+            with self.lock:
+                for sampled, value in zip(self.inputs.values(), volts):
+                    sampled.buffer.append(float(value))
+            self.ready.set()
+            if self.sample_interval:
+                self.stopped.wait(self.sample_interval)
 
     def read_data(self) -> Dict:
         """ read data """
-        # Start ADC conversions on channel 0
-        self.adc.start_adc(0, gain=1)
-        value = self.adc.get_last_result()
-        self.adc.stop_adc()
-        value = float(value)*4.096/32768.0
-        val = {
-            "feuchte": "{:.2f}".format(value),
-        }
+        if self.threshold:
+            if not self.watching:
+                self.__watch()
+            try:
+                volts = self.adc.to_volts([self.adc.get_last_result()], self.watched.gain)[0]
+            except OSError:
+                # the chip might have been reset, start it again
+                self.watching = False
+                raise
+            return {self.sensor: "{:.4f}".format(volts)}
+        # right after the start wait for the first round of conversions
+        if not self.ready.wait(len(self.inputs) * 2.0 / self.data_rate + 1.0):
+            raise self.error or OSError("no samples from the ADS1115")
+        with self.lock:
+            buffers = {sensor: list(sampled.buffer) for sensor, sampled in self.inputs.items()}
+        val = {}
+        for sensor, samples in buffers.items():
+            if samples:
+                val[sensor] = "{:.4f}".format(self.aggregates[sensor](samples))
+        if not val and self.error is not None:
+            raise self.error
         return val
 
     def sensor_list(self) -> list:
-        return ["voltage"]
+        return list(self.inputs)
 
     def set_state(self, _) -> bool:
         """ nothing can be set here """
 
     def shutdown(self, _) -> None:
-        """ nothing to do """
+        """ stop sampling or the comparator """
+        if not self.threshold:
+            self.stopped.set()
+            self.thread.join(1.0)
+            self.adc.close()
+            return
+        GPIO.remove_event_detect(self.alert_pin)
+        if self.watching:
+            try:
+                self.adc.stop_adc()
+            except OSError as exception:
+                self.logger.info("cannot stop the ADS1115: %s", exception)
+            self.watching = False
@@ -6,37 +6,94 @@
 """
 
 from typing import Dict
-import smbus2
+import logging
+import time
+from iot_control.iotbus import IoTBusManager
 from iot_control.iotdevicebase import IoTDeviceBase
 from iot_control.iotfactory import IoTFactory
+from iot_control.iotconfig import IoTConfigField, IoTConfigEntries, SENSOR_FIELDS
+
+# opcodes
+POWER_DOWN = 0x00
+POWER_ON = 0x01
+CONTINUOUS = 0x10
+ONE_TIME = 0x20
+# added to CONTINUOUS or ONE_TIME
+RESOLUTION = {"high": 0x00, "high2": 0x01, "low": 0x03}
+MTREG_DEFAULT = 69
 
 
 @IoTFactory.register_device("bh1750")
 class IoTbh1750(IoTDeviceBase):
-    """ BH1750 sensor class
+    """ BH1750 sensor class. In continuous mode (the default) the sensor is set up once
+        and measures all the time, a read just fetches the last result, which takes
+        well below a millisecond. In one time mode every read starts a measurement and
+        waits for it, up to 180 ms with the default measurement time.
+
+        The measurement time register 'mtreg' (31 to 254, default 69) scales the
+        sensitivity and the duration of a measurement: bigger values resolve low light
+        better but take longer. 'resolution' is 'high' (1 lx), 'high2' (0.5 lx) or
+        'low' (4 lx, measuring in 16 ms instead of 120 ms).
     """
 
+    config_schema = {
+        "port": IoTConfigField(int),
+        "i2c_address": IoTConfigField(int),
+        "mode": IoTConfigField(str, default="continuous", choices=("continuous", "one-time")),
+        "resolution": IoTConfigField(str, default="high", choices=tuple(RESOLUTION)),
+        "mtreg": IoTConfigField(int, default=MTREG_DEFAULT),
+        "sensors": IoTConfigEntries(SENSOR_FIELDS),
+    }
+
     def __init__(self, **kwargs):
         super().__init__()
         setupdata = kwargs.get("config")
         self.conf = setupdata
+        self.logger = logging.getLogger("iot_control")
         self.port = setupdata["port"]
         self.address = setupdata["i2c_address"]
+        self.bus = IoTBusManager.bus(self.port)
+        self.continuous = "continuous" == setupdata.get("mode", "continuous")
+        resolution = setupdata.get("resolution", "high")
+        # the register takes 31 to 254
+        self.mtreg = max(31, min(254, setupdata.get("mtreg", MTREG_DEFAULT)))
+        self.opcode = (CONTINUOUS if self.continuous else ONE_TIME) | RESOLUTION[resolution]
+        # maximum measurement time from the datasheet, in seconds
+        self.wait = (0.024 if "low" == resolution else 0.180) * self.mtreg / MTREG_DEFAULT
+        # lux per count
+        self.factor = MTREG_DEFAULT / (1.2 * self.mtreg)
+        if "high2" == resolution:
+            self.factor /= 2
+        # the continuous measurement is running
+        self.running = False
+
+    def bus_id(self):
+        return super().bus_id() or "i2c-{}".format(self.port)
+
+    def __setup(self) -> None:
+        """ private helper writing the measurement time and starting a measurement """
+        self.bus.write_byte(self.address, POWER_ON)
+        self.bus.write_byte(self.address, 0x40 | (self.mtreg >> 5))
+        self.bus.write_byte(self.address, 0x60 | (self.mtreg & 0x1F))
+        self.bus.write_byte(self.address, self.opcode)
 
     def read_data(self) -> Dict:
         """ read data """
-        bus = smbus2.SMBus(self.port)
-        # 0x20 = ONE_TIME_HIGH_RES_MODE_1
-        # Start measurement at 1lx resolution. Time typically 120ms
-        # Device is automatically set to Power Down after measurement.
-        # Read data from I2C interface
-        data = bus.read_i2c_block_data(
-            self.address, 0x20, 16)
-        result = (data[1] + (256 * data[0])) / 1.2
+        try:
+            if not self.running:
+                self.__setup()
+                # wait for the first result, continuous measurements go on by themselves
+                time.sleep(self.wait)
+                self.running = self.continuous
+            data = self.bus.read(self.address, 2)
+        except OSError:
+            # the sensor might have lost power, set it up again
+            self.running = False
+            raise
+        result = ((data[0] << 8) | data[1]) * self.factor
         val = {
             "illuminance": "{:.1f}".format(result),
         }
-        bus.close()
         return val
 
     def sensor_list(self) -> list:
@@ -46,4 +103,10 @@ class IoTbh1750(IoTDeviceBase):
         """ nothing can be set here """
 
     def shutdown(self, _) -> None:
-        """ nothing to do """
+        """ stop measuring """
+        if self.running:
+            try:
+                self.bus.write_byte(self.address, POWER_DOWN)
+            except OSError as exception:
+                self.logger.info("cannot power down BH1750: %s", exception)
+            self.running = False
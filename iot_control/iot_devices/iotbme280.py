@@ -6,48 +6,171 @@
 
 from typing import Dict
 import logging
-import smbus2
-import bme280
+import struct
+import time
+from iot_control.iotbus import IoTBusManager
 from iot_control.iotdevicebase import IoTDeviceBase
 from iot_control.iotfactory import IoTFactory
+from iot_control.iotconfig import IoTConfigField, IoTConfigEntries, IoTConfigSection, \
+    SENSOR_FIELDS
+
+# registers
+REG_CALIB_TP = 0x88
+REG_CALIB_H1 = 0xA1
+REG_CHIP_ID = 0xD0
+REG_CALIB_H = 0xE1
+REG_CTRL_HUM = 0xF2
+REG_CTRL_MEAS = 0xF4
+REG_CONFIG = 0xF5
+REG_DATA = 0xF7
+CHIP_ID = 0x60
+MODE_FORCED = 0x01
+
+# register settings of the oversampling and the IIR filter coefficient
+OVERSAMPLING = {0: 0, 1: 1, 2: 2, 4: 3, 8: 4, 16: 5}
+IIR_FILTER = {0: 0, 2: 1, 4: 2, 8: 3, 16: 4}
 
 
 @IoTFactory.register_device("bme280")
 class IoTbme280(IoTDeviceBase):
-    """ BME280 sensor class
+    """ BME280 sensor class. The calibration is read once and again only after a bus
+        error, every read starts one measurement in forced mode, waits the maximum
+        measurement time of the datasheet for the oversampling and reads all data
+        registers at once: two transactions per read.
+
+        Oversampling 0 skips the pressure or humidity measurement, its value isn't
+        reported then. The temperature is always measured. The IIR filter smooths
+        pressure and temperature over several reads.
     """
 
+    config_schema = {
+        "port": IoTConfigField(int),
+        "i2c_address": IoTConfigField(int),
+        "oversampling": IoTConfigSection({
+            # pressure and humidity are compensated with the temperature
+            "temperature": IoTConfigField(int, default=1,
+                                          choices=tuple(k for k in OVERSAMPLING if k)),
+            "pressure": IoTConfigField(int, default=1, choices=tuple(OVERSAMPLING)),
+            "humidity": IoTConfigField(int, default=1, choices=tuple(OVERSAMPLING)),
+        }),
+        "iir_filter": IoTConfigField(int, default=0, choices=tuple(IIR_FILTER)),
+        "sensors": IoTConfigEntries(SENSOR_FIELDS),
+    }
+
     def __init__(self, **kwargs):
         super().__init__()
         setupdata = kwargs.get("config")
         self.conf = setupdata
         self.port = setupdata["port"]
         self.address = setupdata["i2c_address"]
+        # shared with the other devices on the bus, kept open
+        self.bus = IoTBusManager.bus(self.port)
 
         self.logger= logging.getLogger("iot_control")
 
+        oversampling = setupdata.get("oversampling", None) or {}
+        self.os_t = oversampling.get("temperature", 1)
+        self.os_p = oversampling.get("pressure", 1)
+        self.os_h = oversampling.get("humidity", 1)
+        self.iir_filter = setupdata.get("iir_filter", 0)
+        self.ctrl_meas = OVERSAMPLING[self.os_t] << 5 | OVERSAMPLING[self.os_p] << 2 | MODE_FORCED
+        # maximum measurement time from the datasheet, in seconds
+        wait = 1.25 + 2.3 * self.os_t
+        if self.os_p:
+            wait += 2.3 * self.os_p + 0.575
+        if self.os_h:
+            wait += 2.3 * self.os_h + 0.575
+        self.wait = wait / 1000.0
+        # read from the chip on the first read and after bus errors
+        self.calibration = None
+
+    def bus_id(self):
+        return super().bus_id() or "i2c-{}".format(self.port)
+
+    def __setup(self) -> None:
+        """ private helper reading the calibration and writing the settings, which
+            the chip loses when it is reset
+        """
+        chip_id = self.bus.write_read(self.address, [REG_CHIP_ID], 1)[0]
+        if CHIP_ID != chip_id:
+            self.logger.warning("BME280 at 0x%02x has chip id 0x%02x", self.address, chip_id)
+        block = self.bus.write_read(self.address, [REG_CALIB_TP], 26)
+        cal = dict(zip(("T1", "T2", "T3", "P1", "P2", "P3", "P4", "P5", "P6", "P7", "P8", "P9"),
+                       struct.unpack_from("<HhhHhhhhhhhh", block)))
+        cal["H1"] = block[REG_CALIB_H1 - REG_CALIB_TP]
+        block = self.bus.write_read(self.address, [REG_CALIB_H], 7)
+        cal["H2"], cal["H3"] = struct.unpack_from("<hB", block)
+        # H4 and H5 are signed 12 bit values sharing the nibbles of 0xE5
+        cal["H4"] = (struct.unpack_from("b", block, 3)[0] << 4) | (block[4] & 0x0F)
+        cal["H5"] = (struct.unpack_from("b", block, 5)[0] << 4) | (block[4] >> 4)
+        cal["H6"] = struct.unpack_from("b", block, 6)[0]
+
+        # the config register can only be written in sleep mode, which the chip is in
+        # between forced measurements, ctrl_hum gets active with the next ctrl_meas
+        self.bus.write_byte_data(self.address, REG_CONFIG, IIR_FILTER[self.iir_filter] << 2)
+        self.bus.write_byte_data(self.address, REG_CTRL_HUM, OVERSAMPLING[self.os_h])
+        self.calibration = cal
+
+    def __compensate(self, block) -> Dict:
+        """ private helper, the values from the data registers with the compensation
+            formulas in floating point from the datasheet
+        """
+        cal = self.calibration
+        adc_p = (block[0] << 12) | (block[1] << 4) | (block[2] >> 4)
+        adc_t = (block[3] << 12) | (block[4] << 4) | (block[5] >> 4)
+        adc_h = (block[6] << 8) | block[7]
+
+        var1 = (adc_t / 16384.0 - cal["T1"] / 1024.0) * cal["T2"]
+        var2 = (adc_t / 131072.0 - cal["T1"] / 8192.0) ** 2 * cal["T3"]
+        t_fine = var1 + var2
+        val = {"temperature": "{:.1f}".format(t_fine / 5120.0)}
+
+        if self.os_p:
+            var1 = t_fine / 2.0 - 64000.0
+            var2 = var1 * var1 * cal["P6"] / 32768.0
+            var2 = var2 + var1 * cal["P5"] * 2.0
+            var2 = var2 / 4.0 + cal["P4"] * 65536.0
+            var1 = (cal["P3"] * var1 * var1 / 524288.0 + cal["P2"] * var1) / 524288.0
+            var1 = (1.0 + var1 / 32768.0) * cal["P1"]
+            if var1:
+                pressure = (1048576.0 - adc_p - var2 / 4096.0) * 6250.0 / var1
+                var1 = cal["P9"] * pressure * pressure / 2147483648.0
+                var2 = pressure * cal["P8"] / 32768.0
+                pressure += (var1 + var2 + cal["P7"]) / 16.0
+                val["pressure"] = "{:.1f}".format(pressure / 100.0)
+
+        if self.os_h:
+            h = t_fine - 76800.0
+            h = (adc_h - (cal["H4"] * 64.0 + cal["H5"] / 16384.0 * h)) * (
+                cal["H2"] / 65536.0 * (1.0 + cal["H6"] / 67108864.0 * h * (
+                    1.0 + cal["H3"] / 67108864.0 * h)))
+            h = h * (1.0 - cal["H1"] * h / 524288.0)
+            val["humidity"] = "{:.1f}".format(min(100.0, max(0.0, h)))
+        return val
 
     def read_data(self) -> Dict:
         """ read data """
 
         val= {}
+        error= None
 
         count= 3
+        delay= 0.05
         while 0 < count :
 
-            try: 
+            try:
 
-                with smbus2.SMBus(self.port) as bus:
-                    calibration_params = bme280.load_calibration_params(
-                        bus, self.address)
-                    data = bme280.sample(bus, self.address)
-                    val = {
-                        "temperature": "{:.1f}".format(data.temperature),
-                        "humidity": "{:.1f}".format(data.humidity),
-                        "pressure": "{:.1f}".format(data.pressure)
-                    }
-            except OSError as error :  
-                self.logger.info("OSError: %s", error)
+                if self.calibration is None:
+                    self.__setup()
+                self.bus.write_byte_data(self.address, REG_CTRL_MEAS, self.ctrl_meas)
+                # the bus is free for others meanwhile
+                time.sleep(self.wait)
+                val = self.__compensate(self.bus.write_read(self.address, [REG_DATA], 8))
+            except OSError as e :
+                self.logger.info("OSError: %s", e)
+                error= e
+                # the chip might have been reset, read everything again
+                self.calibration = None
 
             if val:
                 break
@@ -55,41 +178,20 @@ class IoTbme280(IoTDeviceBase):
             count -= 1
             self.logger.error("Could not read new value, try %s more time(s)", count)
 
-        return val
-
-    def read_data_new(self) -> Dict:
-        """ read data from BME280 sensor in a robust way"""
-
-        val= {}
-
-        count= 5
-        while 0 < count :
-
-            try: 
-
-                with smbus2.SMBus(self.port) as bus:
-                    calibration_params = bme280.load_calibration_params(
-                        bus, self.address)
-                    data = bme280.sample(bus, self.address)
-                    val = {
-                        "temperature": "{:.1f}".format(data.temperature),
-                        "humidity": "{:.1f}".format(data.humidity),
-                        "pressure": "{:.1f}".format(data.pressure)
-                    }
-            except OSError as error :  
-                self.logger.info("OSError: %s", error)
-
-            if val:
-                break
+            if 0 < count:
+                # give the bus some time before trying again
+                time.sleep(delay)
+                delay *= 2
 
-            count -= 1
-            self.logger.error("Could not read new value, try %s more time(s)", count)
+        if not val and error is not None:
+            # let the runtime know, it will back off if the sensor stays dead
+            raise error
 
         return val
 
-
     def sensor_list(self) -> list:
-        return ["temperature", "humidity", "pressure"]
+        return [name for name, used in (("temperature", True), ("humidity", self.os_h),
+                                        ("pressure", self.os_p)) if used]
 
     def set_state(self, _) -> bool:
         """ nothing can be set here """
@@ -8,6 +8,7 @@ from typing import Dict
 import os
 from iot_control.iotdevicebase import IoTDeviceBase, IoTConfigError
 from iot_control.iotfactory import IoTFactory
+from iot_control.iotconfig import IoTConfigField, IoTConfigEntries, ENTITY_FIELDS
 
 
 @IoTFactory.register_device("command_switch")
@@ -15,6 +16,15 @@ class IoTcommandswitch(IoTDeviceBase):
     """ running shell commands if the switch is triggered
     """
 
+    config_schema = {
+        "payload_on": IoTConfigField(str),
+        "payload_off": IoTConfigField(str),
+        "switches": IoTConfigEntries(dict(ENTITY_FIELDS, **{
+            "on_command": IoTConfigField(str),
+            "off_command": IoTConfigField(str),
+        })),
+    }
+
     last_state = {}
     on_cmds = {}
     off_cmds = {}
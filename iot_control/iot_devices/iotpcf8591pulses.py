@@ -7,68 +7,270 @@
 from typing import Dict
 import logging
 import socket
-import smbus
 import threading
 import time
 import json
+import paho.mqtt.client as mqtt
+import zmq
+
+from iot_control.iotbus import IoTBusManager
 from iot_control.iotdevicebase import IoTDeviceBase
 from iot_control.iotfactory import IoTFactory
+from iot_control.iotconfig import IoTConfigField, IoTConfigEntries, SENSOR_FIELDS, NUMBER
+from iot_control.iotdevicebase import IoTConfigError
+
+try:
+    import numpy
+except ImportError:
+    # the pulses are detected sample by sample then
+    numpy = None
+
+# control byte: analog output on, auto increment starting with channel 0
+AUTO_INCREMENT = 0x44
+# statistics of the sampler to publish as sensor with 'diagnostic'
+DIAGNOSTICS = ("jitter_mean", "jitter_max", "missed", "errors")
+
+
+class IoTPulseDetector:
+    """ counts the pulses of one channel in blocks of samples. A pulse starts at a
+        sample at or below 'low' and ends at the next one at or above 'high', values
+        in between keep the state. Pulses shorter than 'min_width' samples are not
+        counted. A pulse going on at the end of a block is continued in the next one.
+        With numpy a block is done in a few vectorized steps on arrays allocated
+        once, without it sample by sample.
+
+    Args:
+        size (int): samples in a block
+        low (int): ADC value at or below which a pulse starts
+        high (int): ADC value at or above which a pulse ends
+        min_width (int): minimum number of samples in a pulse
+    """
+
+    def __init__(self, size: int, low: int, high: int, min_width: int):
+        self.size = size
+        self.low = low
+        self.high = high
+        self.min_width = min_width
+        self.in_pulse = False
+        # samples of the pulse going on so far
+        self.width = 0
+        if numpy is not None:
+            # element 0 is the state at the end of the previous block
+            self.positions = numpy.arange(size + 1)
+            self.inside = numpy.empty(size + 1, dtype=bool)
+            self.outside = numpy.empty(size, dtype=bool)
+            self.decided = numpy.empty(size + 1, dtype=bool)
+            self.last = numpy.empty(size + 1, dtype=self.positions.dtype)
+            self.state = numpy.empty(size + 1, dtype=bool)
+            self.edges = numpy.empty(size, dtype=bool)
+
+    def is_low(self, value: int, previous: int) -> bool:
+        """ is the sample at or below 'low' """
+        return value <= self.low
+
+    def count(self, samples) -> int:
+        """ the number of pulses which ended in this block of samples """
+        if numpy is None:
+            return self.__count_samples(samples)
+        inside = self.inside
+        state = self.state
+        inside[0] = self.in_pulse
+        numpy.less_equal(samples, self.low, out=inside[1:])
+        numpy.greater_equal(samples, self.high, out=self.outside)
+        self.decided[0] = True
+        numpy.logical_or(inside[1:], self.outside, out=self.decided[1:])
+        # the state of every sample is the one of the last sample beyond a threshold
+        numpy.multiply(self.positions, self.decided, out=self.last)
+        numpy.maximum.accumulate(self.last, out=self.last)
+        numpy.take(inside, self.last, out=state)
+
+        numpy.greater(state[1:], state[:-1], out=self.edges)
+        starts = numpy.flatnonzero(self.edges)
+        numpy.less(state[1:], state[:-1], out=self.edges)
+        ends = numpy.flatnonzero(self.edges)
+        if self.in_pulse:
+            starts = numpy.concatenate(([-self.width], starts))
+        pulses = int(numpy.count_nonzero(ends - starts[:len(ends)] >= self.min_width))
+        self.in_pulse = len(starts) > len(ends)
+        self.width = self.size - int(starts[-1]) if self.in_pulse else 0
+        return pulses
+
+    def __count_samples(self, samples) -> int:
+        """ private helper doing count() sample by sample """
+        pulses = 0
+        in_pulse = self.in_pulse
+        width = self.width
+        for value in samples:
+            if in_pulse:
+                if value >= self.high:
+                    in_pulse = False
+                    if width >= self.min_width:
+                        pulses += 1
+                else:
+                    width += 1
+            elif value <= self.low:
+                in_pulse = True
+                width = 1
+        self.in_pulse = in_pulse
+        self.width = width if in_pulse else 0
+        return pulses
+
+
+class IoTRelativePulseDetector:
+    """ counts the pulses of one channel in blocks of samples, like the sensor always
+        did without 'pulse_low' and 'pulse_high': a pulse is a sample at or below
+        'ratio' times the one before it, so it is counted at the falling edge whatever
+        the idle level is. The last sample of a block is the one before the first of
+        the next block.
+
+    Args:
+        size (int): samples in a block
+        ratio (float): drop to this fraction of the sample before
+    """
+
+    def __init__(self, size: int, ratio: float = 0.2):
+        self.size = size
+        self.ratio = ratio
+        # the sample before the first one, as if the level was at the top
+        self.last = 255
+        if numpy is not None:
+            self.limits = numpy.empty(size, dtype=float)
+            self.edges = numpy.empty(size, dtype=bool)
+
+    def is_low(self, value: int, previous: int) -> bool:
+        """ is the sample a drop against the one before """
+        return value <= self.ratio * previous
+
+    def count(self, samples) -> int:
+        """ the number of pulses in this block of samples """
+        if numpy is None:
+            pulses = 0
+            last = self.last
+            for value in samples:
+                if value <= self.ratio * last:
+                    pulses += 1
+                last = value
+            self.last = last
+            return pulses
+        limits = self.limits
+        limits[0] = self.last
+        limits[1:] = samples[:-1]
+        limits *= self.ratio
+        numpy.less_equal(samples, limits, out=self.edges)
+        self.last = int(samples[-1])
+        return int(numpy.count_nonzero(self.edges))
 
-import datetime
-import paho.mqtt.client as mqtt
-import zmq
 
 @IoTFactory.register_device("pcf8591pulses")
 class IoTpcf8591pulses(IoTDeviceBase):
-    """ PCF8591Oulses sensor class
+    """ PCF8591Oulses sensor class. A thread samples all channels every
+        'sample_interval' seconds, on deadlines that don't drift with the time the
+        reads take, with one block read. The samples are collected in a buffer and
+        every 'block' samples the pulses are detected in all of them at once. A pulse
+        is a drop of a sample to a fifth of the one before (see
+        IoTRelativePulseDetector) or, if 'pulse_low' and 'pulse_high' are given, a
+        level at or below 'pulse_low' until it is back at 'pulse_high', both as ADC
+        values (0 to 255), with 'min_width' as shortest pulse in seconds (see
+        IoTPulseDetector).
+        How late it woke up (the jitter, in ms)
+        and the deadlines it missed can be published as sensors with 'diagnostic'
+        instead of 'channel'. The jitter is over the time since the last reading.
     """
 
-    def internal_background_thread(self):
-
-        bus=smbus.SMBus( self.port )
-        cmd=0x40
-        num= len(self.values)
-        sleeptime= 0.010
-        #sleeptime= 0.005
+    config_schema = {
+        "port": IoTConfigField(int),
+        "i2c_address": IoTConfigField(int),
+        # optional, keep the counters across restarts via MQTT
+        "internal_mqtt_server": IoTConfigField(str, required=False),
+        "internal_mqtt_port": IoTConfigField(int, required=False),
+        "internal_mqtt_user": IoTConfigField(str, required=False),
+        "internal_mqtt_password": IoTConfigField(str, required=False),
+        # optional, publish the raw samples via ZMQ
+        "debug_zmq_port": IoTConfigField(int, required=False),
+        # optional, seconds between two samples
+        "sample_interval": IoTConfigField(NUMBER, default=0.010),
+        # optional, number of samples to detect the pulses in at once
+        "block": IoTConfigField(int, default=100),
+        "sensors": IoTConfigEntries(dict(SENSOR_FIELDS, **{
+            # required for counting pulses
+            "recentvalue": IoTConfigField(NUMBER, required=False),
+            "factor": IoTConfigField(NUMBER, required=False),
+            "channel": IoTConfigField(int, required=False, choices=(0, 1, 2, 3)),
+            # optional, hysteresis and minimum duration of a pulse instead of the
+            # relative drop
+            "pulse_low": IoTConfigField(int, required=False),
+            "pulse_high": IoTConfigField(int, required=False),
+            "min_width": IoTConfigField(NUMBER, required=False),
+            # instead of the three above, a statistic of the sampler
+            "diagnostic": IoTConfigField(str, required=False, choices=DIAGNOSTICS),
+        })),
+    }
 
-        currvalue= {}
-        lastvalue= {}
-        for i in self.values:
-            currvalue[i]= 0
-            lastvalue[i]= 255
+    def internal_background_thread(self):
 
-        while True:
+        bus=IoTBusManager.bus( self.port )
+        period= self.sample_interval
+        length= self.length
+        size= len( self.samples ) // length
+        row= 0
+
+        deadline= time.monotonic()
+        while not self.stopped.is_set():
+
+            # sleep until the next deadline, independent of how long the last round took
+            deadline += period
+            delay= deadline - time.monotonic()
+            if 0 < delay and self.stopped.wait( delay ):
+                break
+            late= time.monotonic() - deadline
+            missed= 0
+            if late >= period:
+                # skip the deadlines which are over instead of sampling in a burst
+                missed= int( late / period )
+                deadline += missed * period
+            with self.stats_lock:
+                self.jitter_sum += late
+                self.jitter_count += 1
+                self.jitter_max= max( self.jitter_max, late )
+                self.missed += missed
+
+            try:
+                block= bus.read_i2c_block_data( self.address, AUTO_INCREMENT, length )
+            except OSError as e:
+                with self.stats_lock:
+                    self.errors += 1
+                self.logger.debug( "IoTpcf8591pulses: reading the ADC failed: %s", e )
+                continue
+
+            # into the preallocated buffer, nothing else is created per sample
+            self.samples[ row * length:( row + 1 ) * length ]= block
+            row += 1
 
-            message= dict()
+            if self.debug:
+                self.__send_debug( block )
 
-            message["time"]= time.time() # "{}".format(datetime.datetime.utcnow())
-            message["adc"]= dict() # value from the ADC
-            message["val"]= dict() # value integrated from the pulses
-            message["sig"]= dict() # value indicating a pulse
+            if row == size:
+                for i in self.detectors:
+                    self.values[i] += self.detectors[i].count( self.columns[i] ) * self.factors[i]
+                row= 0
 
-            for i in self.values:
-                lastvalue[i]= currvalue[i]
-                currvalue[i]= bus.read_byte_data(self.address,cmd+self.channels[i])
-                # print( "   ", i, lastvalue[i], currvalue[i] )
+    def __send_debug(self, block):
+        """ private helper publishing a sample via ZMQ, 'sig' shows it is a pulse """
 
-            for i in self.values:
-                message["adc"][i]= currvalue[i]
-                message["val"][i]= self.values[i]
-                message["sig"][i]= 0
+        message= dict()
 
-            for i in self.values:
-                if currvalue[i] <= 0.2*lastvalue[i] :
-                    self.values[i] += self.factors[i]
-                    message["sig"][i]= 100
+        message["time"]= time.time() # "{}".format(datetime.datetime.utcnow())
+        message["adc"]= dict() # value from the ADC
+        message["val"]= dict() # value integrated from the pulses
+        message["sig"]= dict() # value indicating a pulse
 
-            if self.debug:
-                #print("    ",message)
-                self.sendsocket.send_json( message )
+        for i in self.values:
+            message["adc"][i]= block[ 1 + self.channels[i] ]
+            message["val"][i]= self.values[i]
+            message["sig"][i]= 100 if self.detectors[i].is_low( message["adc"][i], self.debug_last[i] ) else 0
+            self.debug_last[i]= message["adc"][i]
 
-                time.sleep(sleeptime-0.005)
-
-            else:
-                time.sleep(sleeptime)
+        self.sendsocket.send_json( message )
 
     def mqtt_callback_connect(self, client, userdata, flags, rc):
         """ callback as defined by the mqtt API for the moment when the connection is made
@@ -152,10 +354,59 @@ class IoTpcf8591pulses(IoTDeviceBase):
         self.values= {}
         self.factors= {}
         self.channels= {}
+        self.diagnostics= {}
         for s in setupdata["sensors"]:
-            self.values[s]= setupdata["sensors"][s]["recentvalue"]
-            self.factors[s]= setupdata["sensors"][s]["factor"]
-            self.channels[s]= setupdata["sensors"][s]["channel"]
+            cfg= setupdata["sensors"][s]
+            if "diagnostic" in cfg:
+                self.diagnostics[s]= cfg["diagnostic"]
+                continue
+            for key in ( "recentvalue", "factor", "channel" ):
+                if key not in cfg:
+                    raise IoTConfigError( "sensor {} of IoTpcf8591pulses needs '{}' or 'diagnostic'".format( s, key ) )
+            self.values[s]= cfg["recentvalue"]
+            self.factors[s]= cfg["factor"]
+            self.channels[s]= cfg["channel"]
+
+        # statistics of the sampler
+        self.sample_interval= setupdata.get( "sample_interval", 0.010 )
+        self.stats_lock= threading.Lock()
+        self.jitter_sum= 0.0
+        self.jitter_count= 0
+        self.jitter_max= 0.0
+        self.missed= 0
+        self.errors= 0
+        self.stopped= threading.Event()
+
+        # buffer of 'block' samples of all channels read, the first byte of a read is
+        # the conversion started by the previous read
+        self.length= 2 + max( self.channels.values(), default= 0 )
+        size= max( 1, setupdata.get( "block", 100 ) )
+        self.samples= bytearray( size * self.length )
+        self.detectors= {}
+        self.columns= {}
+        # the sample before, for the debug values
+        self.debug_last= dict.fromkeys( self.values, 255 )
+        for s in self.values:
+            cfg= setupdata["sensors"][s]
+            if "pulse_low" not in cfg and "pulse_high" not in cfg:
+                if "min_width" in cfg:
+                    raise IoTConfigError( "sensor {} of IoTpcf8591pulses needs pulse_low and pulse_high for min_width".format( s ) )
+                self.detectors[s]= IoTRelativePulseDetector( size )
+            else:
+                if "pulse_low" not in cfg or "pulse_high" not in cfg:
+                    raise IoTConfigError( "sensor {} of IoTpcf8591pulses needs both pulse_low and pulse_high".format( s ) )
+                low= cfg["pulse_low"]
+                high= cfg["pulse_high"]
+                if low >= high:
+                    raise IoTConfigError( "sensor {} of IoTpcf8591pulses needs pulse_low below pulse_high".format( s ) )
+                min_width= max( 1, int( round( cfg.get( "min_width", 0 ) / self.sample_interval ) ) )
+                self.detectors[s]= IoTPulseDetector( size, low, high, min_width )
+            offset= 1 + self.channels[s]
+            if numpy is not None:
+                # a view of the channel in the buffer
+                self.columns[s]= numpy.frombuffer( self.samples, dtype=numpy.uint8 )[offset::self.length]
+            else:
+                self.columns[s]= memoryview( self.samples )[offset::self.length]
 
         # if there are values from the MQTT channel then the recent values from the config above are ignored
         if True == self.retain :
@@ -183,6 +434,21 @@ class IoTpcf8591pulses(IoTDeviceBase):
         for i in self.values:
             val[i]= "{:.3f}".format(self.values[i])
 
+        if self.diagnostics:
+            with self.stats_lock:
+                stats= {
+                    "jitter_mean": 1000.0 * self.jitter_sum / self.jitter_count if self.jitter_count else 0.0,
+                    "jitter_max": 1000.0 * self.jitter_max,
+                    "missed": self.missed,
+                    "errors": self.errors,
+                }
+                # the jitter is over the time since the last reading
+                self.jitter_sum= 0.0
+                self.jitter_count= 0
+                self.jitter_max= 0.0
+            for i in self.diagnostics:
+                val[i]= "{:.3f}".format( stats[ self.diagnostics[i] ] ) if self.diagnostics[i].startswith( "jitter" ) else str( stats[ self.diagnostics[i] ] )
+
         if True == self.retain :
 
             payload = json.dumps(val)
@@ -201,7 +467,12 @@ class IoTpcf8591pulses(IoTDeviceBase):
         """ nothing can be set here """
 
     def shutdown(self, _) -> None:
-        """ nothing to do """
+        """ stop the sampler and the MQTT client, a reload creates new ones """
+        self.stopped.set()
+        self.t.join( 1.0 )
+        if True == self.retain :
+            self.mqtt_client.disconnect()
+            self.mqtt_client.loop_stop()
         if self.sendsocket:
             self.sendsocket.close()
             self.context.term()
@@ -8,9 +8,10 @@ between 0% and 100% according to https://www.home-assistant.io/integrations/ligh
 import time
 import logging
 from typing import Dict
-import RPi.GPIO as GPIO
+from iot_control.iothardware import GPIO
 from iot_control.iotdevicebase import IoTDeviceBase
 from iot_control.iotfactory import IoTFactory
+from iot_control.iotconfig import IoTConfigField, IoTConfigEntries, ENTITY_FIELDS
 import json
 
 @IoTFactory.register_device("raspi-pwm-light")
@@ -18,6 +19,15 @@ class IoTraspipwmlight(IoTDeviceBase):
     """ LED light strip or light controlled by motor controller with PWM to adjust brightness
     """
 
+    config_schema = {
+        "payload_on": IoTConfigField(str, required=False),
+        "payload_off": IoTConfigField(str, required=False),
+        "pwmlights": IoTConfigEntries(dict(ENTITY_FIELDS, **{
+            "pins": IoTConfigField(list),
+            "pwmpin": IoTConfigField(int),
+        })),
+    }
+
     logger = None
 
     # stores mapping of covers to pins
@@ -56,6 +66,9 @@ class IoTraspipwmlight(IoTDeviceBase):
 
             self.pwmlights[light]= cfg
 
+    def bus_id(self):
+        return super().bus_id() or "gpio"
+
     def read_data(self) -> Dict:
 
         val = {}
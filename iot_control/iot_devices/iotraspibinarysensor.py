@@ -5,10 +5,11 @@
 """
 
 from typing import Dict
-import RPi.GPIO as GPIO
+from iot_control.iothardware import GPIO
 import logging
 from iot_control.iotdevicebase import IoTDeviceBase
 from iot_control.iotfactory import IoTFactory
+from iot_control.iotconfig import IoTConfigField, IoTConfigEntries, ENTITY_FIELDS
 
 
 @IoTFactory.register_device("raspi-binary-sensor")
@@ -16,9 +17,15 @@ class IoTraspibinarysensor(IoTDeviceBase):
     """ binary sensor class to act upon an input GPIO pin on a Raspi
     """
 
-    # stores mapping of binary sensors to pins
-    sensors = {}
-    
+    config_schema = {
+        "payload_on": IoTConfigField(str),
+        "payload_off": IoTConfigField(str),
+        "binary-sensors": IoTConfigEntries(dict(ENTITY_FIELDS, **{
+            "pin": IoTConfigField(int),
+            "device_class": IoTConfigField(str, required=False),
+        })),
+    }
+
     # handle for a pending autooff event
     handle = None
 
@@ -34,6 +41,8 @@ class IoTraspibinarysensor(IoTDeviceBase):
         GPIO.setwarnings(False)
 
         sensors_cfg = setupdata["binary-sensors"]
+        # stores mapping of binary sensors to pins
+        self.sensors = {}
 
         def callback( pin ):
             """ Helper callback function providing all the interesting arguments that the stupid API of 
@@ -55,6 +64,9 @@ class IoTraspibinarysensor(IoTDeviceBase):
 
             GPIO.add_event_detect( pin, GPIO.BOTH, callback= callback, bouncetime=100 )
 
+    def bus_id(self):
+        return super().bus_id() or "gpio"
+
     def read_data(self) -> Dict:
         """ read data """
         val = {}
@@ -75,7 +87,7 @@ class IoTraspibinarysensor(IoTDeviceBase):
         return False 
 
     def shutdown(self, _) -> None:
-        """ Don't need to clean up for input pins """
+        """ stop the edge detection, so the pins can be set up again after a reload """
         for sensor in self.sensors:
             pin = self.sensors[sensor]
-            #GPIO.output(pin, GPIO.LOW)
+            GPIO.remove_event_detect(pin)
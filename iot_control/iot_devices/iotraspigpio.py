@@ -5,10 +5,11 @@
 """
 
 from typing import Dict
-import RPi.GPIO as GPIO
+from iot_control.iothardware import GPIO
 import logging
 from iot_control.iotdevicebase import IoTDeviceBase
 from iot_control.iotfactory import IoTFactory
+from iot_control.iotconfig import IoTConfigField, IoTConfigEntries, ENTITY_FIELDS, NUMBER
 
 
 @IoTFactory.register_device("raspi-gpio")
@@ -16,6 +17,19 @@ class IoTraspigpio(IoTDeviceBase):
     """ Raspberry pi GPIO class
     """
 
+    switch_fields = dict(ENTITY_FIELDS, **{
+        "pin": IoTConfigField(int),
+        "autooff": IoTConfigField(NUMBER, required=False),
+        "inverse": IoTConfigField(int, required=False),
+    })
+    config_schema = {
+        "payload_on": IoTConfigField(str),
+        "payload_off": IoTConfigField(str),
+        "switches": IoTConfigEntries(switch_fields, required=False),
+        # old name of 'switches'
+        "names": IoTConfigEntries(switch_fields, required=False),
+    }
+
     # stores mapping of switches to pins
     switches = {}
     autooff = {}
@@ -57,6 +71,9 @@ class IoTraspigpio(IoTDeviceBase):
     def give_scheduled_event_handle(self,handle,msg) -> None: # TODO
         self.handle[msg]= handle
   
+    def bus_id(self):
+        return super().bus_id() or "gpio"
+
     def read_data(self) -> Dict:
         """ read data """
         val = {}
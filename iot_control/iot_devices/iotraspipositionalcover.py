@@ -6,9 +6,10 @@
 import time
 import logging
 from typing import Dict
-import RPi.GPIO as GPIO
+from iot_control.iothardware import GPIO
 from iot_control.iotdevicebase import IoTDeviceBase
 from iot_control.iotfactory import IoTFactory
+from iot_control.iotconfig import IoTConfigField, IoTConfigEntries, ENTITY_FIELDS, NUMBER
 import json
 
 motorstep= []
@@ -24,6 +25,18 @@ class IoTraspipositionalcover(IoTDeviceBase):
     controller
     """
 
+    config_schema = {
+        "payload_open": IoTConfigField(str),
+        "payload_close": IoTConfigField(str),
+        "payload_stop": IoTConfigField(str),
+        "position_open": IoTConfigField(int),
+        "sleeptime": IoTConfigField(NUMBER),
+        "state_file": IoTConfigField(str),
+        "poscovers": IoTConfigEntries(dict(ENTITY_FIELDS, **{
+            "motorpins": IoTConfigField(list),
+        })),
+    }
+
     logger = None
 
     # stores mapping of covers to pins
@@ -108,6 +121,9 @@ class IoTraspipositionalcover(IoTDeviceBase):
         for p in motorpins:
             GPIO.output(p,GPIO.LOW)
 
+    def bus_id(self):
+        return super().bus_id() or "gpio"
+
     def read_data(self) -> Dict:
 
         val = {}
@@ -6,9 +6,10 @@
 import time
 import logging
 from typing import Dict
-import RPi.GPIO as GPIO
+from iot_control.iothardware import GPIO
 from iot_control.iotdevicebase import IoTDeviceBase
 from iot_control.iotfactory import IoTFactory
+from iot_control.iotconfig import IoTConfigField, IoTConfigEntries, ENTITY_FIELDS
 
 
 @IoTFactory.register_device("raspi-state-cover")
@@ -18,6 +19,22 @@ class IoTraspicover(IoTDeviceBase):
     controller
     """
 
+    config_schema = {
+        "payload_open": IoTConfigField(str),
+        "payload_close": IoTConfigField(str),
+        "payload_stop": IoTConfigField(str),
+        "state_open": IoTConfigField(str, required=False),
+        "state_opening": IoTConfigField(str, required=False),
+        "state_closed": IoTConfigField(str, required=False),
+        "state_closing": IoTConfigField(str, required=False),
+        "state_unknown": IoTConfigField(str, required=False),
+        "statecovers": IoTConfigEntries(dict(ENTITY_FIELDS, **{
+            "pin_up": IoTConfigField(int),
+            "pin_down": IoTConfigField(int),
+            "pin_trigger": IoTConfigField(int),
+        })),
+    }
+
     logger = None
 
     # constants for the internal state, they get translated into what HA/MQTT understand
@@ -40,9 +57,6 @@ class IoTraspicover(IoTDeviceBase):
     state_closing = "closing"
     state_unknown = "unknown"
 
-    # stores mapping of covers to pins
-    covers = {}
-
     # handle for a pending autooff event
     handle = None
 
@@ -119,6 +133,8 @@ class IoTraspicover(IoTDeviceBase):
         self.translate_status[IoTraspicover.STATE_ILLEGAL] = self.state_unknown
 
         covers_cfg = setupdata["statecovers"]
+        # stores mapping of covers to pins
+        self.covers = {}
 
         def callback(pin):
             """ Helper callback function providing all the interesting
@@ -168,6 +184,9 @@ class IoTraspicover(IoTDeviceBase):
                                   bouncetime=100)
 
 
+    def bus_id(self):
+        return super().bus_id() or "gpio"
+
     def read_data(self) -> Dict:
         """ don't read real data or gpios but just return the stored status  """
         val = {}
@@ -288,7 +307,10 @@ class IoTraspicover(IoTDeviceBase):
         return False
 
     def shutdown(self, _) -> None:
+        """ stop the edge detection, so the pins can be set up again after a reload """
         for cover in self.covers:
             cfg = self.covers[cover]
             pin_trigger = cfg["pin_trigger"]
             #GPIO.output(pin_trigger, GPIO.HIGH)
+            GPIO.remove_event_detect(cfg["pin_up"])
+            GPIO.remove_event_detect(cfg["pin_down"])
@@ -0,0 +1,191 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" synthetic device generating load for capacity planning
+"""
+
+import logging
+import math
+import random
+import threading
+import time
+from typing import Dict
+from iot_control.iotdevicebase import IoTDeviceBase
+from iot_control.iotfactory import IoTFactory
+from iot_control.iotconfig import IoTConfigField, IoTConfigSection, NUMBER
+
+
+@IoTFactory.register_device("synthetic")
+class IoTsynthetic(IoTDeviceBase):
+    """ a device with 'count' generated entities of one kind, sensors, switches or
+        binary sensors. The entries are put into the config like they were written
+        there, so the backends announce and publish them on exactly the same paths as
+        those of real hardware. For a mix of entities use several synthetic devices
+        with different prefixes.
+
+        Sensor values follow a distribution, switches accept commands, and with
+        'triggers' bursts of changes go through runtime.trigger_for_device() like
+        the edges of a chattering contact on a GPIO pin.
+    """
+
+    config_schema = {
+        "entity": IoTConfigField(str, default="sensor",
+                                 choices=("sensor", "switch", "binary-sensor")),
+        "count": IoTConfigField(int, default=10),
+        # start of names and unique ids, must differ between synthetic devices
+        "prefix": IoTConfigField(str),
+        "seed": IoTConfigField(int, required=False),
+        "payload_on": IoTConfigField(str, default="on"),
+        "payload_off": IoTConfigField(str, default="off"),
+        # keys for every generated sensor
+        "sensor": IoTConfigSection({
+            "device_class": IoTConfigField(str, default="temperature"),
+            "unit_of_measurement": IoTConfigField(str, default="°C"),
+            "expire_after": IoTConfigField(NUMBER, default=3600),
+        }),
+        # intervals given to the sensors in turn, to have several update rates
+        "intervals": IoTConfigField(list, required=False),
+        "distribution": IoTConfigSection({
+            "kind": IoTConfigField(str, default="normal", choices=(
+                "constant", "uniform", "normal", "sine", "random-walk")),
+            "mean": IoTConfigField(NUMBER, default=20.0),
+            "stddev": IoTConfigField(NUMBER, default=1.0),
+            "low": IoTConfigField(NUMBER, default=0.0),
+            "high": IoTConfigField(NUMBER, default=100.0),
+            "period": IoTConfigField(NUMBER, default=3600.0),
+            "step": IoTConfigField(NUMBER, default=0.1),
+            "decimals": IoTConfigField(int, default=2),
+        }),
+        # seconds a read takes, like the transfers on a bus
+        "read_time": IoTConfigField(NUMBER, required=False),
+        # bursts of 'burst' triggers 'spacing' seconds apart, 'rate' bursts per second
+        # on average with exponentially distributed gaps
+        "triggers": IoTConfigSection({
+            "rate": IoTConfigField(NUMBER),
+            "burst": IoTConfigField(int, default=1),
+            "spacing": IoTConfigField(NUMBER, default=0.01),
+        }),
+    }
+
+    # config section the backends look for, by entity
+    sections = {"sensor": "sensors", "switch": "switches", "binary-sensor": "binary-sensors"}
+
+    def __init__(self, **kwargs):
+        super().__init__()
+        self.logger = logging.getLogger("iot_control")
+        setupdata = kwargs.get("config")
+        self.conf = setupdata
+        self.entity = setupdata.get("entity", "sensor")
+        self.payload_on = setupdata.get("payload_on", "on")
+        self.payload_off = setupdata.get("payload_off", "off")
+        self.distribution = setupdata.get("distribution", None) or {}
+        self.read_time = setupdata.get("read_time", 0)
+        self.rng = random.Random(setupdata.get("seed", None))
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.trigger_thread = None
+        self.triggers_sent = 0
+
+        prefix = setupdata["prefix"]
+        sensor_cfg = setupdata.get("sensor", None) or {}
+        intervals = setupdata.get("intervals", None) or []
+        entries = {}
+        for i in range(setupdata.get("count", 10)):
+            name = "{}_{}".format(prefix, i)
+            entry = {"name": "{} {}".format(prefix, i), "unique_id": name}
+            if "sensor" == self.entity:
+                entry.update({
+                    "device_class": sensor_cfg.get("device_class", "temperature"),
+                    "unit_of_measurement": sensor_cfg.get("unit_of_measurement", "°C"),
+                    "expire_after": sensor_cfg.get("expire_after", 3600)})
+                if intervals:
+                    entry["interval"] = intervals[i % len(intervals)]
+            elif "binary-sensor" == self.entity:
+                entry["device_class"] = "door"
+            entries[name] = entry
+        setupdata[IoTsynthetic.sections[self.entity]] = entries
+
+        mean = self.distribution.get("mean", 20.0)
+        # state per entity: the value of a random walk or the phase of a sine,
+        # the payload of switches and binary sensors
+        if "sensor" == self.entity:
+            self.states = {name: (mean if "random-walk" == self.distribution.get("kind")
+                                  else self.rng.uniform(0, 2 * math.pi))
+                           for name in entries}
+        else:
+            self.states = {name: self.payload_off for name in entries}
+
+    def give_runtime_reference(self, runtime) -> None:
+        super().give_runtime_reference(runtime)
+        triggers = self.conf.get("triggers", None)
+        if triggers and triggers.get("rate", 0) > 0 and self.trigger_thread is None:
+            self.trigger_thread = threading.Thread(
+                target=self.__trigger_bursts, daemon=True,
+                name="iot_control_synthetic_{}".format(self.conf["prefix"]))
+            self.trigger_thread.start()
+
+    def __value(self, name: str) -> float:
+        """ private helper, next value of a sensor from the distribution """
+        dist = self.distribution
+        kind = dist.get("kind", "normal")
+        mean = dist.get("mean", 20.0)
+        if "constant" == kind:
+            return mean
+        if "uniform" == kind:
+            return self.rng.uniform(dist.get("low", 0.0), dist.get("high", 100.0))
+        if "sine" == kind:
+            elapsed = time.monotonic() - self.start
+            return mean + dist.get("stddev", 1.0) * math.sin(
+                2 * math.pi * elapsed / dist.get("period", 3600.0) + self.states[name])
+        if "random-walk" == kind:
+            self.states[name] += self.rng.gauss(0.0, dist.get("step", 0.1))
+            return self.states[name]
+        return self.rng.gauss(mean, dist.get("stddev", 1.0))
+
+    def __trigger_bursts(self) -> None:
+        """ private thread sending bursts of triggers, like the callback of a GPIO pin """
+        triggers = self.conf["triggers"]
+        names = list(self.states)
+        while not self.stop.wait(self.rng.expovariate(triggers["rate"])):
+            if self.runtime is None or self.runtime.loop is None:
+                # the event loop isn't running yet
+                continue
+            for _ in range(triggers.get("burst", 1)):
+                if "sensor" != self.entity and names:
+                    name = self.rng.choice(names)
+                    with self.lock:
+                        self.states[name] = self.payload_on \
+                            if self.states[name] == self.payload_off else self.payload_off
+                self.triggers_sent += 1
+                self.runtime.trigger_for_device(self)
+                if self.stop.wait(triggers.get("spacing", 0.01)):
+                    return
+
+    def read_data(self) -> Dict:
+        """ read data """
+        if self.read_time:
+            time.sleep(self.read_time)
+        decimals = self.distribution.get("decimals", 2)
+        with self.lock:
+            if "sensor" == self.entity:
+                return {name: "{:.{}f}".format(self.__value(name), decimals)
+                        for name in self.states}
+            return dict(self.states)
+
+    def sensor_list(self) -> list:
+        return list(self.states)
+
+    def set_state(self, messages: Dict) -> bool:
+        """ switches take payload_on and payload_off """
+        if "switch" != self.entity:
+            return False
+        with self.lock:
+            for name, payload in messages.items():
+                if name in self.states and payload in (self.payload_on, self.payload_off):
+                    self.states[name] = payload
+        return True
+
+    def shutdown(self, _) -> None:
+        """ stop the triggers """
+        self.stop.set()
@@ -17,13 +17,34 @@ class IoTBackendBase(metaclass=ABCMeta):
 
     # each thing will have a config dict
     conf = {}
+    # the name of the backend as given in the config file, set by the runtime
+    name = None
+    # keys of the config as dict of IoTConfigField, IoTConfigEntries and
+    # IoTConfigSection (see iotconfig.py), None if the config isn't checked
+    config_schema = None
+    # False if replay.py must not feed recorded readings into the backend, like one
+    # without time stamps whose server is shared with the running daemon
+    replayable = True
 
     def __init__(self, **kwargs):
         """ Constructor """
 
     @abstractmethod
-    def workon(self, thing: IoTDeviceBase, data: Dict) -> None:
-        """ Abstract method to work on a sensors data """
+    def workon(self, thing: IoTDeviceBase, data: Dict, timestamp: float = None) -> None:
+        """ Abstract method to work on a sensors data, timestamp is the time when the
+        data was read from the device in seconds since the epoch (None means now) """
+
+    def workon_many(self, readings: list) -> None:
+        """ work on several readings (IoTReading objects) at once. Calls workon() for
+        each of them, overwrite if the backend can do better with a batch """
+        for reading in readings:
+            self.workon(reading.device, reading.data, reading.timestamp)
+
+    def workon_spooled(self, readings: list) -> None:
+        """ work on readings (IoTReading objects) that were spooled while the backend
+        was unavailable, oldest first, in batches as they are taken from the spool.
+        Calls workon_many(), overwrite if old data has to be treated differently """
+        self.workon_many(readings)
 
     @abstractmethod
     def announce(self) -> None:
@@ -38,3 +59,27 @@ class IoTBackendBase(metaclass=ABCMeta):
     @abstractmethod
     def register_device(self, device: IoTDeviceBase) -> None:
         """ Abstract method to register a device """
+
+    def announce_device(self, device: IoTDeviceBase) -> None:
+        """ announce a device registered after announce() was called, like when it was
+        added by a reload of the config. Calls announce(), overwrite if the backend can
+        do it for a single device """
+        self.announce()
+
+    def unregister_device(self, device: IoTDeviceBase) -> None:
+        """ forget a device, like when it was removed by a reload of the config.
+        Does nothing, overwrite if the backend keeps anything per device """
+
+    def is_available(self) -> bool:
+        """ can the backend take data again after it raised IoTBackendUnavailable.
+        Asked before spooled data is delivered, may try to reconnect. Returns True,
+        overwrite if the backend can tell """
+        return True
+
+
+class IoTBackendUnavailable(Exception):
+    """exception raised by workon() and workon_many() if the server of the backend
+    can't be reached, the data wasn't delivered and should be tried again later"""
+
+    def __init__(self, msg="backend unavailable"):
+        super().__init__(msg)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" shared I2C buses: one open handle per bus, serialized access and statistics
+
+"""
+
+import contextlib
+import threading
+import time
+from iot_control.iothardware import IoTHardware
+
+
+class IoTI2CBus:
+    """ one I2C bus shared by all drivers using it. The handle is opened on first use
+        and kept open, every call holds the lock of the bus, so a thread sampling at
+        100 Hz and a sensor read by the runtime never interleave their transfers.
+        Several calls which must not be interrupted by others (like starting a
+        conversion and reading its result) go into 'with bus.transaction():'.
+
+        Has the methods of smbus2.SMBus the drivers use, plus write_read() for a
+        register pointer write and a read in one combined transaction (i2c_rdwr).
+
+    Args:
+        port (int): number of the bus, like 1 for /dev/i2c-1
+    """
+
+    def __init__(self, port: int):
+        self.port = port
+        self.handle = None
+        # reentrant, calls inside transaction() take it again
+        self.lock = threading.RLock()
+        self.opened = time.monotonic()
+        # statistics
+        self.transactions = 0
+        self.bytes = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """ hold the bus for several calls, yields the bus """
+        start = time.monotonic()
+        with self.lock:
+            waited = time.monotonic() - start
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+            yield self
+
+    def __call(self, count: int, method: str, *args):
+        """ private helper calling a method of the handle with the lock held
+
+        Args:
+            count (int): bytes transferred, for the statistics
+            method (str): name of the method of smbus2.SMBus
+        """
+        start = time.monotonic()
+        with self.lock:
+            acquired = time.monotonic()
+            waited = acquired - start
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+            handle = self.__open()
+            try:
+                return getattr(handle, method)(*args)
+            except OSError:
+                self.errors += 1
+                raise
+            finally:
+                self.transactions += 1
+                self.bytes += count
+                self.busy_time += time.monotonic() - acquired
+
+    def read_byte(self, address: int) -> int:
+        return self.__call(1, "read_byte", address)
+
+    def write_byte(self, address: int, value: int) -> None:
+        self.__call(1, "write_byte", address, value)
+
+    def read_byte_data(self, address: int, register: int) -> int:
+        return self.__call(2, "read_byte_data", address, register)
+
+    def write_byte_data(self, address: int, register: int, value: int) -> None:
+        self.__call(2, "write_byte_data", address, register, value)
+
+    def read_word_data(self, address: int, register: int) -> int:
+        return self.__call(3, "read_word_data", address, register)
+
+    def write_word_data(self, address: int, register: int, value: int) -> None:
+        self.__call(3, "write_word_data", address, register, value)
+
+    def read_i2c_block_data(self, address: int, register: int, length: int) -> list:
+        return self.__call(1 + length, "read_i2c_block_data", address, register, length)
+
+    def write_i2c_block_data(self, address: int, register: int, data) -> None:
+        self.__call(1 + len(data), "write_i2c_block_data", address, register, data)
+
+    def i2c_rdwr(self, *messages) -> None:
+        """ a combined transaction of smbus2.i2c_msg messages """
+        self.__call(sum(len(m) for m in messages), "i2c_rdwr", *messages)
+
+    def write_read(self, address: int, data, length: int) -> bytes:
+        """ write data (usually a register pointer) and read length bytes in one
+            transaction with a repeated start, without the 32 byte limit of SMBus
+            block reads
+
+        Args:
+            address (int): 7 bit I2C address
+            data: bytes to write
+            length (int): bytes to read
+        """
+        if not hasattr(self.__open(), "i2c_rdwr"):
+            # the old smbus module, only a one byte register pointer works
+            return bytes(self.read_i2c_block_data(address, data[0], length))
+        message = IoTHardware.i2c_msg()
+        read = message.read(address, length)
+        self.i2c_rdwr(message.write(address, bytes(data)), read)
+        return bytes(read)
+
+    def read(self, address: int, length: int) -> bytes:
+        """ read length bytes without writing a register pointer or command first,
+            for chips like the BH1750 which have nothing to address. Needs smbus2.
+
+        Args:
+            address (int): 7 bit I2C address
+            length (int): bytes to read
+        """
+        read = IoTHardware.i2c_msg().read(address, length)
+        self.i2c_rdwr(read)
+        return bytes(read)
+
+    def __open(self):
+        """ private helper opening the handle """
+        with self.lock:
+            if self.handle is None:
+                self.handle = IoTHardware.smbus(self.port)
+            return self.handle
+
+    def utilisation(self) -> float:
+        """ part of the time since the bus was opened it was busy, 0 to 1 """
+        elapsed = time.monotonic() - self.opened
+        return self.busy_time / elapsed if elapsed > 0 else 0.0
+
+    def close(self) -> None:
+        """ close the handle, the next call opens it again """
+        with self.lock:
+            if self.handle is not None:
+                self.handle.close()
+                self.handle = None
+
+
+class IoTBusManager:
+    """ hands out the shared IoTI2CBus for a bus number, drivers call
+        IoTBusManager.bus(port) instead of opening an SMBus of their own
+    """
+
+    buses = {}
+    lock = threading.Lock()
+
+    @classmethod
+    def bus(cls, port: int) -> IoTI2CBus:
+        """ the shared bus, created on first use
+
+        Args:
+            port (int): number of the bus, like 1 for /dev/i2c-1
+        """
+        with cls.lock:
+            if port not in cls.buses:
+                cls.buses[port] = IoTI2CBus(port)
+            return cls.buses[port]
+
+    @classmethod
+    def close_all(cls) -> None:
+        """ close all handles """
+        with cls.lock:
+            for bus in cls.buses.values():
+                bus.close()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" schema for the config file, validation and a cache for the validated config
+
+"""
+
+import hashlib
+import logging
+import marshal
+import os
+import sys
+from typing import Dict
+import yaml
+from iot_control.iotdevicebase import IoTConfigError
+from iot_control.iotfactory import IoTFactory
+
+# the C implementation of the YAML parser is much faster, if it is installed
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# change when the format of the cache file changes
+CACHE_VERSION = 1
+
+NUMBER = (int, float)
+
+
+class IoTConfigField:
+    """ one key in the config
+
+    Args:
+        kind: type or tuple of types the value must have, None for any type
+        required (bool): the key must be given
+        default: value used if the key is not given
+        choices: the allowed values, None for any value
+    """
+
+    def __init__(self, kind=None, required: bool = True, default=None, choices=None):
+        self.kind = kind
+        self.required = required and default is None
+        self.default = default
+        self.choices = choices
+
+
+class IoTConfigEntries:
+    """ a section with freely named entries like 'sensors' or 'switches', each one
+        is a dict checked against the same fields
+
+    Args:
+        fields (Dict): the schema of each entry
+        required (bool): the section must be given
+    """
+
+    def __init__(self, fields: Dict, required: bool = True):
+        self.fields = fields
+        self.required = required
+
+
+class IoTConfigSection:
+    """ a dict with fixed keys inside the config, like 'metrics'
+
+    Args:
+        fields (Dict): the schema of the section
+        required (bool): the section must be given
+    """
+
+    def __init__(self, fields: Dict, required: bool = False):
+        self.fields = fields
+        self.required = required
+
+
+# keys the runtime understands for every device
+DEVICE_FIELDS = {
+    "interval": IoTConfigField(NUMBER, required=False),
+    "bus": IoTConfigField(str, required=False),
+    "read_timeout": IoTConfigField(NUMBER, required=False),
+    "failure_threshold": IoTConfigField(int, required=False),
+    "backoff": IoTConfigField(NUMBER, required=False),
+    "max_backoff": IoTConfigField(NUMBER, required=False),
+    "deadband_abs": IoTConfigField(NUMBER, required=False),
+    "deadband_rel": IoTConfigField(NUMBER, required=False),
+    "heartbeat": IoTConfigField(NUMBER, required=False),
+    "trigger_window": IoTConfigField(NUMBER, required=False),
+    # parameters of the simulated chips, see iot_control.simulation
+    "simulation": IoTConfigField(dict, required=False),
+}
+
+# keys of an entry in the 'sensors' section, used by the runtime and the backends
+SENSOR_FIELDS = {
+    "name": IoTConfigField(str),
+    "unique_id": IoTConfigField(str),
+    "device_class": IoTConfigField(str, required=False),
+    "unit_of_measurement": IoTConfigField(str, required=False),
+    "expire_after": IoTConfigField(NUMBER, required=False),
+    "interval": IoTConfigField(NUMBER, required=False),
+    "deadband_abs": IoTConfigField(NUMBER, required=False),
+    "deadband_rel": IoTConfigField(NUMBER, required=False),
+    "heartbeat": IoTConfigField(NUMBER, required=False),
+}
+
+# keys of an entry of switches, binary sensors, covers and lights
+ENTITY_FIELDS = {
+    "name": IoTConfigField(str),
+    "unique_id": IoTConfigField(str),
+}
+
+# keys the runtime understands for every backend
+BACKEND_FIELDS = {
+    "queue_size": IoTConfigField(int, required=False),
+    "queue_policy": IoTConfigField(str, required=False,
+                                   choices=("block", "drop-oldest", "latest-wins")),
+    # keep the data on disk while the backend is unavailable, sizes in MB
+    "spool": IoTConfigSection({
+        "directory": IoTConfigField(str),
+        "max_size": IoTConfigField(NUMBER, required=False),
+        "segment_size": IoTConfigField(NUMBER, required=False),
+        "flush_interval": IoTConfigField(NUMBER, required=False),
+        "retry_interval": IoTConfigField(NUMBER, required=False),
+    }),
+}
+
+
+def _describe(kind) -> str:
+    """ private helper for the name of a type in a message """
+    if isinstance(kind, tuple):
+        return " or ".join(k.__name__ for k in kind)
+    return kind.__name__
+
+
+def validate(schema: Dict, config, path: str, errors: list, warnings: list) -> Dict:
+    """ check a config dict against a schema and return the normalized copy with
+        defaults filled in. Problems are appended to errors and warnings instead of raising, so all of
+        them can be reported at once.
+
+    Args:
+        schema (Dict): name -> IoTConfigField, IoTConfigEntries or IoTConfigSection
+        config: the config to check
+        path (str): where the config is in the file, for the messages
+        errors (list): gets the messages about things which don't work
+        warnings (list): gets the messages about unknown keys
+    """
+    if config is None:
+        config = {}
+    if not isinstance(config, dict):
+        errors.append("{}: expected a dict, got {!r}".format(path, config))
+        return {}
+
+    result = {}
+    for key, value in config.items():
+        if key not in schema:
+            warnings.append("{}: unknown key '{}'".format(path, key))
+            result[key] = value
+
+    for key, spec in schema.items():
+        where = "{}.{}".format(path, key)
+        if key not in config or config[key] is None:
+            if spec.required:
+                errors.append("{}: '{}' is missing".format(path, key))
+            elif isinstance(spec, IoTConfigField) and spec.default is not None:
+                result[key] = spec.default
+            continue
+        value = config[key]
+
+        if isinstance(spec, IoTConfigEntries):
+            if not isinstance(value, dict):
+                errors.append("{}: expected named entries, got {!r}".format(where, value))
+                continue
+            result[key] = {entry: validate(spec.fields, entry_cfg,
+                                           "{}.{}".format(where, entry), errors, warnings)
+                           for entry, entry_cfg in value.items()}
+        elif isinstance(spec, IoTConfigSection):
+            result[key] = validate(spec.fields, value, where, errors, warnings)
+        else:
+            if spec.kind is not None:
+                kinds = spec.kind if isinstance(spec.kind, tuple) else (spec.kind,)
+                # bool is an int for Python, but not for a config file
+                if not isinstance(value, kinds) or (isinstance(value, bool) and bool not in kinds):
+                    errors.append("{}: expected {}, got {!r}".format(
+                        where, _describe(spec.kind), value))
+                    continue
+            if spec.choices is not None and value not in spec.choices:
+                errors.append("{}: {!r} is not one of {}".format(
+                    where, value, ", ".join(str(c) for c in spec.choices)))
+                continue
+            result[key] = value
+    return result
+
+
+class IoTConfigLoader:
+    """ loads the config file, checks it against the schemas of the runtime, the devices
+        and the backends and reports all errors at once. Devices and backends declare
+        their keys in the class attribute 'config_schema', classes without one are not
+        checked.
+
+        The validated config is cached in 'cache_file' together with the hash of the
+        config file. As long as neither the config file nor the modules of the schemas
+        change, it is taken from there without parsing and checking again.
+
+    Args:
+        runtime_schema (Dict): schema of the 'runtime' section
+        cache_file (str): path of the cache, None to not cache
+    """
+
+    def __init__(self, runtime_schema: Dict, cache_file: str = None):
+        self.logger = logging.getLogger("iot_control")
+        self.runtime_schema = runtime_schema
+        self.cache_file = cache_file
+
+    @staticmethod
+    def __module_files(classes) -> Dict:
+        """ private helper returning the source files of the given classes with their
+            modification times, a change of a schema invalidates the cache
+        """
+        files = {}
+        for cls in classes:
+            module = sys.modules.get(cls.__module__, None)
+            filename = getattr(module, "__file__", None)
+            if filename:
+                files[filename] = os.stat(filename).st_mtime
+        filename = os.path.abspath(__file__)
+        files[filename] = os.stat(filename).st_mtime
+        return files
+
+    def __read_cache(self, digest: str):
+        """ private helper returning the cached config for this hash or None """
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return None
+        try:
+            with open(self.cache_file, "rb") as f:
+                cached = marshal.load(f)
+            if cached["version"] != CACHE_VERSION or cached["hash"] != digest:
+                return None
+            for filename, mtime in cached["files"].items():
+                if os.stat(filename).st_mtime != mtime:
+                    return None
+        except (OSError, EOFError, ValueError, TypeError, KeyError) as exception:
+            self.logger.info("config cache not used: %s", exception)
+            return None
+        return cached
+
+    def __write_cache(self, digest: str, conf: Dict, warnings: list, files: Dict) -> None:
+        """ private helper storing the validated config """
+        if not self.cache_file:
+            return
+        try:
+            data = marshal.dumps({"version": CACHE_VERSION, "hash": digest, "conf": conf,
+                                  "warnings": warnings, "files": files})
+            temp = self.cache_file + ".tmp"
+            with open(temp, "wb") as f:
+                f.write(data)
+            os.replace(temp, self.cache_file)
+        except (OSError, ValueError) as exception:
+            # ValueError: something in the config which marshal doesn't know
+            self.logger.info("cannot cache the config: %s", exception)
+
+    def load(self, configfile: str) -> Dict:
+        """ load, check and normalize the config file
+
+        Args:
+            configfile (str): path of the config file
+
+        Raises:
+            IoTConfigError: with all problems found in the file
+        """
+        self.logger.info("loading config file %s", configfile)
+        with open(configfile, "rb") as stream:
+            raw = stream.read()
+        digest = hashlib.sha256(raw).hexdigest()
+
+        cached = self.__read_cache(digest)
+        if cached is not None:
+            self.logger.info("using the cached config for %s", configfile)
+            for warning in cached["warnings"]:
+                self.logger.warning("config: %s", warning)
+            return cached["conf"]
+
+        try:
+            conf = yaml.load(raw, Loader=YAML_LOADER)
+        except yaml.YAMLError as exc:
+            raise IoTConfigError("Unable to parse configuration file {}: {}".format(
+                configfile, exc)) from exc
+
+        errors = []
+        warnings = []
+        conf, classes = self.__validate(conf, errors, warnings)
+        for warning in warnings:
+            self.logger.warning("config: %s", warning)
+        if errors:
+            raise IoTConfigError("{} error(s) in configuration file {}:\n  {}".format(
+                len(errors), configfile, "\n  ".join(errors)))
+
+        self.__write_cache(digest, conf, warnings, IoTConfigLoader.__module_files(classes))
+        return conf
+
+    def __validate(self, conf, errors: list, warnings: list):
+        """ private helper checking the whole config, returns the normalized config
+            and the classes whose schemas were used
+        """
+        if not isinstance(conf, dict):
+            errors.append("the config file must contain a dict")
+            return {}, []
+
+        result = dict(conf)
+        classes = []
+        result["runtime"] = validate(self.runtime_schema, conf.get("runtime", None),
+                                     "runtime", errors, warnings)
+
+        for section, lookup, common in (("backends", IoTFactory.backend_class, BACKEND_FIELDS),
+                                        ("devices", IoTFactory.device_class, DEVICE_FIELDS)):
+            if not isinstance(conf.get(section, None), dict):
+                errors.append("'{}' is missing".format(section))
+                continue
+            result[section] = {}
+            for name, cfg in conf[section].items():
+                path = "{}.{}".format(section, name)
+                try:
+                    cls = lookup(name)
+                except ImportError as exception:
+                    # not fatal, the runtime skips what it cannot create
+                    warnings.append("{}: {}".format(path, exception))
+                    result[section][name] = cfg
+                    continue
+                if cls is None:
+                    errors.append("{}: unknown kind '{}'".format(path, name.split("%")[0]))
+                    continue
+                classes.append(cls)
+                schema = getattr(cls, "config_schema", None)
+                if schema is None:
+                    result[section][name] = cfg
+                    continue
+                result[section][name] = validate(dict(common, **schema), cfg, path,
+                                                 errors, warnings)
+        return result, classes
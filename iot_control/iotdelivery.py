@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" delivery of data to a backend through a bounded queue and a worker thread
+
+"""
+
+import collections
+import logging
+import threading
+import time
+from iot_control.iotbackendbase import IoTBackendBase, IoTBackendUnavailable
+from iot_control.iotreading import IoTReading
+
+
+class IoTDeliveryQueue:
+    """ bounded queue in front of one backend. The runtime puts data into the queue
+        and a worker thread calls workon() of the backend, so the runtime never waits
+        for a network round trip. What happens when the queue is full is decided by
+        the policy:
+          - 'block': put() waits until there is space again
+          - 'drop-oldest': the oldest data in the queue is thrown away
+          - 'latest-wins': data for a device already waiting in the queue is updated
+            with the new values per entry, so only the latest value of each sensor is
+            delivered. If the queue is full with other devices the oldest is dropped.
+
+        With a spool (IoTSpool) the data is written to disk when the backend raises
+        IoTBackendUnavailable, and so is everything after it as long as the spool isn't
+        empty, to keep the order. Every 'retry_interval' seconds the backend is asked
+        whether it is available again, then the spool is delivered in batches with the
+        original time stamps to workon_spooled() of the backend. Spooled data of devices which don't exist anymore is
+        dropped, 'resolve' finds a device by its name. Without a spool the data is lost.
+    """
+
+    BLOCK = "block"
+    DROP_OLDEST = "drop-oldest"
+    LATEST_WINS = "latest-wins"
+
+    def __init__(self, backend: IoTBackendBase, name: str,
+                 size: int = 1000, policy: str = "drop-oldest", metrics=None,
+                 spool=None, resolve=None, retry_interval: float = 30.0):
+        self.logger = logging.getLogger("iot_control")
+        self.metrics = metrics
+        self.backend = backend
+        self.name = name
+        self.size = max(1, size)
+        if policy not in (IoTDeliveryQueue.BLOCK, IoTDeliveryQueue.DROP_OLDEST,
+                          IoTDeliveryQueue.LATEST_WINS):
+            self.logger.error("unknown queue policy '%s' for backend %s, using '%s'",
+                              policy, name, IoTDeliveryQueue.DROP_OLDEST)
+            policy = IoTDeliveryQueue.DROP_OLDEST
+        self.policy = policy
+
+        self.items = collections.deque()
+        # maximum number of readings handed to the backend at once
+        self.batch_size = 100
+        # with 'latest-wins': the data dict in the queue for each waiting device
+        self.pending = {}
+        self.condition = threading.Condition()
+        self.stopping = False
+        self.spool = spool
+        self.resolve = resolve
+        self.retry_interval = retry_interval
+        # when to ask the backend again whether it is available, what was spooled before
+        # a restart waits until the runtime registered the devices with the backend
+        self.next_retry = time.monotonic() + retry_interval
+
+        # statistics
+        self.max_depth = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self.spooled = 0
+
+        self.thread = threading.Thread(target=self.__run, daemon=True,
+                                       name="iot_control_delivery_" + name)
+        self.thread.start()
+
+    def depth(self) -> int:
+        """ number of waiting items """
+        return len(self.items)
+
+    def put(self, reading: IoTReading) -> None:
+        """ queue a reading for delivery to the backend
+
+        Args:
+            reading (IoTReading): the reading
+        """
+        with self.condition:
+            self.__put(reading)
+            self.condition.notify_all()
+
+    def put_many(self, readings: list) -> None:
+        """ queue several readings at once, the worker thread wakes up once for all of them
+
+        Args:
+            readings (list): the IoTReading objects
+        """
+        with self.condition:
+            for reading in readings:
+                self.__put(reading)
+            self.condition.notify_all()
+
+    def __put(self, reading: IoTReading) -> None:
+        """ private helper queueing one reading, the caller holds the lock """
+        device = reading.device
+        if device in self.pending:
+            # 'latest-wins' and the device is still waiting: just update its values
+            waiting = self.pending[device]
+            waiting.data.update(reading.data)
+            waiting.timestamp = reading.timestamp
+            return
+
+        if len(self.items) >= self.size:
+            if IoTDeliveryQueue.BLOCK == self.policy:
+                # wake up the worker, it might not know about readings put just before
+                self.condition.notify_all()
+                while len(self.items) >= self.size and not self.stopping:
+                    self.condition.wait()
+            else:
+                old = self.items.popleft()
+                self.pending.pop(old.device, None)
+                if self.__drop(1):
+                    self.logger.warning("delivery queue of backend %s is full, "
+                                        "%d items dropped so far", self.name, self.dropped)
+
+        if IoTDeliveryQueue.LATEST_WINS == self.policy:
+            # a copy because it gets updated while waiting
+            reading = reading.with_data(dict(reading.data))
+            self.pending[device] = reading
+        self.items.append(reading)
+        self.max_depth = max(self.max_depth, len(self.items))
+
+    def __spool_wait(self):
+        """ private helper, seconds until spooled data is due, None if there is none """
+        if self.spool is None or self.spool.empty():
+            return None
+        return max(0.0, self.next_retry - time.monotonic())
+
+    def __run(self):
+        """ private worker thread delivering the queued data to the backend """
+        while True:
+            with self.condition:
+                while not self.items and not self.stopping:
+                    wait = self.__spool_wait()
+                    if 0 == wait:
+                        break
+                    self.condition.wait(wait)
+                if not self.items and self.stopping:
+                    break
+                # take everything that is waiting, the backend gets it as one batch
+                batch = self.__take(self.batch_size)
+
+            if self.spool is not None and not self.spool.empty():
+                self.__drain()
+            if not batch:
+                continue
+            if self.spool is not None and not self.spool.empty():
+                # behind what is spooled already
+                self.__to_spool(batch)
+                continue
+            try:
+                self.__deliver(batch)
+            except IoTBackendUnavailable as exception:
+                if self.spool is None:
+                    if self.__drop(len(batch)):
+                        self.logger.warning("backend %s is unavailable, %d items dropped "
+                                            "so far: %s", self.name, self.dropped, exception)
+                    continue
+                self.logger.warning("backend %s is unavailable, spooling: %s",
+                                    self.name, exception)
+                self.next_retry = time.monotonic() + self.retry_interval
+                self.__to_spool(batch)
+            except Exception as exception:
+                self.errors += len(batch)
+                self.logger.error("backend %s failed to work on %d reading(s): %s",
+                                  self.name, len(batch), exception)
+
+        if self.spool is not None:
+            self.spool.close()
+
+    def __take(self, count: int) -> list:
+        """ private helper taking up to count waiting readings, the caller holds the lock """
+        batch = []
+        while self.items and len(batch) < count:
+            reading = self.items.popleft()
+            if self.pending.get(reading.device, None) is reading:
+                del self.pending[reading.device]
+            batch.append(reading)
+        self.condition.notify_all()
+        return batch
+
+    def __deliver(self, batch: list, spooled: bool = False) -> None:
+        """ private helper handing readings to the backend """
+        start = time.monotonic()
+        if spooled:
+            self.backend.workon_spooled(batch)
+        elif 1 == len(batch):
+            self.backend.workon(batch[0].device, batch[0].data, batch[0].timestamp)
+        else:
+            self.backend.workon_many(batch)
+        self.delivered += len(batch)
+        if self.metrics is not None:
+            self.metrics.observe("iot_backend_workon_seconds",
+                                 time.monotonic() - start, {"backend": self.name})
+
+    def __drop(self, count: int) -> bool:
+        """ private helper counting dropped items, tells whether to log it: for the
+            1st, the 101st, the 201st and so on, also if several are dropped at once
+        """
+        before = self.dropped
+        self.dropped += count
+        return (before + 99) // 100 != (self.dropped + 99) // 100
+
+    def __to_spool(self, batch: list) -> None:
+        """ private helper writing readings to the spool """
+        try:
+            self.spool.append(batch)
+            self.spooled += len(batch)
+        except OSError as exception:
+            self.dropped += len(batch)
+            self.logger.error("cannot spool %d reading(s) for backend %s: %s",
+                              len(batch), self.name, exception)
+
+    def __drain(self) -> None:
+        """ private helper delivering the spool if the backend is available again """
+        if time.monotonic() < self.next_retry:
+            return
+        try:
+            available = self.backend.is_available()
+        except Exception as exception:
+            self.logger.debug("backend %s: %s", self.name, exception)
+            available = False
+        if not available:
+            self.next_retry = time.monotonic() + self.retry_interval
+            return
+        self.logger.info("backend %s is available again, delivering %d spooled bytes",
+                         self.name, self.spool.size())
+        while not self.spool.empty() and not self.stopping:
+            # what arrived meanwhile goes behind the spool, nothing is dropped
+            with self.condition:
+                waiting = self.__take(len(self.items))
+            if waiting:
+                self.__to_spool(waiting)
+            records, position = self.spool.peek(self.batch_size)
+            batch = []
+            for name, data, timestamp in records:
+                device = self.resolve(name) if self.resolve is not None else None
+                if device is None:
+                    self.dropped += 1
+                else:
+                    batch.append(IoTReading(device, data, timestamp))
+            try:
+                if batch:
+                    self.__deliver(batch, spooled=True)
+            except IoTBackendUnavailable as exception:
+                self.logger.warning("backend %s is unavailable again: %s", self.name, exception)
+                self.next_retry = time.monotonic() + self.retry_interval
+                return
+            except Exception as exception:
+                self.errors += len(batch)
+                self.logger.error("backend %s failed to work on %d spooled reading(s): %s",
+                                  self.name, len(batch), exception)
+            self.spool.commit(position)
+        self.spool.flush()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """ deliver what is still waiting, but at most for timeout seconds,
+            and stop the worker thread
+
+        Args:
+            timeout (float): time to wait for the worker thread in seconds
+        """
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.thread.join(timeout)
+        self.logger.info("delivery queue of backend %s: %d delivered, %d dropped, "
+                         "%d errors, %d spooled, max. depth %d", self.name, self.delivered,
+                         self.dropped, self.errors, self.spooled, self.max_depth)
@@ -17,6 +17,11 @@ class IoTDeviceBase(metaclass=ABCMeta):
     # each thing will have a config dict
     conf = {}
     runtime = None
+    # the name of the device as given in the config file, set by the runtime
+    name = None
+    # keys of the config as dict of IoTConfigField, IoTConfigEntries and
+    # IoTConfigSection (see iotconfig.py), None if the config isn't checked
+    config_schema = None
 
     def __init__(self, **kwargs):
         """ Constructor """
@@ -30,6 +35,14 @@ class IoTDeviceBase(metaclass=ABCMeta):
         """ give the handle for a scheduled event back to the device after it was schedules by IoTRuntime.
         Ignore by default, overwrite if concrete class want's to do something with it"""
 
+    def bus_id(self):
+        """ name of the bus (like 'i2c-1' or 'gpio') this device talks to when reading.
+        The runtime never reads two devices on the same bus at the same time. None means
+        the device doesn't share a bus with others. Can be overwritten by 'bus' in the config"""
+        if self.conf and "bus" in self.conf:
+            return self.conf["bus"]
+        return None
+
     @abstractmethod
     def read_data(self) -> Dict:
         """ Abstract method to read data """
@@ -51,4 +64,4 @@ class IoTConfigError(Exception):
     """exception raised on a configuration error"""
 
     def __init__(self, msg="error in the config file"):
-        super().__init__()
+        super().__init__(msg)
@@ -6,6 +6,8 @@
 """
 
 from typing import Callable
+import importlib
+import importlib.metadata
 import logging
 from iot_control.iotdevicebase import IoTDeviceBase
 from iot_control.iotbackendbase import IoTBackendBase
@@ -19,6 +21,67 @@ class IoTFactory:
     # internal registry for backends
     backend_registry = {}
 
+    # modules of the built-in device classes and backends. They are imported when a
+    # device or backend of this name is created for the first time, so only the drivers
+    # used in the config file (and their dependencies) are loaded.
+    device_modules = {
+        "ads1115": "iot_control.iot_devices.iotads1115",
+        "bh1750": "iot_control.iot_devices.iotbh1750",
+        "bme280": "iot_control.iot_devices.iotbme280",
+        "bubblesensor": "iot_control.iot_devices.iotbubblesensor",
+        "command_switch": "iot_control.iot_devices.iotcommandswitch",
+        "pcf8591pulses": "iot_control.iot_devices.iotpcf8591pulses",
+        "raspi-binary-sensor": "iot_control.iot_devices.iotraspibinarysensor",
+        "raspi-gpio": "iot_control.iot_devices.iotraspigpio",
+        "raspi-positional-cover": "iot_control.iot_devices.iotraspipositionalcover",
+        "raspi-pwm-light": "iot_control.iot_devices.iotpwmlight",
+        "raspi-state-cover": "iot_control.iot_devices.iotraspistatecover",
+        "synthetic": "iot_control.iot_devices.iotsynthetic",
+    }
+    backend_modules = {
+        "influx": "iot_control.backends.influx",
+        "mqtt_hass": "iot_control.backends.mqtthass",
+    }
+
+    # entry point groups where other packages can provide devices and backends,
+    # the name of the entry point is the name used in the config file
+    device_entry_points = "iot_control.devices"
+    backend_entry_points = "iot_control.backends"
+
+    @ classmethod
+    def __load(cls, name: str, registry: dict, modules: dict, group: str) -> None:
+        """ private helper importing the module which registers name, first from the
+            built-in modules then from the entry points of installed packages
+        """
+        if name in registry:
+            return
+
+        logger = logging.getLogger('iot_control')
+        if name in modules:
+            logger.info("loading module %s for %s", modules[name], name)
+            try:
+                importlib.import_module(modules[name])
+            except ImportError as exception:
+                # most likely a missing optional dependency of this driver
+                raise ImportError("cannot load {} for {}: {}".format(
+                    modules[name], name, exception)) from exception
+            return
+
+        entry_points = importlib.metadata.entry_points()
+        if hasattr(entry_points, "select"):
+            candidates = entry_points.select(group=group, name=name)
+        else:
+            # before Python 3.10
+            candidates = [e for e in entry_points.get(group, []) if e.name == name]
+        for entry_point in candidates:
+            logger.info("loading entry point %s for %s", entry_point.value, name)
+            loaded = entry_point.load()
+            # the entry point can name the class or just the module whose
+            # decorator registers it
+            if name not in registry and isinstance(loaded, type):
+                registry[name] = loaded
+            return
+
     @ classmethod
     def register_device(cls, name: str) -> Callable:
         """ Class method to register Executor class to the internal registry.
@@ -31,8 +94,9 @@ class IoTFactory:
         return inner_wrapper
 
     @ classmethod
-    def create_device(cls, name: str, **kwargs) -> 'IoTDeviceBase':
-        """ Factory command to create the device.
+    def device_class(cls, name: str):
+        """ the class for a device name from the config file or None if there is none,
+            imports its module if needed
         """
 
         # if there is a '%' in the device class then ignore the remainder,
@@ -41,13 +105,21 @@ class IoTFactory:
         if -1 != pos:
             name = name[0:pos]
 
-        if name not in cls.device_registry:
+        cls.__load(name, cls.device_registry, cls.device_modules, cls.device_entry_points)
+        return cls.device_registry.get(name, None)
+
+    @ classmethod
+    def create_device(cls, name: str, **kwargs) -> 'IoTDeviceBase':
+        """ Factory command to create the device.
+        """
+
+        device_class = cls.device_class(name)
+        if device_class is None:
             raise SystemExit(
                 'device {} does not exist in the registry'.format(name))
 
         logger = logging.getLogger('iot_control')
         logger.info("creating device for class %s", name)
-        device_class = cls.device_registry[name]
         device = device_class(**kwargs)
         return device
 
@@ -62,17 +134,25 @@ class IoTFactory:
 
         return inner_wrapper
 
+    @ classmethod
+    def backend_class(cls, name: str):
+        """ the class for a backend name from the config file or None if there is none,
+            imports its module if needed
+        """
+        cls.__load(name, cls.backend_registry, cls.backend_modules, cls.backend_entry_points)
+        return cls.backend_registry.get(name, None)
+
     @ classmethod
     def create_backend(cls, name: str, **kwargs) -> 'IoTBackendBase':
         """ Factory command to create the backend.
         """
 
-        if name not in cls.backend_registry:
+        backend_class = cls.backend_class(name)
+        if backend_class is None:
             raise SystemExit(
                 'backend class {} does not exist in the registry'.format(name))
 
         logger = logging.getLogger('iot_control')
         logger.info("creating backend for class %s", name)
-        backend_class = cls.backend_registry[name]
         backend = backend_class(**kwargs)
         return backend
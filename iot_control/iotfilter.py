@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" filter between reading a device and publishing its data: deadband and heartbeat
+
+"""
+
+from typing import Dict
+
+
+class IoTPublishFilter:
+    """ decides which entries of the data of one device are worth publishing.
+
+        Values of entries in the 'sensors' section are suppressed while they stay within
+        the deadband around the last published value, which is the bigger one of
+        'deadband_abs' and 'deadband_rel' times the last value. All other entries
+        (switches, binary sensors, covers, lights) are states and are suppressed while
+        they don't change. Each entry is published at least every 'heartbeat' seconds,
+        and at least twice within 'expire_after' if a sensor has that, so Home Assistant
+        never marks it as unavailable.
+
+        The settings can be given per entry, in the config of the device or in the
+        'runtime' section of the config file. Entries without any of them are always
+        published.
+    """
+
+    SETTINGS = ("deadband_abs", "deadband_rel", "heartbeat")
+
+    def __init__(self, conf: Dict, defaults: Dict = None):
+        self.conf = conf or {}
+        self.defaults = defaults or {}
+        # settings per entry, created on first use
+        self.settings = {}
+        # last published value and time per entry
+        self.last_value = {}
+        self.last_time = {}
+        self.suppressed = 0
+
+    def __entry_settings(self, entry):
+        """ private helper collecting the settings for one entry """
+        if entry in self.settings:
+            return self.settings[entry]
+
+        entry_cfg = {}
+        is_sensor = False
+        for section, section_cfg in self.conf.items():
+            if isinstance(section_cfg, dict) and isinstance(section_cfg.get(entry, None), dict):
+                entry_cfg = section_cfg[entry]
+                is_sensor = "sensors" == section
+                break
+
+        settings = {}
+        for key in IoTPublishFilter.SETTINGS:
+            for cfg in (entry_cfg, self.conf, self.defaults):
+                if key in cfg:
+                    settings[key] = cfg[key]
+                    break
+
+        if settings and "expire_after" in entry_cfg:
+            half = entry_cfg["expire_after"] / 2.0
+            settings["heartbeat"] = min(settings.get("heartbeat", half), half)
+
+        if settings:
+            settings["numeric"] = is_sensor
+            settings["band_abs"] = settings.get("deadband_abs", 0.0)
+            settings["band_rel"] = settings.get("deadband_rel", 0.0)
+        else:
+            settings = None
+
+        self.settings[entry] = settings
+        return settings
+
+    def __within_deadband(self, settings, last, value) -> bool:
+        """ private helper, True if the new value doesn't differ enough from the last one """
+        if not settings["numeric"]:
+            return last == value
+        try:
+            last = float(last)
+            value = float(value)
+        except (TypeError, ValueError):
+            return last == value
+        band = max(settings["band_abs"], settings["band_rel"] * abs(last))
+        return abs(value - last) <= band
+
+    def filter(self, data: Dict, now: float) -> Dict:
+        """ returns the entries of data which should be published now and
+            remembers them as published
+
+        Args:
+            data (Dict): the data as returned by read_data()
+            now (float): the current time of a monotonic clock
+        """
+        result = {}
+        for entry, value in data.items():
+            settings = self.__entry_settings(entry)
+            if settings is not None and entry in self.last_value:
+                silent = now - self.last_time[entry]
+                if ("heartbeat" not in settings or silent < settings["heartbeat"]) and \
+                        self.__within_deadband(settings, self.last_value[entry], value):
+                    self.suppressed += 1
+                    continue
+            result[entry] = value
+        self.published(result, now)
+        return result
+
+    def published(self, data: Dict, now: float) -> None:
+        """ remember entries which were published without asking filter() before
+
+        Args:
+            data (Dict): the published data
+            now (float): the current time of a monotonic clock
+        """
+        for entry, value in data.items():
+            self.last_value[entry] = value
+            self.last_time[entry] = now
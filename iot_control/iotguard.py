@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" guard for the reads of a device: read deadline and circuit breaker
+
+"""
+
+import logging
+from typing import Dict
+
+
+class IoTDeviceGuard:
+    """ guards the reads of one device. It holds the deadline for a read and works as
+        circuit breaker: after 'failure_threshold' consecutive failures the circuit opens
+        and the device is skipped for 'backoff' seconds. Then it is half open and one
+        read probes the device again. If that one fails too, or there is no result of it
+        after 'read_timeout', the backoff doubles up to 'max_backoff', if it succeeds the
+        circuit is closed again.
+
+        All settings can be given in the 'runtime' section of the config file as default
+        for all devices and in the config of a device for this device only.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    # defaults for the settings
+    read_timeout = 10.0
+    failure_threshold = 3
+    backoff = 30.0
+    max_backoff = 3600.0
+
+    def __init__(self, name: str, defaults: Dict = None, config: Dict = None):
+        self.logger = logging.getLogger("iot_control")
+        self.name = name
+        for key in ("read_timeout", "failure_threshold", "backoff", "max_backoff"):
+            if config and key in config:
+                setattr(self, key, config[key])
+            elif defaults and key in defaults:
+                setattr(self, key, defaults[key])
+
+        self.state = IoTDeviceGuard.CLOSED
+        self.failures = 0
+        self.failures_total = 0
+        self.current_backoff = self.backoff
+        self.retry_at = 0.0
+
+    def allow(self, now: float) -> bool:
+        """ may the device be read now?
+
+        Args:
+            now (float): the current time of a monotonic clock
+        """
+        if IoTDeviceGuard.CLOSED == self.state:
+            return True
+        if IoTDeviceGuard.OPEN == self.state and now >= self.retry_at:
+            self.logger.info("device %s: circuit half open, probing the device", self.name)
+            self.state = IoTDeviceGuard.HALF_OPEN
+            self.retry_at = now
+            return True
+        if IoTDeviceGuard.HALF_OPEN == self.state and now >= self.retry_at + self.read_timeout:
+            # nobody reported the result of the probing read, don't wait for it forever
+            self.failure(now, "no result of the probing read after {} seconds"
+                         .format(self.read_timeout))
+        # either still open or the probing read didn't come back yet
+        return False
+
+    def success(self) -> None:
+        """ report a successful read """
+        if IoTDeviceGuard.CLOSED != self.state:
+            self.logger.warning("device %s is working again, circuit closed", self.name)
+        self.state = IoTDeviceGuard.CLOSED
+        self.failures = 0
+        self.current_backoff = self.backoff
+
+    def failure(self, now: float, reason) -> None:
+        """ report a failed read
+
+        Args:
+            now (float): the current time of a monotonic clock
+            reason: the exception or a text describing what went wrong
+        """
+        self.failures += 1
+        self.failures_total += 1
+        self.logger.warning("device %s: read failed (%d in a row): %s",
+                            self.name, self.failures, reason)
+
+        if IoTDeviceGuard.HALF_OPEN == self.state:
+            self.current_backoff = min(2 * self.current_backoff, self.max_backoff)
+        elif self.failures < self.failure_threshold:
+            return
+
+        self.state = IoTDeviceGuard.OPEN
+        self.retry_at = now + self.current_backoff
+        self.logger.error("device %s: circuit open, skipping it for %.0f seconds",
+                          self.name, self.current_backoff)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" access to the hardware: the real I2C buses and GPIO pins or simulated ones
+
+"""
+
+import logging
+from typing import Dict
+
+
+class IoTHardware:
+    """ the drivers get their I2C buses and GPIO pins from here instead of importing
+        smbus2, smbus or RPi.GPIO themselves. With 'hardware: {mode: simulated}' in the
+        runtime section of the config file everything is simulated (see the package
+        iot_control.simulation), so the real code paths run without a Raspberry Pi.
+        The modules for the real hardware are imported when they are used first.
+    """
+
+    REAL = "real"
+    SIMULATED = "simulated"
+
+    mode = REAL
+    # the IoTSimulation when simulated
+    simulation = None
+    # the real RPi.GPIO module once it was imported
+    gpio_module = None
+
+    @classmethod
+    def select(cls, hardware_cfg: Dict = None) -> None:
+        """ choose real or simulated hardware, must be called before devices are created
+
+        Args:
+            hardware_cfg (Dict): the 'hardware' section of the runtime config, like
+                {mode: simulated, seed: 1, i2c_clock: 100000}
+        """
+        hardware_cfg = hardware_cfg or {}
+        mode = hardware_cfg.get("mode", IoTHardware.REAL)
+        if IoTHardware.SIMULATED == mode:
+            # only needed without real hardware
+            from iot_control.simulation import IoTSimulation
+            if cls.simulation is None:
+                cls.simulation = IoTSimulation(hardware_cfg.get("seed", None),
+                                               hardware_cfg.get("i2c_clock", 100000))
+            logging.getLogger("iot_control").warning("running with simulated hardware")
+        else:
+            cls.simulation = None
+        cls.mode = mode
+
+    @classmethod
+    def smbus(cls, port: int):
+        """ open an I2C bus, returns an object with the interface of smbus2.SMBus
+
+        Args:
+            port (int): number of the bus, like 1 for /dev/i2c-1
+        """
+        if cls.simulation is not None:
+            return cls.simulation.smbus(port)
+        try:
+            import smbus2
+            return smbus2.SMBus(port)
+        except ImportError:
+            # the older package has the same interface for what the drivers use
+            import smbus
+            return smbus.SMBus(port)
+
+    @classmethod
+    def i2c_msg(cls):
+        """ the class for messages of combined transactions with SMBus.i2c_rdwr(),
+            smbus2.i2c_msg or its simulated counterpart
+        """
+        if cls.simulation is not None:
+            from iot_control.simulation.i2c import IoTSimulatedMessage
+            return IoTSimulatedMessage
+        import smbus2
+        return smbus2.i2c_msg
+
+    @classmethod
+    def gpio(cls):
+        """ the RPi.GPIO module or the simulated GPIO bank """
+        if cls.simulation is not None:
+            return cls.simulation.gpio
+        if cls.gpio_module is None:
+            import RPi.GPIO
+            cls.gpio_module = RPi.GPIO
+        return cls.gpio_module
+
+
+class IoTGPIOProxy:
+    """ stands in for the RPi.GPIO module, every attribute is looked up in the module
+        chosen by IoTHardware when it is used, so drivers can keep writing GPIO.output()
+    """
+
+    def __getattr__(self, name):
+        return getattr(IoTHardware.gpio(), name)
+
+
+# drivers use 'from iot_control.iothardware import GPIO' instead of 'import RPi.GPIO as GPIO'
+GPIO = IoTGPIOProxy()
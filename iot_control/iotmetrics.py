@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" runtime metrics and a small endpoint serving them in Prometheus text format
+
+"""
+
+import bisect
+import logging
+import os
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# default buckets for durations in seconds
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class IoTHistogram:
+    """ histogram with fixed buckets, observing a value is one bisect and two additions
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """ add a value """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class IoTMetrics:
+    """ registry for counters, gauges and histograms with labels. Everything is kept in
+        plain dicts under one lock, so recording is cheap enough to be always on. Values
+        which exist elsewhere anyway (like queue depths) are not copied but read by
+        collector functions when the metrics are rendered.
+    """
+
+    COUNTER = "counter"
+    GAUGE = "gauge"
+    HISTOGRAM = "histogram"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # name -> (type, help text, buckets)
+        self.descriptions = {}
+        # name -> {labels: value or IoTHistogram}
+        self.values = {}
+        self.collectors = []
+        self.server = None
+
+    def describe(self, name: str, kind: str, text: str, buckets=LATENCY_BUCKETS) -> None:
+        """ declare a metric
+
+        Args:
+            name (str): name of the metric
+            kind (str): one of COUNTER, GAUGE, HISTOGRAM
+            text (str): help text
+            buckets: upper bounds of the buckets of a histogram
+        """
+        self.descriptions[name] = (kind, text, buckets)
+        self.values.setdefault(name, {})
+
+    @staticmethod
+    def __labels(labels):
+        """ private helper turning a dict of labels into a hashable key """
+        if not labels:
+            return ()
+        return tuple(sorted(labels.items()))
+
+    def inc(self, name: str, labels=None, amount: float = 1) -> None:
+        """ increase a counter """
+        key = IoTMetrics.__labels(labels)
+        with self.lock:
+            values = self.values[name]
+            values[key] = values.get(key, 0) + amount
+
+    def set(self, name: str, value: float, labels=None) -> None:
+        """ set a gauge """
+        key = IoTMetrics.__labels(labels)
+        with self.lock:
+            self.values[name][key] = value
+
+    def observe(self, name: str, value: float, labels=None) -> None:
+        """ add a value to a histogram """
+        key = IoTMetrics.__labels(labels)
+        with self.lock:
+            values = self.values[name]
+            histogram = values.get(key, None)
+            if histogram is None:
+                histogram = IoTHistogram(self.descriptions[name][2])
+                values[key] = histogram
+            histogram.observe(value)
+
+    def add_collector(self, collector) -> None:
+        """ add a function called when rendering, it returns a list of tuples
+            (name, labels dict, value) for metrics declared with describe()
+        """
+        self.collectors.append(collector)
+
+    @staticmethod
+    def __format_labels(key, extra=None):
+        """ private helper for the {label="value"} part """
+        items = list(key)
+        if extra:
+            items.append(extra)
+        if not items:
+            return ""
+        return "{" + ",".join('{}="{}"'.format(
+            k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in items) + "}"
+
+    def render(self) -> str:
+        """ all metrics in Prometheus text format """
+        collected = {}
+        for collector in self.collectors:
+            try:
+                for name, labels, value in collector():
+                    collected.setdefault(name, {})[IoTMetrics.__labels(labels)] = value
+            except Exception as exception:
+                logging.getLogger("iot_control").error("metrics collector failed: %s",
+                                                       exception)
+
+        lines = []
+        with self.lock:
+            for name, (kind, text, buckets) in sorted(self.descriptions.items()):
+                lines.append("# HELP {} {}".format(name, text))
+                lines.append("# TYPE {} {}".format(name, kind))
+                values = dict(self.values.get(name, {}))
+                values.update(collected.get(name, {}))
+                for key, value in sorted(values.items()):
+                    if isinstance(value, IoTHistogram):
+                        cumulative = 0
+                        for bound, count in zip(buckets + ("+Inf",), value.counts):
+                            cumulative += count
+                            lines.append("{}_bucket{} {}".format(
+                                name, IoTMetrics.__format_labels(key, ("le", bound)),
+                                cumulative))
+                        lines.append("{}_sum{} {}".format(
+                            name, IoTMetrics.__format_labels(key), value.sum))
+                        lines.append("{}_count{} {}".format(
+                            name, IoTMetrics.__format_labels(key), value.count))
+                    else:
+                        lines.append("{}{} {}".format(
+                            name, IoTMetrics.__format_labels(key), value))
+        return "\n".join(lines) + "\n"
+
+    def start_server(self, address: str = "127.0.0.1", port: int = None,
+                     path: str = None) -> None:
+        """ serve the metrics via HTTP in a background thread, either on a TCP port
+            or on a Unix socket
+
+        Args:
+            address (str): address to listen on for TCP
+            port (int): TCP port
+            path (str): path of the Unix socket, used instead of the port if given
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """ answers every GET with the metrics """
+
+            def do_GET(self):
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                """ no access log """
+
+        if path:
+            if os.path.exists(path):
+                os.unlink(path)
+
+            class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+                """ HTTP on a Unix socket """
+                daemon_threads = True
+
+                def get_request(self):
+                    request, _ = super().get_request()
+                    # BaseHTTPRequestHandler expects a (host, port) client address
+                    return request, ("local", 0)
+
+            self.server = UnixHTTPServer(path, Handler)
+        else:
+            self.server = ThreadingHTTPServer((address, port), Handler)
+            self.server.daemon_threads = True
+
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True,
+                                  name="iot_control_metrics")
+        thread.start()
+
+    def stop_server(self) -> None:
+        """ stop serving the metrics """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
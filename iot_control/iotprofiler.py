@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" on-demand profiling of the running daemon
+
+"""
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+
+
+class IoTProfiler:
+    """ profiling hooks for the running runtime, triggered by signals:
+          - SIGUSR1 profiles the next 'ticks' regular updates. In mode 'cprofile' the
+            thread of the event loop is profiled with cProfile, in mode 'sampling' the
+            stacks of all threads (MQTT network thread, sampler threads, worker threads)
+            are sampled every 'sample_interval' seconds and written in the folded format
+            flame graph tools understand.
+          - SIGUSR2 writes the stacks of all threads and a tracemalloc snapshot. The first
+            one starts tracemalloc, every further one also lists the growth since the
+            previous snapshot, which is how leaks show up.
+        All files are written to 'directory', next to the log file.
+    """
+
+    def __init__(self, directory: str, ticks: int = 10, mode: str = "cprofile",
+                 sample_interval: float = 0.01, top: int = 25):
+        self.logger = logging.getLogger("iot_control")
+        self.directory = directory
+        self.ticks = ticks
+        if mode not in ("cprofile", "sampling"):
+            self.logger.error("unknown profile mode '%s', using 'cprofile'", mode)
+            mode = "cprofile"
+        self.mode = mode
+        self.sample_interval = sample_interval
+        self.top = top
+
+        self.ticks_left = 0
+        self.profile = None
+        self.sampler = None
+        self.samples = {}
+        self.sampling = False
+        self.snapshot = None
+
+    def __filename(self, kind: str, suffix: str) -> str:
+        """ private helper for the name of an output file """
+        return os.path.join(self.directory, "iot_control-{}-{}.{}".format(
+            kind, time.strftime("%Y%m%d-%H%M%S"), suffix))
+
+    def start_profile(self) -> None:
+        """ start profiling for the next ticks, called by the SIGUSR1 handler """
+        if self.ticks_left > 0:
+            self.logger.warning("profiling is running already, %d ticks left", self.ticks_left)
+            return
+        self.logger.warning("start profiling (%s) for %d ticks", self.mode, self.ticks)
+        self.ticks_left = max(1, self.ticks)
+        if "cprofile" == self.mode:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            self.samples = {}
+            self.sampling = True
+            self.sampler = threading.Thread(target=self.__sample, daemon=True,
+                                            name="iot_control_profiler")
+            self.sampler.start()
+
+    def tick(self) -> None:
+        """ count one regular update, stops profiling after the last one """
+        if self.ticks_left <= 0:
+            return
+        self.ticks_left -= 1
+        if 0 == self.ticks_left:
+            self.stop_profile()
+
+    def stop_profile(self) -> None:
+        """ stop profiling and write the results, raises OSError if they can't be written """
+        self.ticks_left = 0
+        # stopped before the results are written, which may fail
+        profile, self.profile = self.profile, None
+        sampler, self.sampler = self.sampler, None
+        if profile is not None:
+            profile.disable()
+            filename = self.__filename("profile", "prof")
+            profile.dump_stats(filename)
+            text = io.StringIO()
+            pstats.Stats(profile, stream=text).sort_stats("cumulative").print_stats(self.top)
+            with open(self.__filename("profile", "txt"), "w") as f:
+                f.write(text.getvalue())
+            self.logger.warning("profile written to %s", filename)
+
+        if sampler is not None:
+            self.sampling = False
+            sampler.join()
+            filename = self.__filename("samples", "folded")
+            with open(filename, "w") as f:
+                for stack, count in sorted(self.samples.items(), key=lambda item: -item[1]):
+                    f.write("{} {}\n".format(";".join(stack), count))
+            self.logger.warning("%d stack samples written to %s",
+                                sum(self.samples.values()), filename)
+
+    def __sample(self) -> None:
+        """ private sampling thread, counts the stacks of all other threads """
+        me = threading.get_ident()
+        while self.sampling:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                # walk the frames directly, traceback would read the source lines
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append("{}:{}".format(os.path.basename(code.co_filename),
+                                                 code.co_name))
+                    frame = frame.f_back
+                stack = tuple([names.get(ident, str(ident))] + frames[::-1])
+                self.samples[stack] = self.samples.get(stack, 0) + 1
+            time.sleep(self.sample_interval)
+
+    def dump_state(self) -> None:
+        """ write the stacks of all threads and a tracemalloc snapshot,
+            called by the SIGUSR2 handler
+        """
+        filename = self.__filename("stacks", "txt")
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        with open(filename, "w") as f:
+            for ident, frame in sys._current_frames().items():
+                f.write("Thread {} ({}):\n".format(names.get(ident, "?"), ident))
+                f.write("".join(traceback.format_stack(frame)))
+                f.write("\n")
+        self.logger.warning("stacks of all threads written to %s", filename)
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.top)
+            self.logger.warning("tracemalloc started, send SIGUSR2 again to see the growth")
+        snapshot = tracemalloc.take_snapshot()
+        filename = self.__filename("memory", "txt")
+        with open(filename, "w") as f:
+            current, peak = tracemalloc.get_traced_memory()
+            f.write("traced memory: {} bytes, peak {} bytes\n\n".format(current, peak))
+            f.write("top allocations:\n")
+            for stat in snapshot.statistics("lineno")[:self.top]:
+                f.write("{}\n".format(stat))
+            if self.snapshot is not None:
+                f.write("\ngrowth since the last snapshot:\n")
+                for stat in snapshot.compare_to(self.snapshot, "lineno")[:self.top]:
+                    f.write("{}\n".format(stat))
+        self.snapshot = snapshot
+        self.logger.warning("tracemalloc snapshot written to %s", filename)
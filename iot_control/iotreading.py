@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" snapshot of the data read from a device
+
+"""
+
+import time
+from typing import Dict
+from iot_control.iotdevicebase import IoTDeviceBase
+
+
+class IoTReading:
+    """ the data of one read_data() call together with the time it was acquired.
+        It is created once per read and the same object is handed to all backends,
+        so they all get the same values with the same time stamp.
+    """
+
+    __slots__ = ("device", "data", "timestamp")
+
+    def __init__(self, device: IoTDeviceBase, data: Dict, timestamp: float = None):
+        """ Constructor
+
+        Args:
+            device (IoTDeviceBase): the device
+            data (Dict): the data as returned by read_data()
+            timestamp (float): acquisition time in seconds since the epoch, now if not given
+        """
+        self.device = device
+        self.data = data
+        if timestamp is None:
+            timestamp = time.time()
+        self.timestamp = timestamp
+
+    def with_data(self, data: Dict) -> 'IoTReading':
+        """ a reading of the same device and acquisition time but with other data
+
+        Args:
+            data (Dict): the new data
+        """
+        return IoTReading(self.device, data, self.timestamp)
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" append-only binary log of all readings and commands, and a reader for it
+
+"""
+
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+
+# start of every record file
+MAGIC = b"IOTREC\x01\n"
+
+# record types
+SESSION = 0x48
+DEVICE = 0x44
+ENTITY = 0x45
+READING = 0x52
+COMMAND = 0x43
+
+# type and length in front of every record
+RECORD_HEADER = struct.Struct("<BI")
+TIMESTAMP_DEVICE_COUNT = struct.Struct("<dHH")
+DOUBLE = struct.Struct("<d")
+INT = struct.Struct("<q")
+SHORT = struct.Struct("<H")
+UINT = struct.Struct("<I")
+
+
+def encode_value(value) -> bytes:
+    """ a value as tag byte and data, short strings (the usual formatted numbers) and
+        numbers are stored directly, everything else as JSON with a 2 byte length or,
+        from 64 KB on, a 4 byte length
+    """
+    if isinstance(value, bool):
+        return b"b" + bytes([value])
+    if isinstance(value, float):
+        return b"f" + DOUBLE.pack(value)
+    if isinstance(value, int) and -(1 << 63) <= value < (1 << 63):
+        return b"i" + INT.pack(value)
+    if isinstance(value, str):
+        data = value.encode("utf-8")
+        if len(data) < 256:
+            return b"s" + bytes([len(data)]) + data
+    data = json.dumps(value, default=str).encode("utf-8")
+    if len(data) <= 0xFFFF:
+        return b"j" + SHORT.pack(len(data)) + data
+    return b"J" + UINT.pack(len(data)) + data
+
+
+def decode_value(buffer: bytes, position: int):
+    """ the value at position and the position behind it """
+    tag = buffer[position:position + 1]
+    position += 1
+    if b"s" == tag:
+        size = buffer[position]
+        return buffer[position + 1:position + 1 + size].decode("utf-8"), position + 1 + size
+    if b"f" == tag:
+        return DOUBLE.unpack_from(buffer, position)[0], position + DOUBLE.size
+    if b"i" == tag:
+        return INT.unpack_from(buffer, position)[0], position + INT.size
+    if b"b" == tag:
+        return bool(buffer[position]), position + 1
+    if b"j" == tag:
+        size = SHORT.unpack_from(buffer, position)[0]
+        position += SHORT.size
+        return json.loads(buffer[position:position + size].decode("utf-8")), position + size
+    if b"J" == tag:
+        size = UINT.unpack_from(buffer, position)[0]
+        position += UINT.size
+        return json.loads(buffer[position:position + size].decode("utf-8")), position + size
+    raise ValueError("unknown value tag {!r}".format(tag))
+
+
+class IoTRecorder:
+    """ writes every reading and command to an append-only binary file. Devices and
+        entity names are written once per session and referred to by number afterwards,
+        so a reading costs little more than its values. The file is flushed every
+        'flush_interval' seconds, after a crash at most that much is lost and the
+        reader stops at the cut-off record. With 'max_bytes' the file is renamed to
+        '<file>.1' when it gets bigger and a new one is started.
+
+    Args:
+        path (str): the file
+        max_bytes (int): size for starting a new file, 0 for no limit
+        flush_interval (float): seconds between two flushes
+    """
+
+    def __init__(self, path: str, max_bytes: int = 0, flush_interval: float = 1.0):
+        self.logger = logging.getLogger("iot_control")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.file = None
+        self.devices = {}
+        self.entities = {}
+        self.last_flush = time.monotonic()
+        self.records = 0
+        self.__open()
+
+    def __open(self) -> None:
+        """ private helper opening the file and starting a session """
+        self.file = open(self.path, "ab", buffering=65536)
+        if 0 == self.file.tell():
+            self.file.write(MAGIC)
+        self.devices = {}
+        self.entities = {}
+        self.__write(SESSION, DOUBLE.pack(time.time()) + socket.gethostname().encode("utf-8"))
+
+    def __write(self, kind: int, payload: bytes) -> None:
+        """ private helper appending one record """
+        self.file.write(RECORD_HEADER.pack(kind, len(payload)))
+        self.file.write(payload)
+        self.records += 1
+
+    def __device_id(self, device) -> int:
+        """ private helper, number of a device, its config is written on first use """
+        number = self.devices.get(device, None)
+        if number is None:
+            number = len(self.devices)
+            self.devices[device] = number
+            name = (device.name or type(device).__name__).encode("utf-8")
+            conf = json.dumps(device.conf, default=str).encode("utf-8")
+            self.__write(DEVICE, SHORT.pack(number) + SHORT.pack(len(name)) + name + conf)
+        return number
+
+    def __entity_id(self, device_id: int, entity: str) -> int:
+        """ private helper, number of an entity of a device, written on first use """
+        key = (device_id, entity)
+        number = self.entities.get(key, None)
+        if number is None:
+            number = len(self.entities)
+            self.entities[key] = number
+            self.__write(ENTITY, SHORT.pack(device_id) + SHORT.pack(number) +
+                         str(entity).encode("utf-8"))
+        return number
+
+    def __done(self) -> None:
+        """ private helper flushing and rotating after a record """
+        now = time.monotonic()
+        if now - self.last_flush >= self.flush_interval:
+            self.file.flush()
+            self.last_flush = now
+        if self.max_bytes and self.file.tell() > self.max_bytes:
+            self.file.close()
+            os.replace(self.path, self.path + ".1")
+            self.__open()
+
+    def record_reading(self, reading) -> None:
+        """ append a reading
+
+        Args:
+            reading (IoTReading): the reading
+        """
+        with self.lock:
+            if self.file is None:
+                return
+            try:
+                device_id = self.__device_id(reading.device)
+                values = [SHORT.pack(self.__entity_id(device_id, entity)) + encode_value(value)
+                          for entity, value in reading.data.items()]
+                self.__write(READING, TIMESTAMP_DEVICE_COUNT.pack(
+                    reading.timestamp, device_id, len(values)) + b"".join(values))
+                self.__done()
+            except OSError as exception:
+                self.__failed(exception)
+
+    def record_command(self, device, entity: str, value, timestamp: float = None) -> None:
+        """ append a command sent to a device
+
+        Args:
+            device (IoTDeviceBase): the device
+            entity (str): the switch, cover etc.
+            value: the payload of the command
+            timestamp (float): time of the command in seconds since the epoch, now if not given
+        """
+        with self.lock:
+            if self.file is None:
+                return
+            try:
+                device_id = self.__device_id(device)
+                entity_id = self.__entity_id(device_id, entity)
+                self.__write(COMMAND, TIMESTAMP_DEVICE_COUNT.pack(
+                    time.time() if timestamp is None else timestamp, device_id, entity_id) +
+                             encode_value(value))
+                self.__done()
+            except OSError as exception:
+                self.__failed(exception)
+
+    def __failed(self, exception) -> None:
+        """ private helper, stop recording instead of disturbing the runtime """
+        self.logger.error("recording to %s failed, stopped recording: %s", self.path, exception)
+        try:
+            self.file.close()
+        except OSError:
+            pass
+        self.file = None
+
+    def close(self) -> None:
+        """ flush and close the file """
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        self.logger.info("%d records written to %s", self.records, self.path)
+
+
+class IoTRecordReader:
+    """ reads a file written by IoTRecorder and yields its records as tuples:
+          ("session", start time, host name)
+          ("device", name, config)
+          ("reading", timestamp, device name, data)
+          ("command", timestamp, device name, entity, value)
+        A record cut off at the end of the file (after a crash) ends the iteration.
+
+    Args:
+        path (str): the file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.truncated = False
+
+    def __iter__(self):
+        with open(self.path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("{} is not a record file".format(self.path))
+            devices = {}
+            entities = {}
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    self.truncated = bool(header)
+                    return
+                kind, length = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length:
+                    self.truncated = True
+                    return
+                if SESSION == kind:
+                    devices = {}
+                    entities = {}
+                    yield ("session", DOUBLE.unpack_from(payload)[0],
+                           payload[DOUBLE.size:].decode("utf-8"))
+                elif DEVICE == kind:
+                    number, size = struct.unpack_from("<HH", payload)
+                    name = payload[4:4 + size].decode("utf-8")
+                    devices[number] = name
+                    yield ("device", name, json.loads(payload[4 + size:].decode("utf-8")))
+                elif ENTITY == kind:
+                    device_id, number = struct.unpack_from("<HH", payload)
+                    entities[(device_id, number)] = payload[4:].decode("utf-8")
+                elif READING == kind:
+                    timestamp, device_id, count = TIMESTAMP_DEVICE_COUNT.unpack_from(payload)
+                    position = TIMESTAMP_DEVICE_COUNT.size
+                    data = {}
+                    for _ in range(count):
+                        number = SHORT.unpack_from(payload, position)[0]
+                        value, position = decode_value(payload, position + SHORT.size)
+                        data[entities[(device_id, number)]] = value
+                    yield ("reading", timestamp, devices[device_id], data)
+                elif COMMAND == kind:
+                    timestamp, device_id, number = TIMESTAMP_DEVICE_COUNT.unpack_from(payload)
+                    value, _ = decode_value(payload, TIMESTAMP_DEVICE_COUNT.size)
+                    yield ("command", timestamp, devices[device_id],
+                           entities[(device_id, number)], value)
+                # unknown record types of newer versions are skipped
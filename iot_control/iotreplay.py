@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" feeds a recorded log back through the backends
+
+"""
+
+import fnmatch
+import logging
+import time
+from typing import Dict
+from iot_control.iotdevicebase import IoTDeviceBase
+from iot_control.iotfactory import IoTFactory
+from iot_control.iotdelivery import IoTDeliveryQueue
+from iot_control.iotfilter import IoTPublishFilter
+from iot_control.iotreading import IoTReading
+from iot_control.iotrecorder import IoTRecordReader
+
+
+class IoTReplayDevice(IoTDeviceBase):
+    """ stands in for a recorded device, with its recorded config but without hardware
+    """
+
+    # config sections with the entities of a device
+    sections = ("sensors", "switches", "binary-sensors", "statecovers", "poscovers",
+                "pwmlights")
+
+    def __init__(self, name: str, conf: Dict):
+        super().__init__()
+        self.name = name
+        self.conf = conf
+
+    def read_data(self) -> Dict:
+        """ nothing to read, the data comes from the log """
+        return {}
+
+    def sensor_list(self) -> list:
+        for section in IoTReplayDevice.sections:
+            if section in self.conf:
+                return list(self.conf[section])
+        return []
+
+    def set_state(self, _) -> bool:
+        """ commands aren't executed during a replay """
+        return False
+
+    def shutdown(self, _) -> None:
+        """ nothing to do """
+
+
+class IoTReplay:
+    """ replays recorded readings through the backends of a config file, at the
+        recorded pace times 'speed' or as fast as possible with speed 0. The readings
+        keep their recorded time stamps, so InfluxDB gets them at the time they were
+        taken. Like the runtime the deadband filter of the config is applied, unless
+        'unfiltered' is set. Recorded commands are counted but not replayed, the
+        readings after them carry the new states. Backends which aren't 'replayable',
+        like MQTT, are skipped.
+
+    Args:
+        conf (Dict): the checked config, its backends and runtime section are used
+        backends (list): names of the backends to use, None for all
+        speed (float): factor for the recorded pace, 0 for as fast as possible
+        start (float): skip readings before this time (seconds since the epoch)
+        end (float): stop at this time
+        devices (list): patterns of the device names to replay, None for all
+        unfiltered (bool): deliver every reading without the deadband filter
+    """
+
+    def __init__(self, conf: Dict, backends: list = None, speed: float = 1.0,
+                 start: float = None, end: float = None, devices: list = None,
+                 unfiltered: bool = False):
+        self.logger = logging.getLogger("iot_control")
+        self.conf = conf
+        self.runtime_cfg = conf.get("runtime", None) or {}
+        self.speed = speed
+        self.start = start
+        self.end = end
+        self.patterns = devices
+        self.unfiltered = unfiltered
+        self.devices = {}
+        self.filters = {}
+        self.backends = []
+        self.queues = {}
+        self.readings = 0
+        self.commands = 0
+        self.suppressed = 0
+
+        for name, backend_cfg in conf["backends"].items():
+            if backends and name not in backends:
+                continue
+            backend_class = IoTFactory.backend_class(name)
+            if backend_class is not None and not backend_class.replayable:
+                self.logger.warning("backend %s can't be used for a replay, skipped", name)
+                continue
+            backend = IoTFactory.create_backend(name, config=backend_cfg)
+            backend.name = name
+            self.backends.append(backend)
+            # nothing may get lost, the replay waits for slow backends instead
+            self.queues[backend] = IoTDeliveryQueue(backend, name, 1000, IoTDeliveryQueue.BLOCK)
+        if not self.backends:
+            self.logger.error("no backend to replay to")
+
+    def __device(self, name: str, conf: Dict) -> None:
+        """ private helper announcing a recorded device, a device with the same name
+            but another config replaces the old one. The old one isn't unregistered,
+            the backends keep what they know about it
+        """
+        old = self.devices.get(name, None)
+        if old is not None and old.conf == conf:
+            return
+        device = IoTReplayDevice(name, conf)
+        self.devices[name] = device
+        self.filters[name] = IoTPublishFilter(conf, self.runtime_cfg)
+        for backend in self.backends:
+            backend.register_device(device)
+            backend.announce_device(device)
+
+    def __selected(self, name: str) -> bool:
+        """ private helper, is the device to be replayed """
+        return not self.patterns or any(fnmatch.fnmatch(name, p) for p in self.patterns)
+
+    def run(self, paths: list) -> None:
+        """ replay the record files one after the other
+
+        Args:
+            paths (list): the files
+        """
+        first = None
+        began = time.monotonic()
+        for path in paths:
+            reader = IoTRecordReader(path)
+            for record in reader:
+                if "device" == record[0]:
+                    if self.__selected(record[1]):
+                        self.__device(record[1], record[2])
+                    continue
+                if record[0] not in ("reading", "command"):
+                    continue
+                timestamp, name = record[1], record[2]
+                if name not in self.devices or not self.__selected(name):
+                    continue
+                if self.start is not None and timestamp < self.start:
+                    continue
+                if self.end is not None and timestamp > self.end:
+                    break
+                if "command" == record[0]:
+                    self.commands += 1
+                    continue
+
+                if first is None:
+                    first = timestamp
+                elif self.speed > 0:
+                    delay = began + (timestamp - first) / self.speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+
+                data = record[3]
+                if not self.unfiltered:
+                    published = self.filters[name].filter(data, timestamp)
+                    self.suppressed += len(data) - len(published)
+                    data = published
+                if data:
+                    reading = IoTReading(self.devices[name], data, timestamp)
+                    for backend in self.backends:
+                        self.queues[backend].put(reading)
+                    self.readings += 1
+            if reader.truncated:
+                self.logger.warning("%s ends with an incomplete record", path)
+
+    def shutdown(self) -> None:
+        """ wait until everything is delivered and shut the backends down """
+        for backend in self.backends:
+            queue = self.queues[backend]
+            while queue.depth():
+                time.sleep(0.05)
+            queue.stop()
+            backend.shutdown()
+        self.logger.info("replayed %d readings, %d entries suppressed, %d commands skipped",
+                         self.readings, self.suppressed, self.commands)
@@ -5,25 +5,32 @@
 
 """
 
+import copy
+import os
 import sys
 import logging
 import asyncio
 import functools
 import signal
-import yaml
-import iot_control.iot_devices.iotads1115
-import iot_control.iot_devices.iotbme280
-import iot_control.iot_devices.iotbh1750
-import iot_control.iot_devices.iotraspigpio
-import iot_control.iot_devices.iotcommandswitch
-import iot_control.iot_devices.iotpcf8591pulses
-import iot_control.iot_devices.iotraspibinarysensor
-import iot_control.iot_devices.iotraspistatecover
-import iot_control.iot_devices.iotraspipositionalcover
-import iot_control.iot_devices.iotpwmlight
-import iot_control.backends.influx
-import iot_control.backends.mqtthass
+import threading
+import time
+import concurrent.futures
+# the modules of the devices and backends are imported by IoTFactory when needed
 from iot_control.iotfactory import IoTFactory
+from iot_control.iotdevicebase import IoTConfigError
+from iot_control.iotconfig import IoTConfigLoader, IoTConfigField, IoTConfigSection, \
+    DEVICE_FIELDS, BACKEND_FIELDS, NUMBER
+from iot_control.iotscheduler import IoTScheduler
+from iot_control.iotguard import IoTDeviceGuard
+from iot_control.iotfilter import IoTPublishFilter
+from iot_control.iotdelivery import IoTDeliveryQueue
+from iot_control.iotreading import IoTReading
+from iot_control.iotmetrics import IoTMetrics
+from iot_control.iotprofiler import IoTProfiler
+from iot_control.iothardware import IoTHardware
+from iot_control.iotbus import IoTBusManager
+from iot_control.iotrecorder import IoTRecorder
+from iot_control.iotspool import IoTSpool
 
 
 class IoTRuntime:
@@ -35,12 +42,74 @@ class IoTRuntime:
     devices = []
     update_intervall = 60
     loop = None
+    # 'serial' reads all devices one after the other in the thread of the event loop,
+    # 'concurrent' reads them in a pool of worker threads, one at a time per bus
+    polling = "serial"
+    executor = None
+    bus_locks = {}
+    # locks of the devices without a bus, so no device is ever read twice at once
+    device_locks = {}
+    reads_in_flight = set()
+    # reads which ran into their deadline but didn't return yet
+    late_reads = set()
+    guards = {}
+    filters = {}
+    # delivery queue for every backend
+    queues = {}
+    # devices with a triggered update queued or running, the value tells if
+    # more triggers arrived meanwhile and one more update is needed
+    triggers_pending = {}
+    trigger_lock = threading.Lock()
+    triggers_coalesced = 0
+    # readings of triggered updates waiting to be delivered together
+    trigger_batch = []
+    # seconds after a triggered update during which further triggers are merged
+    trigger_window = 0.0
+    scheduler = None
+    update_handle = None
+    # sensor entries per device which have an interval of their own
+    timed_entries = {}
+    # warn if a regular update fires later than this many seconds
+    drift_warning = 1.0
+    # IoTRecorder writing all readings and commands, None if not recording
+    recorder = None
+
+    # keys of the 'runtime' section of the config file, the settings for devices
+    # and backends given there are their defaults
+    config_schema = {
+        "polling": IoTConfigField(str, required=False, choices=("serial", "concurrent")),
+        "workers": IoTConfigField(int, required=False),
+        "drift_warning": IoTConfigField(NUMBER, required=False),
+        "metrics": IoTConfigSection({
+            "address": IoTConfigField(str, required=False),
+            "port": IoTConfigField(int, required=False),
+            "socket": IoTConfigField(str, required=False),
+        }),
+        "profile_ticks": IoTConfigField(int, required=False),
+        "profile_mode": IoTConfigField(str, required=False, choices=("cprofile", "sampling")),
+        "hardware": IoTConfigSection({
+            "mode": IoTConfigField(str, required=False, choices=("real", "simulated")),
+            "seed": IoTConfigField(int, required=False),
+            "i2c_clock": IoTConfigField(int, required=False),
+        }),
+        # log of all readings and commands for replay.py, 'max_size' in MB
+        "record": IoTConfigSection({
+            "file": IoTConfigField(str),
+            "max_size": IoTConfigField(NUMBER, required=False),
+            "flush_interval": IoTConfigField(NUMBER, required=False),
+        }),
+    }
+    config_schema.update({key: DEVICE_FIELDS[key] for key in (
+        "read_timeout", "failure_threshold", "backoff", "max_backoff", "deadband_abs",
+        "deadband_rel", "heartbeat", "trigger_window")})
+    config_schema.update(BACKEND_FIELDS)
 
     def __init__(self, configfile: str, log_level=logging.WARNING):
 
         self.logger = logging.getLogger('iot_control')
         self.logger.setLevel(log_level)
         filehandler = logging.FileHandler('iot_control.log')
+        self.log_directory = os.path.dirname(os.path.abspath(filehandler.baseFilename))
         filehandler.setLevel(log_level)
         self.logger.addHandler(filehandler)
         formatter = logging.Formatter(
@@ -53,48 +122,410 @@ class IoTRuntime:
         # logger.error('Fehlermeldung')
         # logger.critical('Schwerer Fehler')
 
-        self.logger.info("loading config file %s", configfile)
-        with open(configfile, 'r') as stream:
+        self.configfile = configfile
+        # the checked config is cached next to the log file
+        self.config_loader = IoTConfigLoader(IoTRuntime.config_schema,
+                                             os.path.join(self.log_directory, "iot_control.cache"))
+        self.conf = self.__load_config(configfile)
+        if self.conf is None:
+            sys.exit(1)
+        # the config as it was loaded, to find out what changed on a reload
+        self.loaded_conf = copy.deepcopy(self.conf)
+        # optional settings of the runtime itself
+        self.__apply_runtime_cfg()
+        runtime_cfg = self.runtime_cfg
+        IoTHardware.select(runtime_cfg.get("hardware", None))
+        if "record" in runtime_cfg and runtime_cfg["record"]:
+            record_cfg = runtime_cfg["record"]
             try:
-                self.conf = yaml.load(stream, Loader=yaml.SafeLoader)
-            except yaml.YAMLError as exc:
-                self.logger.critical(exc)
-                self.logger.critical(
-                    "Unable to parse configuration file %s", configfile)
-                sys.exit(1)
+                self.recorder = IoTRecorder(record_cfg["file"],
+                                            int(record_cfg.get("max_size", 0) * 1024 * 1024),
+                                            record_cfg.get("flush_interval", 1.0))
+                self.logger.info("recording to %s", record_cfg["file"])
+            except OSError as exception:
+                self.logger.error("cannot record: %s", exception)
+        if "polling" in runtime_cfg:
+            self.polling = runtime_cfg["polling"]
+        if self.polling not in ("serial", "concurrent"):
+            self.logger.error("unknown polling mode '%s', using 'serial'", self.polling)
+            self.polling = "serial"
+        self.metrics = IoTMetrics()
+        self.__describe_metrics()
+        self.profiler = IoTProfiler(self.log_directory,
+                                    runtime_cfg.get("profile_ticks", 10),
+                                    runtime_cfg.get("profile_mode", "cprofile"))
         # first: build backends
         for backend in self.conf["backends"]:
-            self.logger.info("creating backend %s", backend)
-            backend_cfg = self.conf["backends"][backend]
-            try:
-                self.backends.append(IoTFactory.create_backend(
-                    backend, config=backend_cfg))
-            except Exception as exception:
-                self.logger.error(
-                    "error creating backend: %s", exception)
+            self.__add_backend(backend, self.conf["backends"][backend])
         sys.stdout.flush()
         if not self.backends:
             self.logger.critical("no backends available")
             sys.exit(1)
             # second: register devices with backend
         for device in self.conf["devices"]:
-            self.logger.info("creating device %s", device)
-            device_cfg = self.conf["devices"][device]
-            try:
-                real_device = IoTFactory.create_device(
-                    device, config=device_cfg)
-                real_device.give_runtime_reference(self)
-                self.devices.append(real_device)
-                for backend in self.backends:
-                    backend.register_device(real_device)
-            except Exception as exception:
-                self.logger.error(
-                    "error creating device: %s", exception)
+            self.__add_device(device, self.conf["devices"][device])
         for backend in self.backends:
             backend.announce()
 
+        if "concurrent" == self.polling:
+            # by default one worker per bus plus one for each device without a bus,
+            # then the duration of one update is bounded by the slowest bus
+            workers = len(self.bus_locks) + \
+                len([d for d in self.devices if d.bus_id() is None])
+            if "workers" in runtime_cfg:
+                workers = runtime_cfg["workers"]
+            self.logger.info("concurrent polling with %d worker threads", workers)
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(1, workers), thread_name_prefix="iot_control_poll")
+
+    def __load_config(self, configfile):
+        """ private helper loading and checking the config file, returns None if
+            there are errors in it
+
+        Args:
+            configfile (str): path of the config file
+        """
+        try:
+            return self.config_loader.load(configfile)
+        except IoTConfigError as exception:
+            self.logger.critical(exception)
+            return None
+
+    def __apply_runtime_cfg(self):
+        """ private helper taking the settings from the runtime section of the config
+            which can change while running
+        """
+        self.runtime_cfg = {}
+        if "runtime" in self.conf and self.conf["runtime"]:
+            self.runtime_cfg = self.conf["runtime"]
+        self.drift_warning = self.runtime_cfg.get("drift_warning", IoTRuntime.drift_warning)
+        self.trigger_window = self.runtime_cfg.get("trigger_window", IoTRuntime.trigger_window)
+
+    def __add_backend(self, name, backend_cfg):
+        """ private helper creating a backend with its delivery queue,
+            returns None if that fails
+
+        Args:
+            name (str): name of the backend in the config file
+            backend_cfg (Dict): config of the backend
+        """
+        self.logger.info("creating backend %s", name)
+        try:
+            real_backend = IoTFactory.create_backend(name, config=backend_cfg)
+            real_backend.name = name
+            self.backends.append(real_backend)
+            self.queues[real_backend] = self.__create_queue(real_backend, backend_cfg)
+            return real_backend
+        except Exception as exception:
+            self.logger.error(
+                "error creating backend: %s", exception)
+            return None
+
+    def __remove_backend(self, backend):
+        """ private helper delivering what is still queued for a backend and shutting it down
+
+        Args:
+            backend (IoTBackendBase): the backend
+        """
+        self.backends.remove(backend)
+        self.queues.pop(backend).stop()
+        try:
+            backend.shutdown()
+        except Exception as exception:
+            self.logger.error("error shutting down backend %s: %s", backend.name, exception)
+
+    def __add_device(self, name, device_cfg):
+        """ private helper creating a device and registering it with all backends,
+            returns None if that fails
+
+        Args:
+            name (str): name of the device in the config file
+            device_cfg (Dict): config of the device
+        """
+        self.logger.info("creating device %s", name)
+        try:
+            if IoTHardware.simulation is not None:
+                IoTHardware.simulation.attach_device(name.split("%")[0], device_cfg)
+            real_device = IoTFactory.create_device(
+                name, config=device_cfg)
+            real_device.name = name
+            real_device.give_runtime_reference(self)
+            self.devices.append(real_device)
+            self.guards[real_device] = IoTDeviceGuard(name, self.runtime_cfg, device_cfg)
+            self.filters[real_device] = IoTPublishFilter(device_cfg, self.runtime_cfg)
+            bus = real_device.bus_id()
+            if bus is None:
+                self.device_locks[real_device] = threading.Lock()
+            elif bus not in self.bus_locks:
+                self.bus_locks[bus] = threading.Lock()
+            for backend in self.backends:
+                backend.register_device(real_device)
+            return real_device
+        except Exception as exception:
+            self.logger.error(
+                "error creating device: %s", exception)
+            return None
+
+    def __remove_device(self, device):
+        """ private helper unscheduling a device, removing it from all backends and
+            shutting it down. A read still running in a worker thread is ignored when
+            it comes back.
+
+        Args:
+            device (IOTdevicebase): the device
+        """
+        self.devices.remove(device)
+        if self.scheduler is not None:
+            for job in self.scheduler.jobs():
+                if job[0] is device:
+                    self.scheduler.remove(job)
+        for backend in self.backends:
+            backend.unregister_device(device)
+        with self.trigger_lock:
+            self.triggers_pending.pop(device, None)
+        self.guards.pop(device, None)
+        self.filters.pop(device, None)
+        self.timed_entries.pop(device, None)
+        self.device_locks.pop(device, None)
+        try:
+            device.shutdown(None)
+        except Exception as exception:
+            self.logger.error("error shutting down device %s: %s", device.name, exception)
+
+    def reload_config(self):
+        """ read the config file again and apply only what changed: devices and backends
+            which were removed or whose config changed are shut down, new and changed ones
+            are created and announced. All others keep running untouched, with their
+            connections, sampling threads and scheduled events.
+        """
+        self.logger.warning("reloading config file %s", self.configfile)
+        try:
+            conf = self.__load_config(self.configfile)
+        except OSError as exception:
+            self.logger.error("cannot read config file: %s", exception)
+            conf = None
+        if not conf:
+            self.logger.error("config not reloaded, keeping the running one")
+            return
+
+        old = self.loaded_conf
+        old_runtime_cfg = old.get("runtime", None) or {}
+        self.conf = conf
+        self.loaded_conf = copy.deepcopy(conf)
+        self.__apply_runtime_cfg()
+        runtime_changed = old_runtime_cfg != self.runtime_cfg
+        for key in ("polling", "workers", "metrics", "profile_ticks", "profile_mode",
+                    "hardware", "record"):
+            if old_runtime_cfg.get(key, None) != self.runtime_cfg.get(key, None):
+                self.logger.warning("changing '%s' needs a restart", key)
+
+        # first: shut down what was removed or changed
+        for backend in list(self.backends):
+            if old["backends"][backend.name] != conf["backends"].get(backend.name, None):
+                self.logger.warning("removing backend %s", backend.name)
+                self.__remove_backend(backend)
+        for device in list(self.devices):
+            if old["devices"][device.name] != conf["devices"].get(device.name, None):
+                self.logger.warning("removing device %s", device.name)
+                self.__remove_device(device)
+            elif runtime_changed:
+                # the defaults in the runtime section might be different now
+                self.guards[device] = IoTDeviceGuard(device.name, self.runtime_cfg, device.conf)
+                self.filters[device] = IoTPublishFilter(device.conf, self.runtime_cfg)
+
+        # second: create the new devices and announce them to the running backends
+        running = [device.name for device in self.devices]
+        now = self.loop.time()
+        for name, device_cfg in conf["devices"].items():
+            if name in running:
+                continue
+            self.logger.warning("adding device %s", name)
+            device = self.__add_device(name, device_cfg)
+            if device is None:
+                continue
+            for backend in self.backends:
+                backend.announce_device(device)
+            self.__schedule_device(device, now)
+
+        # third: create the new backends, they get all devices
+        running = [backend.name for backend in self.backends]
+        for name, backend_cfg in conf["backends"].items():
+            if name in running:
+                continue
+            self.logger.warning("adding backend %s", name)
+            backend = self.__add_backend(name, backend_cfg)
+            if backend is None:
+                continue
+            for device in self.devices:
+                backend.register_device(device)
+            backend.announce()
+        if not self.backends:
+            self.logger.critical("no backends available")
+
+        # new devices are due right away
+        if self.update_handle is not None:
+            self.update_handle.cancel()
+        self.update_handle = self.loop.call_soon(IoTRuntime.regular_update, self, self.loop)
+
+    def __create_queue(self, backend, backend_cfg):
+        """ private helper creating the delivery queue for a backend, 'queue_size',
+            'queue_policy' and 'spool' come from the config of the backend or the
+            runtime section
+
+        Args:
+            backend (IoTBackendBase): the backend
+            backend_cfg (Dict): config of the backend
+        """
+        settings = {"queue_size": 1000, "queue_policy": IoTDeliveryQueue.DROP_OLDEST,
+                    "spool": None}
+        for key in settings:
+            if backend_cfg and key in backend_cfg:
+                settings[key] = backend_cfg[key]
+            elif key in self.runtime_cfg:
+                settings[key] = self.runtime_cfg[key]
+        spool = None
+        spool_cfg = settings["spool"]
+        if spool_cfg:
+            # one directory per backend, the section may come from the runtime section
+            directory = os.path.join(spool_cfg["directory"], backend.name)
+            try:
+                spool = IoTSpool(directory,
+                                 int(spool_cfg.get("max_size", 100) * 1024 * 1024),
+                                 int(spool_cfg.get("segment_size", 4) * 1024 * 1024),
+                                 spool_cfg.get("flush_interval", 5.0))
+            except OSError as exception:
+                self.logger.error("cannot spool for backend %s: %s", backend.name, exception)
+        return IoTDeliveryQueue(backend, backend.name,
+                                settings["queue_size"], settings["queue_policy"], self.metrics,
+                                spool, self.__device_by_name,
+                                spool_cfg.get("retry_interval", 30.0) if spool_cfg else 30.0)
+
+    def __device_by_name(self, name):
+        """ private helper finding a device by its name in the config file, None if
+            there is none, called by the delivery queues for spooled data
+
+        Args:
+            name (str): the name
+        """
+        # a copy, a reload of the config might change the list meanwhile
+        for device in list(self.devices):
+            if device.name == name:
+                return device
+        return None
+
+    def __describe_metrics(self):
+        """ private helper declaring all metrics of the runtime """
+        metrics = self.metrics
+        metrics.describe("iot_read_seconds", IoTMetrics.HISTOGRAM,
+                         "duration of read_data() per device in seconds")
+        metrics.describe("iot_read_errors_total", IoTMetrics.COUNTER,
+                         "reads which raised an exception per device")
+        metrics.describe("iot_read_timeouts_total", IoTMetrics.COUNTER,
+                         "reads which missed their deadline per device")
+        metrics.describe("iot_update_drift_seconds", IoTMetrics.HISTOGRAM,
+                         "how late regular updates fired in seconds")
+        metrics.describe("iot_updates_missed_total", IoTMetrics.COUNTER,
+                         "regular updates skipped because the runtime was too late")
+        metrics.describe("iot_loop_lag_seconds", IoTMetrics.HISTOGRAM,
+                         "lag of the event loop in seconds, probed every second")
+        metrics.describe("iot_backend_workon_seconds", IoTMetrics.HISTOGRAM,
+                         "duration of workon() per backend in seconds")
+        metrics.describe("iot_backend_queue_depth", IoTMetrics.GAUGE,
+                         "readings waiting in the delivery queue per backend")
+        metrics.describe("iot_backend_delivered_total", IoTMetrics.COUNTER,
+                         "readings delivered per backend")
+        metrics.describe("iot_backend_dropped_total", IoTMetrics.COUNTER,
+                         "readings dropped because the delivery queue was full")
+        metrics.describe("iot_backend_errors_total", IoTMetrics.COUNTER,
+                         "readings the backend failed to work on")
+        metrics.describe("iot_backend_spooled_total", IoTMetrics.COUNTER,
+                         "readings written to the spool while the backend was unavailable")
+        metrics.describe("iot_backend_spool_bytes", IoTMetrics.GAUGE,
+                         "bytes in the spool waiting for the backend")
+        metrics.describe("iot_i2c_transactions_total", IoTMetrics.COUNTER,
+                         "transactions on the shared I2C bus")
+        metrics.describe("iot_i2c_bytes_total", IoTMetrics.COUNTER,
+                         "bytes transferred on the shared I2C bus")
+        metrics.describe("iot_i2c_errors_total", IoTMetrics.COUNTER,
+                         "transactions on the shared I2C bus which failed")
+        metrics.describe("iot_i2c_busy_seconds_total", IoTMetrics.COUNTER,
+                         "seconds the I2C bus was busy, its rate is the utilisation")
+        metrics.describe("iot_i2c_wait_seconds_total", IoTMetrics.COUNTER,
+                         "seconds drivers waited for the I2C bus")
+        metrics.describe("iot_device_circuit_open", IoTMetrics.GAUGE,
+                         "1 if the circuit breaker of the device is open or half open")
+        metrics.describe("iot_device_failures_total", IoTMetrics.COUNTER,
+                         "failed reads per device as seen by the circuit breaker")
+        metrics.describe("iot_published_suppressed_total", IoTMetrics.COUNTER,
+                         "values not published because of deadband or unchanged state")
+        metrics.describe("iot_triggers_coalesced_total", IoTMetrics.COUNTER,
+                         "triggers merged into an already pending update")
+        metrics.add_collector(self.__collect_metrics)
+
+    def __collect_metrics(self):
+        """ private helper reading the metrics which are counted elsewhere anyway """
+        result = []
+        # copies, a reload of the config might change them meanwhile
+        for backend, queue in list(self.queues.items()):
+            labels = {"backend": backend.name}
+            result.append(("iot_backend_queue_depth", labels, queue.depth()))
+            result.append(("iot_backend_delivered_total", labels, queue.delivered))
+            result.append(("iot_backend_dropped_total", labels, queue.dropped))
+            result.append(("iot_backend_errors_total", labels, queue.errors))
+            if queue.spool is not None:
+                result.append(("iot_backend_spooled_total", labels, queue.spooled))
+                result.append(("iot_backend_spool_bytes", labels, queue.spool.size()))
+        for port, bus in list(IoTBusManager.buses.items()):
+            labels = {"bus": "i2c-{}".format(port)}
+            result.append(("iot_i2c_transactions_total", labels, bus.transactions))
+            result.append(("iot_i2c_bytes_total", labels, bus.bytes))
+            result.append(("iot_i2c_errors_total", labels, bus.errors))
+            result.append(("iot_i2c_busy_seconds_total", labels, bus.busy_time))
+            result.append(("iot_i2c_wait_seconds_total", labels, bus.wait_time))
+        for device, guard in list(self.guards.items()):
+            labels = {"device": device.name}
+            result.append(("iot_device_circuit_open", labels,
+                           0 if IoTDeviceGuard.CLOSED == guard.state else 1))
+            result.append(("iot_device_failures_total", labels, guard.failures_total))
+        for device, publish_filter in list(self.filters.items()):
+            result.append(("iot_published_suppressed_total", {"device": device.name},
+                           publish_filter.suppressed))
+        result.append(("iot_triggers_coalesced_total", None, self.triggers_coalesced))
+        if self.scheduler is not None:
+            result.append(("iot_updates_missed_total", None, self.scheduler.missed))
+        return result
+
+    def __probe_loop_lag(self, expected):
+        """ private helper measuring how late the event loop runs a callback
+
+        Args:
+            expected (float): the time this should have been called
+        """
+        now = self.loop.time()
+        self.metrics.observe("iot_loop_lag_seconds", max(0.0, now - expected))
+        self.loop.call_at(now + 1.0, IoTRuntime.__probe_loop_lag, self, now + 1.0)
+
+    def deliver(self, reading):
+        """ hand a reading to all backends through their delivery queues
+
+        Args:
+            reading (IoTReading): the reading
+        """
+        for backend in self.backends:
+            self.queues[backend].put(reading)
+
+    def deliver_many(self, readings):
+        """ hand several readings to all backends at once, they get them as one batch
+
+        Args:
+            readings (list): the IoTReading objects
+        """
+        for backend in self.backends:
+            self.queues[backend].put_many(readings)
+
     def set_intervall(self, new_intervall: int):
-        """ sets the intervall between two readings of the sensors
+        """ sets the default intervall between two readings of the sensors, devices
+        and sensors with an 'interval' in the config file use their own
 
         Args:
             new_intervall (int): the new interval in seconds between
@@ -112,20 +543,209 @@ class IoTRuntime:
         self.logger.info("got signal %s: exit", signame)
         loop.stop()
 
+    def read_device(self, device):
+        """ read a device once and take the time of acquisition
+
+        Args:
+            device (IOTdevicebase): the device
+
+        Returns:
+            IoTReading: the snapshot of the data
+        """
+        start = time.monotonic()
+        try:
+            data = device.read_data()
+        except Exception:
+            self.metrics.inc("iot_read_errors_total", {"device": device.name})
+            raise
+        reading = IoTReading(device, data)
+        if self.recorder is not None:
+            self.recorder.record_reading(reading)
+        self.metrics.observe("iot_read_seconds", time.monotonic() - start,
+                             {"device": device.name})
+        return reading
+
+    def read_device_locked(self, device):
+        """ read a device while holding the lock of its bus (or of the device if it has
+            no bus), this runs in a worker thread
+
+        Args:
+            device (IOTdevicebase): the device
+        """
+        bus = device.bus_id()
+        if bus is None:
+            lock = self.device_locks.get(device, None)
+        else:
+            lock = self.bus_locks.get(bus, None)
+        if lock is None:
+            return self.read_device(device)
+        # don't wait forever if another read hangs on the same bus
+        if not lock.acquire(timeout=self.guards[device].read_timeout):
+            raise TimeoutError("bus {} is busy".format(bus))
+        try:
+            return self.read_device(device)
+        finally:
+            lock.release()
+
+    def __read_timeout(self, device, future):
+        """ private helper called in the thread of the event loop when a read in a
+            worker thread didn't finish before its deadline. The thread cannot be stopped,
+            but the read counts as failed and its result is thrown away when it arrives
+
+        Args:
+            device (IOTdevicebase): the device
+            future: the future of the read
+        """
+        if future.done() or device not in self.guards:
+            return
+        self.late_reads.add(device)
+        self.metrics.inc("iot_read_timeouts_total", {"device": device.name})
+        guard = self.guards[device]
+        guard.failure(self.loop.time(),
+                      "no result after {} seconds".format(guard.read_timeout))
+
+    def __read_done(self, device, entry_sets, timer, future):
+        """ private helper called in the thread of the event loop when a read in a
+            worker thread has finished, hands the data on to the backends
+
+        Args:
+            device (IOTdevicebase): the device
+            entry_sets (list): the due entries as for __publish_due()
+            timer: handle of the deadline for this read
+            future: the future of the read
+        """
+        timer.cancel()
+        self.reads_in_flight.discard(device)
+        if device not in self.guards:
+            self.late_reads.discard(device)
+            self.logger.info("device %s was removed, result ignored", device.name)
+            return
+        if device in self.late_reads:
+            self.late_reads.discard(device)
+            self.logger.warning("device %s returned after its deadline, result ignored",
+                                device.name)
+            return
+
+        guard = self.guards[device]
+        try:
+            reading = future.result()
+        except Exception as exception:
+            guard.failure(self.loop.time(), exception)
+            return
+        guard.success()
+
+        self.__publish_due(reading, entry_sets)
+
+    def __publish_due(self, reading, entry_sets):
+        """ private helper handing the due entries of a reading on to the backends
+
+        Args:
+            reading (IoTReading): the reading
+            entry_sets (list): sets of due sensor entries, None stands for all entries
+                without an interval of their own
+        """
+        device = reading.device
+        data = reading.data
+        if not data:
+            return
+
+        if None in entry_sets:
+            due = set().union(*[e for e in entry_sets if e is not None])
+            skip = self.timed_entries.get(device, set()) - due
+            data = {entry: data[entry] for entry in data if entry not in skip}
+        else:
+            due = set().union(*entry_sets)
+            data = {entry: data[entry] for entry in data if entry in due}
+
+        # drop values which didn't change enough since they were published last time
+        data = self.filters[device].filter(data, self.loop.time())
+
+        if data:
+            self.deliver(reading.with_data(data))
+
+    def __schedule_device(self, device, first):
+        """ private helper adding the regular updates of a device to the scheduler, sensors
+            with an 'interval' of their own get a separate job
+
+        Args:
+            device (IOTdevicebase): the device
+            first (float): time of the first update
+        """
+        interval = self.update_intervall
+        if device.conf and "interval" in device.conf:
+            interval = device.conf["interval"]
+
+        groups = {}
+        if device.conf and "sensors" in device.conf:
+            for sensor, sensor_cfg in device.conf["sensors"].items():
+                if isinstance(sensor_cfg, dict) and "interval" in sensor_cfg:
+                    groups.setdefault(sensor_cfg["interval"], set()).add(sensor)
+        self.timed_entries[device] = set().union(*groups.values())
+
+        self.scheduler.add((device, None), interval, first)
+        for sensor_interval, entries in groups.items():
+            self.logger.info("device %s: sensors %s every %s seconds",
+                             device.name, sorted(entries), sensor_interval)
+            self.scheduler.add((device, frozenset(entries)), sensor_interval, first)
+
     def regular_update(self, loop):
-        """ do the regular update for all passive devices
+        """ do the regular update for all passive devices whose deadline has passed
         """
         self.logger.debug("iotruntime.regular_update()")
-        for device in self.devices:
-            data = device.read_data()
-            
-            if data:
-                for backend in self.backends:
-                    backend.workon(device, data)
+        due = {}
+        for (device, entries), drift in self.scheduler.pop_due(loop.time()):
+            self.metrics.observe("iot_update_drift_seconds", drift)
+            if drift > self.drift_warning:
+                self.logger.warning("regular update of device %s is %.3f seconds late",
+                                    device.name, drift)
+            due.setdefault(device, []).append(entries)
+
+        for device, entry_sets in due.items():
+            guard = self.guards[device]
+            # before asking the guard, which would take this update as the probing read
+            # of a half open circuit
+            if device in self.reads_in_flight:
+                self.logger.warning("device %s is still busy with the last read, skipping it",
+                                    device.name)
+                continue
+            if not guard.allow(loop.time()):
+                self.logger.debug("circuit of device %s is open, skipping it", device.name)
+                continue
+
+            if self.executor is None:
+                # without worker threads the deadline cannot be enforced, a read
+                # which takes too long still counts as failure
+                start = time.monotonic()
+                try:
+                    reading = self.read_device(device)
+                except Exception as exception:
+                    guard.failure(loop.time(), exception)
+                    continue
+                duration = time.monotonic() - start
+                if duration > guard.read_timeout:
+                    guard.failure(loop.time(), "read took {:.1f} seconds".format(duration))
+                else:
+                    guard.success()
+                self.__publish_due(reading, entry_sets)
+            else:
+                self.reads_in_flight.add(device)
+                future = loop.run_in_executor(
+                    self.executor, IoTRuntime.read_device_locked, self, device)
+                timer = loop.call_later(guard.read_timeout, functools.partial(
+                    IoTRuntime.__read_timeout, self, device, future))
+                future.add_done_callback(
+                    functools.partial(IoTRuntime.__read_done, self, device, entry_sets, timer))
 
-        # reschedule myself for next time
-        loop.call_later(self.update_intervall,
-                        IoTRuntime.regular_update, self, loop)
+        # reschedule myself for the next deadline, which is absolute and
+        # doesn't depend on how long this update took
+        deadline = self.scheduler.next_deadline()
+        if deadline is not None:
+            self.update_handle = loop.call_at(deadline, IoTRuntime.regular_update, self, loop)
+
+        try:
+            self.profiler.tick()
+        except OSError as exception:
+            self.logger.error("cannot write the profile: %s", exception)
 
     def scheduled_update(self, device, switch, event):
         """ handler for updates, call from the main event handler
@@ -135,11 +755,81 @@ class IoTRuntime:
             switch (str): the switch on the device
             event (str): the message to send
         """
+        if device not in self.filters:
+            # removed by a reload of the config meanwhile
+            return
+        self.record_command(device, switch, event)
         if device.set_state({switch: event}):
-            for backend in self.backends:
-                data = device.read_data()
-                backend.workon(device, data)
+            # read once, all backends get the same snapshot
+            self.__read_outside_schedule(device, IoTRuntime.__publish_command)
+
+    def __publish_command(self, reading):
+        """ private helper delivering the reading after a command """
+        self.deliver(reading)
+        self.filters[reading.device].published(reading.data, self.loop.time())
+
+    def __read_outside_schedule(self, device, publish):
+        """ private helper reading a device after a command or a trigger and calling
+            publish(self, reading) in the thread of the event loop. With concurrent
+            polling the read goes through read_device_locked() in a worker thread like
+            the regular ones, so it never runs at the same time as another read of the
+            device or of its bus.
 
+        Args:
+            device (IOTdevicebase): the device
+            publish: function taking the runtime and the reading
+        """
+        guard = self.guards[device]
+        if not guard.allow(self.loop.time()):
+            self.logger.debug("circuit of device %s is open, skipping it", device.name)
+            return
+        if self.executor is None:
+            try:
+                reading = self.read_device(device)
+            except Exception as exception:
+                guard.failure(self.loop.time(), exception)
+                return
+            guard.success()
+            publish(self, reading)
+            return
+        future = self.loop.run_in_executor(
+            self.executor, IoTRuntime.read_device_locked, self, device)
+        future.add_done_callback(functools.partial(
+            IoTRuntime.__read_outside_schedule_done, self, device, publish))
+
+    def __read_outside_schedule_done(self, device, publish, future):
+        """ private helper called in the thread of the event loop when a read started
+            by __read_outside_schedule() has finished
+
+        Args:
+            device (IOTdevicebase): the device
+            publish: function taking the runtime and the reading
+            future: the future of the read
+        """
+        if device not in self.guards:
+            self.logger.info("device %s was removed, result ignored", device.name)
+            return
+        guard = self.guards[device]
+        try:
+            reading = future.result()
+        except Exception as exception:
+            guard.failure(self.loop.time(), exception)
+            return
+        guard.success()
+        publish(self, reading)
+
+
+    def record_command(self, device, entity, value):
+        """ write a command to the record file if recording is on, called by the
+            backends before they hand a command to a device
+
+        Args:
+            device (IOTdevicebase): the device
+            entity (str): the switch, cover etc. on the device
+            value: the message to send
+        """
+        if self.recorder is not None:
+            self.recorder.record_command(device, entity, value)
 
     def __schedule_from_local_thread(self,delay,device,switch,event):
         """ private helper method to schedule a future event from the local thread 
@@ -185,12 +875,54 @@ class IoTRuntime:
 
         Args:
             device (IOTdevicebase): the device
-            switch (str): the switch on the device
-            event (str): the message to send
         """
-        for backend in self.backends:
-            data = device.read_data()
-            backend.workon(device, data)
+        if device not in self.filters:
+            # removed by a reload of the config meanwhile
+            with self.trigger_lock:
+                self.triggers_pending.pop(device, None)
+            return
+        window = self.trigger_window
+        if device.conf and "trigger_window" in device.conf:
+            window = device.conf["trigger_window"]
+        # triggers arriving until then are merged into one more update
+        self.loop.call_later(window, IoTRuntime.__trigger_window_closed, self, device)
+
+        # read once, all backends get the same snapshot. This matters for devices
+        # like the positional cover which move a step on every read_data()
+        self.__read_outside_schedule(device, IoTRuntime.__publish_triggered)
+
+    def __publish_triggered(self, reading):
+        """ private helper handing the reading of a triggered update on to the backends """
+        device = reading.device
+        # state changes are always published, but the filter needs to know
+        self.filters[device].published(reading.data, self.loop.time())
+
+        # triggered updates of several devices handled in the same round of the
+        # event loop are delivered together, without waiting for anything
+        if not self.trigger_batch:
+            self.loop.call_soon(IoTRuntime.__flush_triggered, self)
+        self.trigger_batch.append(reading)
+
+    def __flush_triggered(self):
+        """ private helper delivering the readings of all triggered updates since the last call
+        """
+        batch = self.trigger_batch
+        self.trigger_batch = []
+        self.deliver_many(batch)
+
+    def __trigger_window_closed(self, device):
+        """ private helper called when the window after a triggered update is over,
+            runs one more update if there were triggers meanwhile
+
+        Args:
+            device (IOTdevicebase): the device
+        """
+        with self.trigger_lock:
+            again = self.triggers_pending.pop(device, False)
+            if again:
+                self.triggers_pending[device] = False
+        if again:
+            self.triggered_update(device)
 
     def trigger_for_device(self,device):
         """ Act on notification by a device, like schedule_for_device() but without a delay,
@@ -203,6 +935,16 @@ class IoTRuntime:
             self.logger.error("no event loop created, must not call 'IoTRuntime.schedule_for_device()' yet")
             return None
        
+        # A chattering contact calls this hundreds of times. Only the first trigger gets an
+        # update right away, the following ones are merged into one more update after the
+        # first one is done and its trigger window is over.
+        with self.trigger_lock:
+            if device in self.triggers_pending:
+                self.triggers_pending[device] = True
+                self.triggers_coalesced += 1
+                return None
+            self.triggers_pending[device] = False
+
         # This get's (most likely) called from another thread such as a GPIO callback thread but
         # not the thread where self.loop lives in. Therefore, the following call makes self.loop()
         # to call self.trigger_for_device() soon inside the thread of self.loop
@@ -220,8 +962,33 @@ class IoTRuntime:
             self.loop.add_signal_handler(getattr(signal, signame),
                                          functools.partial(IoTRuntime.signal_handler, self, signame, self.loop))
 
+        # SIGHUP reloads the config file
+        self.loop.add_signal_handler(signal.SIGHUP,
+                                     functools.partial(IoTRuntime.reload_config, self))
+
+        # profiling on demand: SIGUSR1 profiles the next ticks, SIGUSR2 dumps
+        # the stacks of all threads and a tracemalloc snapshot
+        self.loop.add_signal_handler(signal.SIGUSR1, self.profiler.start_profile)
+        self.loop.add_signal_handler(signal.SIGUSR2, self.profiler.dump_state)
+
         # schedule regular update for the first time
-        self.loop.call_soon(IoTRuntime.regular_update, self, self.loop)
+        self.scheduler = IoTScheduler()
+        now = self.loop.time()
+        for device in self.devices:
+            self.__schedule_device(device, now)
+        self.update_handle = self.loop.call_soon(IoTRuntime.regular_update, self, self.loop)
+        self.loop.call_soon(IoTRuntime.__probe_loop_lag, self, self.loop.time())
+
+        # optional endpoint for the metrics in Prometheus text format
+        if "metrics" in self.runtime_cfg and self.runtime_cfg["metrics"]:
+            metrics_cfg = self.runtime_cfg["metrics"]
+            try:
+                self.metrics.start_server(metrics_cfg.get("address", "127.0.0.1"),
+                                          metrics_cfg.get("port", 9105),
+                                          metrics_cfg.get("socket", None))
+                self.logger.info("serving metrics on %s", metrics_cfg)
+            except OSError as exception:
+                self.logger.error("cannot serve metrics: %s", exception)
 
         try:
             self.loop.run_forever()
@@ -230,8 +997,31 @@ class IoTRuntime:
         finally:
             self.loop.close()
 
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+        self.metrics.stop_server()
+        try:
+            self.profiler.stop_profile()
+        except OSError as exception:
+            self.logger.error("cannot write the profile: %s", exception)
+
+        if self.scheduler is not None:
+            self.logger.info("regular updates: max. drift %.3f seconds, %d missed",
+                             self.scheduler.max_drift, self.scheduler.missed)
+
         for device in self.devices:
             device.shutdown(None)
 
+        for port, bus in IoTBusManager.buses.items():
+            self.logger.info("i2c-%d: %d transactions, %d errors, %.1f%% busy, "
+                             "max. wait %.3f seconds", port, bus.transactions, bus.errors,
+                             100.0 * bus.utilisation(), bus.max_wait)
+        IoTBusManager.close_all()
+
         for backend in self.backends:
+            self.queues[backend].stop()
             backend.shutdown()
+
+        if self.recorder is not None:
+            self.recorder.close()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" scheduler for the regular updates of the devices
+
+"""
+
+import heapq
+import itertools
+
+
+class IoTScheduler:
+    """ heap based scheduler where every job has its own interval. Jobs fire on
+        absolute deadlines (deadline + interval) of a monotonic clock, so the period
+        doesn't drift by the time it takes to work on a job. The clock is whatever
+        the caller passes as 'now', the runtime uses the time of the event loop.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+        # statistics about how late jobs fired
+        self.last_drift = 0.0
+        self.max_drift = 0.0
+        self.missed = 0
+
+    def add(self, job, interval: float, first: float) -> None:
+        """ add a job which fires every interval seconds
+
+        Args:
+            job: anything, handed back by pop_due()
+            interval (float): interval between two deadlines in seconds
+            first (float): the first deadline
+        """
+        heapq.heappush(self.heap, (first, next(self.counter), interval, job))
+
+    def remove(self, job) -> None:
+        """ remove all entries of a job
+
+        Args:
+            job: the job as given to add()
+        """
+        self.heap = [entry for entry in self.heap if entry[3] != job]
+        heapq.heapify(self.heap)
+
+    def jobs(self) -> list:
+        """ all jobs, each one once """
+        result = []
+        for entry in self.heap:
+            if entry[3] not in result:
+                result.append(entry[3])
+        return result
+
+    def next_deadline(self):
+        """ the earliest deadline of all jobs or None if there are no jobs """
+        if not self.heap:
+            return None
+        return self.heap[0][0]
+
+    def pop_due(self, now: float) -> list:
+        """ returns all jobs whose deadline has passed and schedules their next deadline
+
+        Args:
+            now (float): the current time
+
+        Returns:
+            list: tuples of (job, drift) where drift is how late the job fired in seconds
+        """
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            deadline, _, interval, job = heapq.heappop(self.heap)
+            drift = now - deadline
+            next_deadline = deadline + interval
+            if next_deadline <= now:
+                # we are late by more than a whole interval, skip the periods
+                # which are over already instead of firing them all at once
+                skipped = int((now - deadline) // interval)
+                self.missed += skipped
+                next_deadline = deadline + (skipped + 1) * interval
+            heapq.heappush(self.heap, (next_deadline, next(self.counter), interval, job))
+            self.last_drift = drift
+            self.max_drift = max(self.max_drift, drift)
+            due.append((job, drift))
+        return due
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" disk spool keeping readings for a backend while it is unavailable
+
+"""
+
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from iot_control.iotrecorder import encode_value, decode_value
+
+# header of every segment: magic and the offset up to which it was delivered
+MAGIC = b"IOTSPL\x01\n"
+SEGMENT_HEADER = struct.Struct("<8sI")
+# length and crc32 in front of every record, a length of 0 ends the segment
+RECORD_HEADER = struct.Struct("<II")
+TIMESTAMP_COUNT = struct.Struct("<dH")
+SHORT = struct.Struct("<H")
+
+
+def encode_reading(name: str, data: dict, timestamp: float) -> bytes:
+    """ a reading as bytes, the device is given by its name """
+    parts = [TIMESTAMP_COUNT.pack(timestamp, len(data))]
+    for entity in (name,) + tuple(data):
+        text = str(entity).encode("utf-8")
+        parts.append(SHORT.pack(len(text)) + text)
+    parts.extend(encode_value(value) for value in data.values())
+    return b"".join(parts)
+
+
+def decode_reading(payload: bytes):
+    """ device name, data and time stamp of a reading made by encode_reading() """
+    timestamp, count = TIMESTAMP_COUNT.unpack_from(payload)
+    position = TIMESTAMP_COUNT.size
+    names = []
+    for _ in range(count + 1):
+        size = SHORT.unpack_from(payload, position)[0]
+        position += SHORT.size
+        names.append(payload[position:position + size].decode("utf-8"))
+        position += size
+    data = {}
+    for entity in names[1:]:
+        data[entity], position = decode_value(payload, position)
+    return names[0], data, timestamp
+
+
+class IoTSpoolSegment:
+    """ one memory mapped file of the spool with a fixed size
+
+    Args:
+        path (str): the file
+        size (int): size of a new file in bytes
+    """
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if 0 == os.fstat(fd).st_size:
+                # sparse, nothing is written to the card but the header
+                os.ftruncate(fd, size)
+                os.pwrite(fd, SEGMENT_HEADER.pack(MAGIC, SEGMENT_HEADER.size), 0)
+            self.map = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+        magic, self.read_offset = SEGMENT_HEADER.unpack_from(self.map)
+        if MAGIC != magic:
+            self.map.close()
+            raise ValueError("{} is no spool segment".format(path))
+        # find the end of the data, a record cut off by a power loss ends it
+        self.write_offset = self.read_offset
+        record = self.next(self.write_offset)
+        while record is not None:
+            self.write_offset = record[1]
+            record = self.next(self.write_offset)
+
+    def next(self, offset: int):
+        """ the payload of the record at offset and the offset behind it, None at the end """
+        if offset + RECORD_HEADER.size > len(self.map):
+            return None
+        length, crc = RECORD_HEADER.unpack_from(self.map, offset)
+        end = offset + RECORD_HEADER.size + length
+        if 0 == length or end > len(self.map):
+            return None
+        payload = self.map[offset + RECORD_HEADER.size:end]
+        if zlib.crc32(payload) != crc:
+            return None
+        return payload, end
+
+    def append(self, payload: bytes) -> bool:
+        """ append a record, False if it doesn't fit """
+        end = self.write_offset + RECORD_HEADER.size + len(payload)
+        if end > len(self.map):
+            return False
+        self.map[self.write_offset + RECORD_HEADER.size:end] = payload
+        self.map[self.write_offset:self.write_offset + RECORD_HEADER.size] = \
+            RECORD_HEADER.pack(len(payload), zlib.crc32(payload))
+        self.write_offset = end
+        return True
+
+    def commit(self, offset: int) -> None:
+        """ everything before offset is delivered """
+        self.read_offset = offset
+        SEGMENT_HEADER.pack_into(self.map, 0, MAGIC, offset)
+
+    def empty(self) -> bool:
+        """ is everything delivered """
+        return self.read_offset >= self.write_offset
+
+    def close(self, remove: bool = False) -> None:
+        """ unmap the file and delete it with remove """
+        self.map.flush()
+        self.map.close()
+        if remove:
+            os.remove(self.path)
+
+
+class IoTSpool:
+    """ append-only spool of readings on disk for one backend, in segments of
+        'segment_size' bytes which are memory mapped. Readings are appended at the
+        end and taken from the front once the backend accepted them, a segment is
+        deleted when everything in it is delivered. Writes go to the page cache and
+        are synced at most every 'flush_interval' seconds, so an SD card sees few
+        large writes. After a crash or power loss the spool continues where the last
+        sync left it, records with a wrong checksum end a segment.
+
+        If the spool grows beyond 'max_bytes' the oldest segment is thrown away.
+
+    Args:
+        directory (str): directory for the segments, created if missing
+        max_bytes (int): maximum size of all segments together
+        segment_size (int): size of one segment
+        flush_interval (float): seconds between two syncs to disk
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 100 * 1024 * 1024,
+                 segment_size: int = 4 * 1024 * 1024, flush_interval: float = 5.0):
+        self.logger = logging.getLogger("iot_control")
+        self.directory = directory
+        self.segment_size = max(segment_size, 4096)
+        self.max_segments = max(2, max_bytes // self.segment_size)
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+        self.dirty = False
+        self.segments = []
+        self.lost_segments = 0
+        os.makedirs(directory, exist_ok=True)
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".seg"):
+                try:
+                    self.segments.append(
+                        IoTSpoolSegment(os.path.join(directory, name), self.segment_size))
+                except (OSError, ValueError) as exception:
+                    self.logger.error("ignoring spool segment %s: %s", name, exception)
+        self.sequence = int(os.path.basename(self.segments[-1].path)[:-4]) + 1 \
+            if self.segments else 0
+        self.__remove_delivered()
+        if self.segments:
+            self.logger.info("spool %s holds %d bytes from before", directory, self.size())
+
+    def __new_segment(self) -> IoTSpoolSegment:
+        """ private helper starting a new segment, dropping the oldest if there are too many """
+        if len(self.segments) >= self.max_segments:
+            self.segments.pop(0).close(remove=True)
+            self.lost_segments += 1
+            self.logger.warning("spool %s is full, dropped its oldest %d bytes",
+                                self.directory, self.segment_size)
+        segment = IoTSpoolSegment(
+            os.path.join(self.directory, "{:010d}.seg".format(self.sequence)), self.segment_size)
+        self.sequence += 1
+        self.segments.append(segment)
+        return segment
+
+    def __remove_delivered(self) -> None:
+        """ private helper deleting the segments which are delivered completely """
+        while self.segments and self.segments[0].empty():
+            self.segments.pop(0).close(remove=True)
+
+    def empty(self) -> bool:
+        """ is nothing waiting """
+        return not self.segments
+
+    def size(self) -> int:
+        """ bytes waiting for delivery """
+        return sum(s.write_offset - s.read_offset for s in self.segments)
+
+    def append(self, readings: list) -> None:
+        """ append readings
+
+        Args:
+            readings (list): IoTReading objects
+        """
+        for reading in readings:
+            payload = encode_reading(reading.device.name, reading.data, reading.timestamp)
+            if not self.segments or not self.segments[-1].append(payload):
+                if not self.__new_segment().append(payload):
+                    self.logger.error("reading of %d bytes doesn't fit into a spool segment",
+                                      len(payload))
+        self.dirty = True
+        self.flush(force=False)
+
+    def peek(self, count: int):
+        """ up to count of the oldest readings as tuples of device name, data and time
+            stamp, and the position to give to commit() once they are delivered
+        """
+        result = []
+        if not self.segments:
+            return result, None
+        segment = self.segments[0]
+        offset = segment.read_offset
+        while len(result) < count:
+            record = segment.next(offset)
+            if record is None:
+                break
+            result.append(decode_reading(record[0]))
+            offset = record[1]
+        if not result:
+            # the rest of the segment is damaged
+            offset = segment.write_offset
+        return result, (segment, offset)
+
+    def commit(self, position) -> None:
+        """ the readings up to position, as returned by peek(), are delivered """
+        if position is None:
+            return
+        segment, offset = position
+        if segment not in self.segments:
+            # dropped meanwhile because the spool was full
+            return
+        if segment.next(offset) is None:
+            # nothing valid behind offset, the segment is done
+            offset = segment.write_offset
+        segment.commit(offset)
+        self.dirty = True
+        self.__remove_delivered()
+
+    def flush(self, force: bool = True) -> None:
+        """ sync to disk, without force only if the last sync is 'flush_interval' ago """
+        now = time.monotonic()
+        if self.dirty and (force or now - self.last_flush >= self.flush_interval):
+            for segment in self.segments:
+                segment.map.flush()
+            self.dirty = False
+            self.last_flush = now
+
+    def close(self) -> None:
+        """ sync and unmap everything, the spool is continued by the next IoTSpool """
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
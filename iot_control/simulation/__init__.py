@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" simulated hardware: I2C buses with register level models of the chips and a
+    GPIO bank, selected with 'hardware: {mode: simulated}' in the runtime section
+
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import Dict
+from iot_control.simulation.i2c import IoTSimulatedI2CBus, IoTSimulatedSMBus
+from iot_control.simulation.gpio import IoTSimulatedGPIO
+from iot_control.simulation.chips import IoTSimulatedBME280, IoTSimulatedBH1750, \
+    IoTSimulatedADS1115, IoTSimulatedPCF8591
+
+
+class IoTSimulation:
+    """ all simulated hardware: the I2C buses by number and the GPIO bank. The chips
+        are put on the buses when the devices using them are created, with the
+        parameters from the 'simulation' key of the device config.
+
+    Args:
+        seed (int): seed of the random generator for reproducible runs, None for random
+        i2c_clock (int): clock of the I2C buses in Hz, 0 for transfers without delay
+    """
+
+    def __init__(self, seed: int = None, i2c_clock: int = 100000):
+        self.logger = logging.getLogger("iot_control")
+        self.rng = random.Random(seed)
+        self.i2c_clock = i2c_clock
+        self.start = time.monotonic()
+        self.buses = {}
+        self.gpio = IoTSimulatedGPIO()
+        self.timed_chips = []
+        self.clock = None
+        # set to run the clock before its next due time
+        self.clock_wakeup = threading.Event()
+        self.lock = threading.Lock()
+
+    def bus(self, port: int) -> IoTSimulatedI2CBus:
+        """ the simulated bus with this number, created when needed """
+        with self.lock:
+            if port not in self.buses:
+                self.buses[port] = IoTSimulatedI2CBus(port, self.i2c_clock)
+            return self.buses[port]
+
+    def smbus(self, port: int) -> IoTSimulatedSMBus:
+        """ open a handle for a bus like smbus2.SMBus(port) """
+        return IoTSimulatedSMBus(self.bus(port))
+
+    def attach_device(self, kind: str, device_cfg: Dict) -> None:
+        """ put the chips a device needs on the simulated buses
+
+        Args:
+            kind (str): the kind of device like 'bme280'
+            device_cfg (Dict): the config of the device
+        """
+        params = device_cfg.get("simulation", None) or {}
+        if "bme280" == kind:
+            self.attach(device_cfg["port"], device_cfg["i2c_address"],
+                        IoTSimulatedBME280(params, self.rng, self.start))
+        elif "bh1750" == kind:
+            self.attach(device_cfg["port"], device_cfg["i2c_address"],
+                        IoTSimulatedBH1750(params, self.rng, self.start))
+        elif "ads1115" == kind:
+            if "alert_pin" not in params and device_cfg.get("alert_pin", None) is not None:
+                # ALERT/RDY is wired to the pin the device watches
+                params = dict(params, alert_pin=device_cfg["alert_pin"])
+            chip = self.attach(device_cfg.get("port", 1), device_cfg.get("i2c_address", 0x48),
+                               IoTSimulatedADS1115(params, self.rng, self.start, self.gpio))
+            if chip.alert_pin is not None:
+                self.__start_clock(chip)
+        elif "pcf8591pulses" == kind:
+            self.attach(device_cfg["port"], device_cfg["i2c_address"],
+                        IoTSimulatedPCF8591(params, self.rng, self.start))
+        # the other devices only use GPIO pins
+
+    def attach(self, port: int, address: int, chip):
+        """ put a chip on a bus, returns the chip at that address (an existing one is
+            kept, so a reloaded device sees the same state)
+        """
+        self.logger.info("simulating %s at 0x%02x on I2C bus %d",
+                         type(chip).__name__, address, port)
+        return self.bus(port).attach(address, chip)
+
+    def __start_clock(self, chip) -> None:
+        """ private helper, chips driving a GPIO pin need to be updated in time """
+        with self.lock:
+            if chip not in self.timed_chips:
+                self.timed_chips.append(chip)
+                chip.wakeup = self.clock_wakeup
+            if self.clock is None:
+                self.clock = threading.Thread(target=self.__run_clock, daemon=True,
+                                              name="iot_control_simulation_clock")
+                self.clock.start()
+
+    def __run_clock(self) -> None:
+        """ private thread letting timed chips finish their conversions when they're due """
+        chip_buses = {}
+        while True:
+            now = time.monotonic()
+            due = now + 0.01
+            for chip in list(self.timed_chips):
+                bus = chip_buses.get(id(chip), None)
+                if bus is None:
+                    bus = next((b for b in self.buses.values() if chip in b.chips.values()), None)
+                    if bus is None:
+                        continue
+                    chip_buses[id(chip)] = bus
+                with bus.lock:
+                    chip.tick(now)
+                    event = chip.next_event(now)
+                if event is not None:
+                    due = min(due, event)
+            self.clock_wakeup.wait(max(0.0, due - time.monotonic()))
+            self.clock_wakeup.clear()
@@ -0,0 +1,502 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" register level models of the I2C chips the devices use
+
+"""
+
+import struct
+from iot_control.simulation.i2c import IoTSimulatedChip, IoTSimulatedRegisterChip
+from iot_control.simulation.signals import IoTSimulatedSignal
+
+
+def _bisect(function, target: float, low: int, high: int) -> int:
+    """ private helper finding the raw value a monotonic function maps to target """
+    rising = function(high) > function(low)
+    while high - low > 1:
+        middle = (low + high) // 2
+        if (function(middle) < target) == rising:
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+class IoTSimulatedBME280(IoTSimulatedRegisterChip):
+    """ BME280 temperature, pressure and humidity sensor: chip id, calibration data of
+        a real chip, ctrl_hum, ctrl_meas, config, the measuring bit of status and the
+        data registers 0xF7-0xFE. Forced mode measurements take as long as the
+        datasheet says for the oversampling, in normal mode they repeat after the
+        standby time. The raw values are computed by inverting the compensation
+        formulas of the datasheet, so real drivers read the simulated conditions.
+
+    Args:
+        params (dict): 'temperature', 'pressure' (hPa) and 'humidity' (%) as parameters
+            of IoTSimulatedSignal, plus 'error_rate'
+    """
+
+    CHIP_ID = 0x60
+
+    # calibration of a real chip: T1-T3, P1-P9, H1-H6
+    CALIBRATION = {"T1": 28485, "T2": 26735, "T3": 50,
+                   "P1": 36738, "P2": -10635, "P3": 3024, "P4": 4213, "P5": -95,
+                   "P6": -7, "P7": 9900, "P8": -10230, "P9": 4285,
+                   "H1": 75, "H2": 368, "H3": 0, "H4": 305, "H5": 50, "H6": 30}
+
+    # standby times of normal mode in ms, by config[7:5]
+    STANDBY = (0.5, 62.5, 125.0, 250.0, 500.0, 1000.0, 10.0, 20.0)
+
+    def __init__(self, params: dict = None, rng=None, start: float = 0.0):
+        super().__init__(params, rng)
+        self.temperature = IoTSimulatedSignal(
+            self.params.get("temperature", {"base": 21.0, "amplitude": 2.0, "noise": 0.02}),
+            rng, start)
+        self.pressure = IoTSimulatedSignal(
+            self.params.get("pressure", {"base": 1013.0, "amplitude": 5.0, "noise": 0.05}),
+            rng, start)
+        self.humidity = IoTSimulatedSignal(
+            self.params.get("humidity", {"base": 45.0, "amplitude": 10.0, "noise": 0.2}),
+            rng, start)
+        self.cal = IoTSimulatedBME280.CALIBRATION
+        self.reset()
+
+    def reset(self) -> None:
+        """ power on reset: sleep mode, calibration in its registers, data skipped """
+        self.registers[:] = bytes(256)
+        cal = self.cal
+        self.registers[0x88:0xA0] = struct.pack(
+            "<HhhHhhhhhhhh", cal["T1"], cal["T2"], cal["T3"], cal["P1"], cal["P2"],
+            cal["P3"], cal["P4"], cal["P5"], cal["P6"], cal["P7"], cal["P8"], cal["P9"])
+        self.registers[0xA1] = cal["H1"]
+        self.registers[0xE1:0xE4] = struct.pack("<hB", cal["H2"], cal["H3"])
+        # H4 and H5 are 12 bit values sharing 0xE5
+        self.registers[0xE4] = (cal["H4"] >> 4) & 0xFF
+        self.registers[0xE5] = (cal["H4"] & 0x0F) | ((cal["H5"] & 0x0F) << 4)
+        self.registers[0xE6] = (cal["H5"] >> 4) & 0xFF
+        self.registers[0xE7] = cal["H6"] & 0xFF
+        self.registers[0xD0] = IoTSimulatedBME280.CHIP_ID
+        self.registers[0xF7:0xFF] = bytes([0x80, 0, 0, 0x80, 0, 0, 0x80, 0])
+        self.ctrl_hum = 0
+        self.busy_until = 0.0
+        self.next_measurement = None
+
+    def __t_fine(self, adc_t: int) -> float:
+        """ private helper, temperature compensation of the datasheet in floating point """
+        cal = self.cal
+        var1 = (adc_t / 16384.0 - cal["T1"] / 1024.0) * cal["T2"]
+        var2 = (adc_t / 131072.0 - cal["T1"] / 8192.0) ** 2 * cal["T3"]
+        return var1 + var2
+
+    def __pressure(self, adc_p: int, t_fine: float) -> float:
+        """ private helper, pressure compensation in Pa """
+        cal = self.cal
+        var1 = t_fine / 2.0 - 64000.0
+        var2 = var1 * var1 * cal["P6"] / 32768.0
+        var2 = var2 + var1 * cal["P5"] * 2.0
+        var2 = var2 / 4.0 + cal["P4"] * 65536.0
+        var1 = (cal["P3"] * var1 * var1 / 524288.0 + cal["P2"] * var1) / 524288.0
+        var1 = (1.0 + var1 / 32768.0) * cal["P1"]
+        pressure = 1048576.0 - adc_p
+        pressure = (pressure - var2 / 4096.0) * 6250.0 / var1
+        var1 = cal["P9"] * pressure * pressure / 2147483648.0
+        var2 = pressure * cal["P8"] / 32768.0
+        return pressure + (var1 + var2 + cal["P7"]) / 16.0
+
+    def __humidity(self, adc_h: int, t_fine: float) -> float:
+        """ private helper, humidity compensation in %, without the clamping """
+        cal = self.cal
+        h = t_fine - 76800.0
+        h = (adc_h - (cal["H4"] * 64.0 + cal["H5"] / 16384.0 * h)) * (
+            cal["H2"] / 65536.0 * (1.0 + cal["H6"] / 67108864.0 * h * (
+                1.0 + cal["H3"] / 67108864.0 * h)))
+        return h * (1.0 - cal["H1"] * h / 524288.0)
+
+    @staticmethod
+    def __oversampling(setting: int) -> int:
+        """ private helper, number of samples for an osrs_x setting, 0 is skipped """
+        return 0 if 0 == setting else 1 << (min(setting, 5) - 1)
+
+    def measurement_time(self) -> float:
+        """ typical duration of a measurement in seconds with the current settings """
+        ctrl_meas = self.registers[0xF4]
+        os_t = IoTSimulatedBME280.__oversampling(ctrl_meas >> 5)
+        os_p = IoTSimulatedBME280.__oversampling((ctrl_meas >> 2) & 0x07)
+        os_h = IoTSimulatedBME280.__oversampling(self.ctrl_hum & 0x07)
+        duration = 1.0 + 2.0 * os_t
+        if os_p:
+            duration += 2.0 * os_p + 0.5
+        if os_h:
+            duration += 2.0 * os_h + 0.5
+        return duration / 1000.0
+
+    def __measure(self, now: float) -> None:
+        """ private helper, put the conditions at time now into the data registers """
+        ctrl_meas = self.registers[0xF4]
+        temperature = self.temperature.value(now)
+        adc_t = _bisect(lambda adc: self.__t_fine(adc) / 5120.0, temperature, 0, 1 << 20)
+        t_fine = self.__t_fine(adc_t)
+        if ctrl_meas >> 5:
+            # 16 bit without IIR filter, one more bit per oversampling step up to 20
+            self.registers[0xFA:0xFD] = bytes([adc_t >> 12, (adc_t >> 4) & 0xFF,
+                                               (adc_t & 0x0F) << 4])
+        if (ctrl_meas >> 2) & 0x07:
+            pressure = self.pressure.value(now) * 100.0
+            adc_p = _bisect(lambda adc: self.__pressure(adc, t_fine), pressure, 0, 1 << 20)
+            self.registers[0xF7:0xFA] = bytes([adc_p >> 12, (adc_p >> 4) & 0xFF,
+                                               (adc_p & 0x0F) << 4])
+        if self.ctrl_hum & 0x07:
+            humidity = min(100.0, max(0.0, self.humidity.value(now)))
+            adc_h = _bisect(lambda adc: self.__humidity(adc, t_fine), humidity, 0, 1 << 16)
+            self.registers[0xFD:0xFF] = bytes([adc_h >> 8, adc_h & 0xFF])
+
+    def update(self, now: float) -> None:
+        mode = self.registers[0xF4] & 0x03
+        if self.busy_until and now >= self.busy_until:
+            self.__measure(self.busy_until)
+            if 0x03 == mode:
+                standby = IoTSimulatedBME280.STANDBY[self.registers[0xF5] >> 5] / 1000.0
+                self.next_measurement = self.busy_until + standby
+            else:
+                # forced mode goes back to sleep
+                self.registers[0xF4] &= 0xFC
+            self.busy_until = 0.0
+        if 0x03 == mode and self.next_measurement is not None and now >= self.next_measurement:
+            # normal mode: skip the measurements nobody read
+            cycle = self.measurement_time() + \
+                IoTSimulatedBME280.STANDBY[self.registers[0xF5] >> 5] / 1000.0
+            missed = int((now - self.next_measurement) / cycle)
+            start = self.next_measurement + missed * cycle
+            self.busy_until = start + self.measurement_time()
+            if now >= self.busy_until:
+                self.__measure(self.busy_until)
+                self.busy_until = 0.0
+                self.next_measurement = start + cycle
+        # bit 3 of status: measuring
+        self.registers[0xF3] = 0x08 if self.busy_until else 0x00
+
+    def write(self, data: bytes, now: float) -> None:
+        # writes are pairs of register and value, without auto increment
+        self.update(now)
+        if 1 == len(data):
+            self.pointer = data[0]
+            return
+        for i in range(0, len(data) - 1, 2):
+            self.write_register(data[i], data[i + 1], now)
+
+    def write_register(self, register: int, value: int, now: float) -> None:
+        if 0xE0 == register and 0xB6 == value:
+            self.reset()
+        elif 0xF2 == register:
+            self.registers[0xF2] = value & 0x07
+        elif 0xF4 == register:
+            self.registers[0xF4] = value
+            # ctrl_hum only becomes effective with a write to ctrl_meas
+            self.ctrl_hum = self.registers[0xF2]
+            mode = value & 0x03
+            if mode in (0x01, 0x02, 0x03) and not self.busy_until:
+                self.busy_until = now + self.measurement_time()
+                self.next_measurement = None
+            self.registers[0xF3] = 0x08 if self.busy_until else 0x00
+        elif 0xF5 == register:
+            self.registers[0xF5] = value & 0xFD
+        # everything else is read only
+
+
+class IoTSimulatedBH1750(IoTSimulatedChip):
+    """ BH1750 ambient light sensor, controlled by one byte opcodes: power down/on,
+        reset, continuous and one time measurements in high resolution (mode 2) and low
+        resolution mode and the measurement time register. A measurement takes
+        120 ms (16 ms in low resolution) scaled with the measurement time register,
+        a read always returns the last finished measurement.
+
+    Args:
+        params (dict): 'lux' as parameters of IoTSimulatedSignal, plus 'error_rate'
+    """
+
+    POWER_DOWN = 0x00
+    POWER_ON = 0x01
+    RESET = 0x07
+    MTREG_DEFAULT = 69
+
+    def __init__(self, params: dict = None, rng=None, start: float = 0.0):
+        super().__init__(params, rng)
+        self.lux = IoTSimulatedSignal(
+            self.params.get("lux", {"base": 300.0, "amplitude": 250.0, "noise": 2.0}),
+            rng, start)
+        self.powered = False
+        self.mode = None
+        self.mtreg = IoTSimulatedBH1750.MTREG_DEFAULT
+        self.data = 0
+        self.busy_until = 0.0
+        self.measurements = 0
+
+    def measurement_time(self) -> float:
+        """ typical duration of a measurement in seconds in the current mode """
+        low = self.mode is not None and 0x03 == self.mode & 0x03
+        return (0.016 if low else 0.120) * self.mtreg / IoTSimulatedBH1750.MTREG_DEFAULT
+
+    def __update(self, now: float) -> None:
+        """ private helper finishing the measurements done until now """
+        while self.busy_until and now >= self.busy_until:
+            lux = max(0.0, self.lux.value(self.busy_until))
+            counts = lux * 1.2 * self.mtreg / IoTSimulatedBH1750.MTREG_DEFAULT
+            if 0x01 == self.mode & 0x03:
+                # high resolution mode 2 counts half lux
+                counts *= 2
+            elif 0x03 == self.mode & 0x03:
+                # low resolution mode has 4 lx steps
+                counts = round(counts / 4.0) * 4
+            self.data = min(0xFFFF, int(round(counts)))
+            self.measurements += 1
+            if self.mode & 0x20:
+                # one time measurement, powers down afterwards
+                self.powered = False
+                self.busy_until = 0.0
+            else:
+                # continuous: skip the measurements nobody read
+                duration = self.measurement_time()
+                missed = int((now - self.busy_until) / duration)
+                self.busy_until += (missed + 1) * duration
+
+    def write(self, data: bytes, now: float) -> None:
+        self.__update(now)
+        for opcode in data:
+            if IoTSimulatedBH1750.POWER_DOWN == opcode:
+                self.powered = False
+                self.busy_until = 0.0
+            elif IoTSimulatedBH1750.POWER_ON == opcode:
+                self.powered = True
+            elif IoTSimulatedBH1750.RESET == opcode:
+                if self.powered:
+                    self.data = 0
+            elif opcode in (0x10, 0x11, 0x13, 0x20, 0x21, 0x23):
+                self.powered = True
+                self.mode = opcode
+                self.busy_until = now + self.measurement_time()
+            elif 0x40 == opcode & 0xF8:
+                # high bits of the measurement time register
+                self.mtreg = ((opcode & 0x07) << 5) | (self.mtreg & 0x1F)
+            elif 0x60 == opcode & 0xE0:
+                self.mtreg = (self.mtreg & 0xE0) | (opcode & 0x1F)
+
+    def read(self, length: int, now: float) -> bytes:
+        self.__update(now)
+        # only two bytes of data, the bus reads 0xFF after them
+        result = bytes([self.data >> 8, self.data & 0xFF])
+        return (result + b"\xff" * length)[:length]
+
+
+class IoTSimulatedADS1115(IoTSimulatedChip):
+    """ ADS1115 16 bit ADC: conversion, config and the two threshold registers selected
+        by a pointer byte. Single shot conversions start by setting the OS bit, which
+        reads 0 until the conversion is done, continuous conversions run at the data
+        rate. MUX selects the input (single ended or differential), PGA the full scale
+        range. The ALERT/RDY pin is driven on the simulated GPIO bank if 'alert_pin' is
+        given: as conversion ready signal (hi_thresh MSB 1, lo_thresh MSB 0) or by the
+        comparator in traditional or window mode, with polarity, latching and queue.
+
+    Args:
+        params (dict): 'channels' maps 0-3 to parameters of IoTSimulatedSignal in volt,
+            'alert_pin' the GPIO pin ALERT/RDY is wired to, plus 'error_rate'
+        gpio (IoTSimulatedGPIO): the simulated GPIO bank for the ALERT/RDY pin
+    """
+
+    CONVERSION = 0x00
+    CONFIG = 0x01
+    LO_THRESH = 0x02
+    HI_THRESH = 0x03
+
+    DATA_RATES = (8, 16, 32, 64, 128, 250, 475, 860)
+    FULL_SCALE = (6.144, 4.096, 2.048, 1.024, 0.512, 0.256, 0.256, 0.256)
+    # inputs of MUX settings as (positive, negative), None is GND
+    INPUTS = ((0, 1), (0, 3), (1, 3), (2, 3), (0, None), (1, None), (2, None), (3, None))
+
+    def __init__(self, params: dict = None, rng=None, start: float = 0.0, gpio=None):
+        super().__init__(params, rng)
+        channels = self.params.get("channels", {})
+        self.inputs = [IoTSimulatedSignal(
+            channels.get(channel, channels.get(str(channel), {
+                "base": 0.5 + 0.5 * channel, "amplitude": 0.1, "noise": 0.001})), rng, start)
+            for channel in range(4)]
+        self.gpio = gpio
+        self.alert_pin = self.params.get("alert_pin", None)
+        self.registers = [0x0000, 0x8583, 0x8000, 0x7FFF]
+        self.pointer = 0
+        self.busy_until = 0.0
+        self.continuous_since = None
+        self.last_conversion = None
+        self.conversions = 0
+        self.alert = False
+        self.exceeded = 0
+        self.within = 0
+        # set by the simulation to run its clock when a conversion was started
+        self.wakeup = None
+
+    def conversion_time(self) -> float:
+        """ duration of one conversion in seconds at the configured data rate """
+        return 1.0 / IoTSimulatedADS1115.DATA_RATES[(self.registers[1] >> 5) & 0x07]
+
+    def __convert(self, at: float) -> None:
+        """ private helper, one conversion finished at time 'at' """
+        config = self.registers[1]
+        positive, negative = IoTSimulatedADS1115.INPUTS[(config >> 12) & 0x07]
+        volts = self.inputs[positive].value(at)
+        if negative is not None:
+            volts -= self.inputs[negative].value(at)
+        full_scale = IoTSimulatedADS1115.FULL_SCALE[(config >> 9) & 0x07]
+        raw = max(-32768, min(32767, int(round(volts / full_scale * 32768))))
+        self.registers[0] = raw & 0xFFFF
+        self.conversions += 1
+        self.__comparator(raw)
+
+    def __comparator(self, raw: int) -> None:
+        """ private helper updating ALERT/RDY after a conversion """
+        config = self.registers[1]
+        queue = config & 0x03
+        if self.gpio is None or self.alert_pin is None or 0x03 == queue:
+            return
+        active = 0 if 0 == config & 0x08 else 1
+        hi_thresh = self.registers[3] - 0x10000 if self.registers[3] & 0x8000 else self.registers[3]
+        lo_thresh = self.registers[2] - 0x10000 if self.registers[2] & 0x8000 else self.registers[2]
+        if self.registers[3] & 0x8000 and not self.registers[2] & 0x8000:
+            # conversion ready: a short pulse in continuous mode, in single shot mode
+            # the pin stays asserted until the next conversion starts
+            if config & 0x0100:
+                self.gpio.drive(self.alert_pin, active)
+            else:
+                self.gpio.pulse(self.alert_pin, 8e-6, active)
+            return
+        window = config & 0x10
+        outside = raw > hi_thresh or (window and raw < lo_thresh)
+        if outside:
+            self.exceeded += 1
+            self.within = 0
+        else:
+            self.within += 1
+            self.exceeded = 0
+        if not self.alert and self.exceeded >= (1 << queue):
+            self.alert = True
+        elif self.alert and not config & 0x04:
+            # not latching: deasserts in window mode when inside, else below lo_thresh
+            if (window and not outside) or (not window and raw < lo_thresh):
+                self.alert = False
+        self.gpio.drive(self.alert_pin, active if self.alert else 1 - active)
+
+    def __update(self, now: float) -> None:
+        """ private helper finishing the conversions done until now """
+        if self.busy_until and now >= self.busy_until:
+            self.__convert(self.busy_until)
+            self.busy_until = 0.0
+            # OS bit: no conversion running
+            self.registers[1] |= 0x8000
+        if self.continuous_since is not None:
+            duration = self.conversion_time()
+            done = int((now - self.continuous_since) / duration)
+            if done > 0 and (self.last_conversion is None or done > self.last_conversion):
+                if self.alert_pin is not None and 0x03 != self.registers[1] & 0x03:
+                    # the comparator sees every conversion
+                    first = 1 if self.last_conversion is None else self.last_conversion + 1
+                    for n in range(max(first, done - 64), done + 1):
+                        self.__convert(self.continuous_since + n * duration)
+                else:
+                    self.__convert(self.continuous_since + done * duration)
+                self.last_conversion = done
+
+    def next_event(self, now: float):
+        """ time.monotonic() when the next conversion finishes, or None """
+        self.__update(now)
+        if self.busy_until:
+            return self.busy_until
+        if self.continuous_since is not None:
+            duration = self.conversion_time()
+            return self.continuous_since + ((self.last_conversion or 0) + 1) * duration
+        return None
+
+    def tick(self, now: float) -> None:
+        """ called by the simulation to drive ALERT/RDY in time """
+        self.__update(now)
+
+    def write(self, data: bytes, now: float) -> None:
+        self.__update(now)
+        if not data:
+            return
+        self.pointer = data[0] & 0x03
+        if len(data) < 3 or IoTSimulatedADS1115.CONVERSION == self.pointer:
+            return
+        value = (data[1] << 8) | data[2]
+        if IoTSimulatedADS1115.CONFIG == self.pointer:
+            if value & 0x0100:
+                # single shot, the OS bit starts a conversion
+                self.continuous_since = None
+                if value & 0x8000 and not self.busy_until:
+                    # wake up from power down takes about 25 us
+                    self.busy_until = now + 25e-6 + 1.0 / IoTSimulatedADS1115.DATA_RATES[
+                        (value >> 5) & 0x07]
+                    if self.alert_pin is not None and self.gpio is not None and \
+                            self.registers[3] & 0x8000 and not self.registers[2] & 0x8000:
+                        self.gpio.drive(self.alert_pin, 0 if value & 0x08 else 1)
+                self.registers[1] = (value & 0x7FFF) | (0 if self.busy_until else 0x8000)
+            else:
+                self.registers[1] = value | 0x8000
+                self.continuous_since = now
+                self.last_conversion = None
+            if self.wakeup is not None:
+                self.wakeup.set()
+        else:
+            self.registers[self.pointer] = value
+
+    def read(self, length: int, now: float) -> bytes:
+        self.__update(now)
+        value = self.registers[self.pointer]
+        if IoTSimulatedADS1115.CONVERSION == self.pointer and self.alert and \
+                self.registers[1] & 0x04:
+            # reading the conversion clears a latched alert
+            self.alert = False
+            if self.gpio is not None and self.alert_pin is not None:
+                self.gpio.drive(self.alert_pin, 0 if self.registers[1] & 0x08 else 1)
+        result = bytes([value >> 8, value & 0xFF])
+        return (result * ((length + 1) // 2))[:length]
+
+
+class IoTSimulatedPCF8591(IoTSimulatedChip):
+    """ PCF8591 8 bit ADC/DAC: the control byte selects the channel, auto increment
+        and the analog output, a second byte sets the DAC. Each byte read returns the
+        conversion started with the previous one, so the first byte after selecting a
+        channel is still from the old one.
+
+    Args:
+        params (dict): 'channels' maps 0-3 to parameters of IoTSimulatedSignal in volt,
+            default are pulses like from an electricity meter, 'vref' the reference
+            voltage, plus 'error_rate'
+    """
+
+    def __init__(self, params: dict = None, rng=None, start: float = 0.0):
+        super().__init__(params, rng)
+        channels = self.params.get("channels", {})
+        self.inputs = [IoTSimulatedSignal(
+            channels.get(channel, channels.get(str(channel), {
+                "kind": "pulses", "level": 2.5, "pulse_level": 0.2, "rate": 0.5,
+                "width": 0.05, "noise": 0.01})), rng, start)
+            for channel in range(4)]
+        self.vref = self.params.get("vref", 3.3)
+        self.control = 0x00
+        self.dac = 0x80
+        self.last = 0x80
+
+    def write(self, data: bytes, now: float) -> None:
+        if not data:
+            return
+        self.control = data[0]
+        if len(data) > 1:
+            self.dac = data[-1]
+
+    def read(self, length: int, now: float) -> bytes:
+        result = bytearray(length)
+        for i in range(length):
+            result[i] = self.last
+            channel = self.control & 0x03
+            volts = self.inputs[channel].value(now)
+            self.last = max(0, min(255, int(round(volts / self.vref * 255))))
+            if self.control & 0x04:
+                self.control = (self.control & 0xFC) | ((channel + 1) & 0x03)
+        return bytes(result)
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" simulated GPIO pins with the interface of RPi.GPIO
+
+"""
+
+import logging
+import queue
+import threading
+import time
+
+
+class IoTSimulatedPWM:
+    """ the counterpart of RPi.GPIO.PWM, keeps frequency and duty cycle """
+
+    def __init__(self, gpio: 'IoTSimulatedGPIO', channel: int, frequency: float):
+        self.gpio = gpio
+        self.channel = channel
+        self.frequency = frequency
+        self.duty_cycle = 0.0
+        self.running = False
+
+    def start(self, duty_cycle: float) -> None:
+        self.running = True
+        self.ChangeDutyCycle(duty_cycle)
+
+    def ChangeDutyCycle(self, duty_cycle: float) -> None:  # pylint: disable=invalid-name
+        self.duty_cycle = duty_cycle
+        self.gpio.notify(self.channel, duty_cycle)
+
+    def ChangeFrequency(self, frequency: float) -> None:  # pylint: disable=invalid-name
+        self.frequency = frequency
+
+    def stop(self) -> None:
+        self.running = False
+        self.gpio.notify(self.channel, 0.0)
+
+
+class IoTSimulatedGPIO:
+    """ a bank of simulated GPIO pins with the interface of RPi.GPIO the devices use.
+        Outputs keep their level and report every change to the output listeners,
+        inputs get their level from the pull up/down resistor until a test or benchmark
+        drives them with inject() or pulse(). Edges on inputs with event detection call
+        the callbacks in a separate thread like RPi.GPIO does, respecting bouncetime.
+    """
+
+    # constants of RPi.GPIO
+    BOARD = 10
+    BCM = 11
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+    RPI_INFO = {"TYPE": "simulated", "P1_REVISION": 3}
+    VERSION = "simulated"
+
+    def __init__(self):
+        self.logger = logging.getLogger("iot_control")
+        self.mode = None
+        self.directions = {}
+        self.levels = {}
+        self.detect = {}
+        self.callbacks = {}
+        self.last_callback = {}
+        self.detected = set()
+        self.listeners = []
+        self.lock = threading.RLock()
+        self.events = queue.Queue()
+        self.dispatcher = None
+
+    # the interface of RPi.GPIO
+
+    def setmode(self, mode: int) -> None:
+        self.mode = mode
+
+    def getmode(self):
+        return self.mode
+
+    def setwarnings(self, flag: bool) -> None:
+        """ nothing to warn about """
+
+    def setup(self, channel, direction: int, pull_up_down: int = PUD_OFF,
+              initial: int = None) -> None:
+        if self.mode is None:
+            raise RuntimeError("Please set pin numbering mode using GPIO.setmode(GPIO.BOARD) "
+                               "or GPIO.setmode(GPIO.BCM)")
+        for pin in IoTSimulatedGPIO.__channels(channel):
+            with self.lock:
+                self.directions[pin] = direction
+                if IoTSimulatedGPIO.OUT == direction:
+                    level = IoTSimulatedGPIO.LOW if initial is None else initial
+                else:
+                    level = 1 if IoTSimulatedGPIO.PUD_UP == pull_up_down else 0
+                self.levels[pin] = level
+            if IoTSimulatedGPIO.OUT == direction:
+                self.notify(pin, level)
+
+    def output(self, channel, value) -> None:
+        pins = IoTSimulatedGPIO.__channels(channel)
+        values = value if isinstance(value, (list, tuple)) else [value] * len(pins)
+        for pin, level in zip(pins, values):
+            if IoTSimulatedGPIO.OUT != self.directions.get(pin, None):
+                raise RuntimeError("The GPIO channel has not been set up as an OUTPUT")
+            self.levels[pin] = 1 if level else 0
+            self.notify(pin, self.levels[pin])
+
+    def input(self, channel: int) -> int:
+        if channel not in self.directions:
+            raise RuntimeError("You must setup() the GPIO channel first")
+        return self.levels[channel]
+
+    def add_event_detect(self, channel: int, edge: int, callback=None,
+                         bouncetime: int = None) -> None:
+        with self.lock:
+            if channel in self.detect:
+                raise RuntimeError("Conflicting edge detection already enabled "
+                                   "for this GPIO channel")
+            self.detect[channel] = (edge, (bouncetime or 0) / 1000.0)
+            self.callbacks[channel] = [callback] if callback is not None else []
+        self.__start_dispatcher()
+
+    def add_event_callback(self, channel: int, callback) -> None:
+        if channel not in self.detect:
+            raise RuntimeError("Add event detection using add_event_detect first "
+                               "before adding a callback")
+        self.callbacks[channel].append(callback)
+
+    def remove_event_detect(self, channel: int) -> None:
+        with self.lock:
+            self.detect.pop(channel, None)
+            self.callbacks.pop(channel, None)
+
+    def event_detected(self, channel: int) -> bool:
+        with self.lock:
+            if channel in self.detected:
+                self.detected.discard(channel)
+                return True
+        return False
+
+    def wait_for_edge(self, channel: int, edge: int, bouncetime: int = None,
+                      timeout: int = None):
+        """ polls the level, good enough for a simulation """
+        end = None if timeout is None else time.monotonic() + timeout / 1000.0
+        last = self.levels.get(channel, 0)
+        while end is None or time.monotonic() < end:
+            level = self.levels.get(channel, 0)
+            if level != last and IoTSimulatedGPIO.__matches(edge, level):
+                return channel
+            last = level
+            time.sleep(0.0005)
+        return None
+
+    def PWM(self, channel: int, frequency: float) -> IoTSimulatedPWM:  # pylint: disable=invalid-name
+        return IoTSimulatedPWM(self, channel, frequency)
+
+    def cleanup(self, channel=None) -> None:
+        with self.lock:
+            pins = list(self.directions) if channel is None else IoTSimulatedGPIO.__channels(channel)
+            for pin in pins:
+                self.directions.pop(pin, None)
+                self.levels.pop(pin, None)
+                self.detect.pop(pin, None)
+                self.callbacks.pop(pin, None)
+
+    # the simulation side
+
+    def add_output_listener(self, listener) -> None:
+        """ listener(pin, value, timestamp) is called for every change of an output or
+            PWM duty cycle, in the thread of the driver which made it
+        """
+        self.listeners.append(listener)
+
+    def notify(self, pin: int, value) -> None:
+        """ report an output change to the listeners """
+        now = time.monotonic()
+        for listener in self.listeners:
+            listener(pin, value, now)
+
+    def level(self, pin: int) -> int:
+        """ the current level of a pin, None if not set up """
+        return self.levels.get(pin, None)
+
+    def inject(self, pin: int, value: int) -> None:
+        """ drive an input pin from outside, like a switch or sensor does
+
+        Args:
+            pin (int): the pin
+            value (int): 0 or 1
+        """
+        value = 1 if value else 0
+        with self.lock:
+            if IoTSimulatedGPIO.OUT == self.directions.get(pin, None):
+                raise RuntimeError("GPIO {} is an output".format(pin))
+            old = self.levels.get(pin, None)
+            self.levels[pin] = value
+            if old == value or pin not in self.detect:
+                return
+            edge, bouncetime = self.detect[pin]
+            if not IoTSimulatedGPIO.__matches(edge, value):
+                return
+            now = time.monotonic()
+            if now - self.last_callback.get(pin, -bouncetime - 1.0) < bouncetime:
+                return
+            self.last_callback[pin] = now
+            self.detected.add(pin)
+            if self.callbacks[pin]:
+                self.events.put((pin, list(self.callbacks[pin])))
+
+    # a chip driving a pin is the same as injecting
+    drive = inject
+
+    def pulse(self, pin: int, width: float, level: int = 1) -> None:
+        """ drive an input to level for width seconds and back, blocks for width
+
+        Args:
+            pin (int): the pin
+            width (float): duration of the pulse in seconds
+            level (int): level during the pulse
+        """
+        self.inject(pin, level)
+        if width >= 0.001:
+            time.sleep(width)
+        self.inject(pin, 1 - level)
+
+    @staticmethod
+    def __matches(edge: int, level: int) -> bool:
+        """ private helper, does a change to level match the detected edge """
+        return IoTSimulatedGPIO.BOTH == edge or \
+            (IoTSimulatedGPIO.RISING == edge and 1 == level) or \
+            (IoTSimulatedGPIO.FALLING == edge and 0 == level)
+
+    @staticmethod
+    def __channels(channel) -> list:
+        """ private helper, a channel or a list of channels as list """
+        return list(channel) if isinstance(channel, (list, tuple)) else [channel]
+
+    def __start_dispatcher(self) -> None:
+        """ private helper starting the thread calling the event callbacks """
+        with self.lock:
+            if self.dispatcher is not None:
+                return
+            self.dispatcher = threading.Thread(target=self.__dispatch, daemon=True,
+                                               name="iot_control_gpio_events")
+            self.dispatcher.start()
+
+    def __dispatch(self) -> None:
+        """ private thread calling the callbacks one after the other like RPi.GPIO """
+        while True:
+            pin, callbacks = self.events.get()
+            for callback in callbacks:
+                try:
+                    callback(pin)
+                except Exception as exception:  # pylint: disable=broad-except
+                    self.logger.error("GPIO callback for pin %d failed: %s", pin, exception)
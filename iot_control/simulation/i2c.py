@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" simulated I2C buses with the interface of smbus2.SMBus
+
+"""
+
+import errno
+import threading
+import time
+
+
+class IoTSimulatedMessage:
+    """ one message of a combined transaction, the counterpart of smbus2.i2c_msg """
+
+    # flag of a read message as in linux/i2c.h
+    I2C_M_RD = 0x0001
+
+    def __init__(self, addr: int, flags: int, buf):
+        self.addr = addr
+        self.flags = flags
+        self.buf = bytearray(buf)
+        self.len = len(self.buf)
+
+    @staticmethod
+    def read(address: int, length: int) -> 'IoTSimulatedMessage':
+        """ a message reading length bytes """
+        return IoTSimulatedMessage(address, IoTSimulatedMessage.I2C_M_RD, bytes(length))
+
+    @staticmethod
+    def write(address: int, buf) -> 'IoTSimulatedMessage':
+        """ a message writing the bytes in buf """
+        if isinstance(buf, str):
+            buf = buf.encode("latin-1")
+        return IoTSimulatedMessage(address, 0, buf)
+
+    def __iter__(self):
+        return iter(self.buf)
+
+    def __bytes__(self):
+        return bytes(self.buf)
+
+    def __len__(self):
+        return self.len
+
+
+class IoTSimulatedChip:
+    """ base class for a chip on a simulated bus. The bus hands it the raw transfers:
+        write() gets all bytes of a write transfer (a register pointer or command
+        first), read() returns the bytes of a read transfer. Both are called with the
+        lock of the bus held, like a real bus only does one transfer at a time.
+
+    Args:
+        params (dict): parameters of the simulation, 'error_rate' is the probability
+            of a transfer failing with a Remote I/O error
+        rng (random.Random): the random generator of the simulation
+    """
+
+    def __init__(self, params: dict = None, rng=None):
+        self.params = params or {}
+        self.rng = rng
+        self.error_rate = self.params.get("error_rate", 0.0)
+        self.transfers = 0
+
+    def write(self, data: bytes, now: float) -> None:
+        """ a write transfer """
+
+    def read(self, length: int, now: float) -> bytes:
+        """ a read transfer """
+        return bytes(length)
+
+
+class IoTSimulatedRegisterChip(IoTSimulatedChip):
+    """ a chip with 8 bit registers and a register pointer which increments with every
+        byte read, like the BME280. The first byte of a write sets the pointer, the
+        following ones are written to the registers from there on.
+    """
+
+    def __init__(self, params: dict = None, rng=None):
+        super().__init__(params, rng)
+        self.registers = bytearray(256)
+        self.pointer = 0
+
+    def write_register(self, register: int, value: int, now: float) -> None:
+        """ a register was written, overwrite to react on it """
+        self.registers[register] = value
+
+    def update(self, now: float) -> None:
+        """ bring the registers up to date before a read, overwrite for conversions
+            which finish in the background
+        """
+
+    def write(self, data: bytes, now: float) -> None:
+        if not data:
+            return
+        self.pointer = data[0]
+        for value in data[1:]:
+            self.write_register(self.pointer, value, now)
+            self.pointer = (self.pointer + 1) & 0xFF
+
+    def read(self, length: int, now: float) -> bytes:
+        self.update(now)
+        result = bytearray(length)
+        for i in range(length):
+            result[i] = self.registers[self.pointer]
+            self.pointer = (self.pointer + 1) & 0xFF
+        return bytes(result)
+
+
+class IoTSimulatedI2CBus:
+    """ the chips on one simulated bus, shared by all handles opened for it. Every
+        transfer takes the time the bytes need on the wire at the given clock.
+
+    Args:
+        port (int): number of the bus
+        clock (int): clock of the bus in Hz, 0 for transfers without delay
+    """
+
+    def __init__(self, port: int, clock: int = 100000):
+        self.port = port
+        self.clock = clock
+        self.chips = {}
+        self.lock = threading.Lock()
+        # statistics
+        self.transfers = 0
+        self.bytes = 0
+        self.busy_time = 0.0
+
+    def attach(self, address: int, chip: IoTSimulatedChip) -> IoTSimulatedChip:
+        """ put a chip on the bus, a chip already at this address is kept
+
+        Args:
+            address (int): 7 bit I2C address
+            chip (IoTSimulatedChip): the chip
+        """
+        return self.chips.setdefault(address, chip)
+
+    def transfer(self, address: int, write: bytes = None, read: int = 0) -> bytes:
+        """ a write and/or a read transfer to one chip, with a repeated start in between
+
+        Args:
+            address (int): 7 bit I2C address
+            write (bytes): the bytes to write or None
+            read (int): number of bytes to read
+        """
+        chip = self.chips.get(address, None)
+        with self.lock:
+            # address byte plus data, 9 clocks each including the acknowledge
+            count = (1 + len(write) if write is not None else 0) + (1 + read if read else 0)
+            duration = count * 9.0 / self.clock if self.clock else 0.0
+            start = time.monotonic()
+            if duration:
+                time.sleep(duration)
+            self.transfers += 1
+            self.bytes += count
+            self.busy_time += time.monotonic() - start
+            if chip is None or (chip.error_rate and chip.rng.random() < chip.error_rate):
+                raise OSError(errno.EREMOTEIO, "Remote I/O error")
+            chip.transfers += 1
+            now = time.monotonic()
+            if write is not None:
+                chip.write(bytes(write), now)
+            if read:
+                return chip.read(read, now)
+        return b""
+
+
+class IoTSimulatedSMBus:
+    """ handle for a simulated bus with the interface of smbus2.SMBus
+
+    Args:
+        bus (IoTSimulatedI2CBus): the bus
+    """
+
+    def __init__(self, bus: IoTSimulatedI2CBus):
+        self.bus = bus
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        """ nothing to close """
+
+    def read_byte(self, i2c_addr: int, force=None) -> int:
+        return self.bus.transfer(i2c_addr, read=1)[0]
+
+    def write_byte(self, i2c_addr: int, value: int, force=None) -> None:
+        self.bus.transfer(i2c_addr, write=bytes([value]))
+
+    def read_byte_data(self, i2c_addr: int, register: int, force=None) -> int:
+        return self.bus.transfer(i2c_addr, write=bytes([register]), read=1)[0]
+
+    def write_byte_data(self, i2c_addr: int, register: int, value: int, force=None) -> None:
+        self.bus.transfer(i2c_addr, write=bytes([register, value]))
+
+    def read_word_data(self, i2c_addr: int, register: int, force=None) -> int:
+        # SMBus words are little endian
+        data = self.bus.transfer(i2c_addr, write=bytes([register]), read=2)
+        return data[0] | (data[1] << 8)
+
+    def write_word_data(self, i2c_addr: int, register: int, value: int, force=None) -> None:
+        self.bus.transfer(i2c_addr, write=bytes([register, value & 0xFF, (value >> 8) & 0xFF]))
+
+    def read_i2c_block_data(self, i2c_addr: int, register: int, length: int, force=None) -> list:
+        return list(self.bus.transfer(i2c_addr, write=bytes([register]), read=length))
+
+    def write_i2c_block_data(self, i2c_addr: int, register: int, data, force=None) -> None:
+        self.bus.transfer(i2c_addr, write=bytes([register] + list(data)))
+
+    def i2c_rdwr(self, *i2c_msgs) -> None:
+        """ combined transaction, each read message gets its data in its buffer. A write
+            followed by a read of the same chip is one transfer with a repeated start
+        """
+        messages = list(i2c_msgs)
+        while messages:
+            message = messages.pop(0)
+            if message.flags & IoTSimulatedMessage.I2C_M_RD:
+                message.buf[:] = self.bus.transfer(message.addr, read=message.len)
+            elif messages and messages[0].addr == message.addr and \
+                    messages[0].flags & IoTSimulatedMessage.I2C_M_RD:
+                read = messages.pop(0)
+                read.buf[:] = self.bus.transfer(message.addr, write=bytes(message.buf),
+                                                read=read.len)
+            else:
+                self.bus.transfer(message.addr, write=bytes(message.buf))
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" physical quantities the simulated chips measure
+
+"""
+
+import math
+
+
+class IoTSimulatedSignal:
+    """ a value changing over time: slow drift as a sine around 'base' with noise, or
+        'pulses' of 'pulse_level' for 'width' seconds, 'rate' times per second, on top
+        of 'level', like the light of an electricity meter on a photo diode
+
+    Args:
+        params (dict): {kind: sine, base, amplitude, period, noise} or
+            {kind: pulses, level, pulse_level, rate, width, noise}
+        rng (random.Random): the random generator of the simulation
+        start (float): time.monotonic() when the simulation started
+    """
+
+    def __init__(self, params: dict, rng, start: float):
+        self.params = params
+        self.kind = params.get("kind", "sine")
+        self.rng = rng
+        self.start = start
+        self.noise = params.get("noise", 0.0)
+        if "pulses" == self.kind:
+            self.level = params.get("level", 2.5)
+            self.pulse_level = params.get("pulse_level", 0.2)
+            self.rate = params.get("rate", 1.0)
+            self.width = params.get("width", 0.05)
+        else:
+            self.base = params.get("base", 0.0)
+            self.amplitude = params.get("amplitude", 0.0)
+            self.period = params.get("period", 3600.0)
+            # every sensor drifts differently
+            self.phase = rng.uniform(0, 2 * math.pi)
+
+    def value(self, now: float) -> float:
+        """ the value at time now (time.monotonic()) """
+        t = now - self.start
+        if "pulses" == self.kind:
+            in_pulse = self.rate > 0 and (t * self.rate) % 1.0 < self.width * self.rate
+            value = self.pulse_level if in_pulse else self.level
+        else:
+            value = self.base + self.amplitude * math.sin(2 * math.pi * t / self.period + self.phase)
+        if self.noise:
+            value += self.rng.gauss(0.0, self.noise)
+        return value
+
+    def pulses(self, now: float) -> int:
+        """ number of pulses started until now, to check pulse counting against """
+        if "pulses" != self.kind or self.rate <= 0:
+            return 0
+        return int(math.floor((now - self.start) * self.rate)) + 1
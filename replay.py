@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" replays readings recorded by the runtime (see 'record' in the runtime section of
+    the config file) through the backends of a config file, without any hardware.
+
+    python replay.py setup.yaml readings.rec                  # at the recorded pace
+    python replay.py -s 0 -b influx setup.yaml old.rec.1 readings.rec   # backfill
+
+"""
+
+import argparse
+import datetime
+import logging
+import sys
+from iot_control.iotconfig import IoTConfigLoader
+from iot_control.iotdevicebase import IoTConfigError
+from iot_control.iotruntime import IoTRuntime
+from iot_control.iotreplay import IoTReplay
+
+
+def parse_time(text: str) -> float:
+    """ an ISO 8601 date and time in local time, as seconds since the epoch """
+    return datetime.datetime.fromisoformat(text).timestamp()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("config", help="config file with the backends")
+    parser.add_argument("records", nargs="+", help="record files, oldest first")
+    parser.add_argument("-s", "--speed", type=float, default=1.0,
+                        help="factor for the recorded pace, 0 for as fast as possible")
+    parser.add_argument("-b", "--backend", action="append", dest="backends",
+                        help="only replay to this backend, can be given several times")
+    parser.add_argument("-d", "--device", action="append", dest="devices",
+                        help="only replay devices matching this pattern")
+    parser.add_argument("--start", type=parse_time, help="skip readings before this time")
+    parser.add_argument("--end", type=parse_time, help="stop at this time")
+    parser.add_argument("--all", action="store_true",
+                        help="deliver every reading, ignoring deadband and heartbeat")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logging.getLogger("iot_control").setLevel(logging.DEBUG if args.verbose else logging.INFO)
+
+    try:
+        conf = IoTConfigLoader(IoTRuntime.config_schema).load(args.config)
+    except IoTConfigError as exception:
+        logging.getLogger("iot_control").critical(exception)
+        sys.exit(1)
+
+    replay = IoTReplay(conf, args.backends, args.speed, args.start, args.end,
+                       args.devices, args.all)
+    try:
+        replay.run(args.records)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        replay.shutdown()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" regression tests for the circuit breaker of the reads of a device
+
+"""
+
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from iot_control.iotbackendbase import IoTBackendBase
+from iot_control.iotdevicebase import IoTDeviceBase
+from iot_control.iotfactory import IoTFactory
+from iot_control.iotguard import IoTDeviceGuard
+from iot_control.iotruntime import IoTRuntime
+
+
+@IoTFactory.register_device("test-slow-once")
+class SlowOnceDevice(IoTDeviceBase):
+    """ device whose first read hangs longer than its read_timeout """
+
+    def __init__(self, **kwargs):
+        super().__init__()
+        self.conf = kwargs.get("config")
+        self.reads = 0
+
+    def read_data(self):
+        self.reads += 1
+        if 1 == self.reads:
+            time.sleep(self.conf["hang"])
+        return {"value": self.reads}
+
+    def sensor_list(self) -> list:
+        return ["value"]
+
+    def set_state(self, _) -> bool:
+        return False
+
+    def shutdown(self, _) -> None:
+        pass
+
+
+@IoTFactory.register_backend("test-collect")
+class CollectBackend(IoTBackendBase):
+    """ backend keeping everything it gets """
+
+    def __init__(self, **kwargs):
+        super().__init__()
+        self.data = []
+        self.lock = threading.Lock()
+
+    def workon(self, thing, data, timestamp=None):
+        with self.lock:
+            self.data.append(data)
+
+    def announce(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+    def register_device(self, device):
+        pass
+
+
+class TestIoTDeviceGuard(unittest.TestCase):
+    """ the guard on its own """
+
+    def test_unanswered_probe_opens_again(self):
+        guard = IoTDeviceGuard("test", config={"read_timeout": 1.0, "failure_threshold": 1,
+                                               "backoff": 10.0})
+        guard.failure(0.0, "hang")
+        self.assertFalse(guard.allow(5.0))
+        self.assertTrue(guard.allow(10.0))
+        self.assertEqual(IoTDeviceGuard.HALF_OPEN, guard.state)
+        # the probe is still out
+        self.assertFalse(guard.allow(10.5))
+        # no result after read_timeout, open again with a longer backoff
+        self.assertFalse(guard.allow(11.0))
+        self.assertEqual(IoTDeviceGuard.OPEN, guard.state)
+        self.assertEqual(20.0, guard.current_backoff)
+        self.assertTrue(guard.allow(31.0))
+        guard.success()
+        self.assertEqual(IoTDeviceGuard.CLOSED, guard.state)
+
+
+class TestLateRead(unittest.TestCase):
+    """ a read hangs past its deadline, the circuit opens and the late result arrives
+        while the backoff is over: the device has to be probed and polled again
+    """
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        # the runtime writes its log and the config cache into the current directory
+        os.chdir(self.directory.name)
+        with open("setup.yaml", "w") as f:
+            f.write("runtime:\n"
+                    "  polling: concurrent\n"
+                    "  read_timeout: 0.2\n"
+                    "  failure_threshold: 1\n"
+                    "  backoff: 0.3\n"
+                    "backends:\n"
+                    "  test-collect: {}\n"
+                    "devices:\n"
+                    "  test-slow-once:\n"
+                    "    hang: 0.6\n")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def test_hang_timeout_late_result(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runtime = IoTRuntime("setup.yaml")
+        runtime.set_intervall(0.1)
+        device = runtime.devices[0]
+        backend = runtime.backends[0]
+        guard = runtime.guards[device]
+        loop.call_later(2.0, loop.stop)
+        runtime.loop_forever()
+
+        self.assertEqual(IoTDeviceGuard.CLOSED, guard.state)
+        # the hanging read is followed by regular ones again
+        self.assertGreater(device.reads, 5)
+        with backend.lock:
+            self.assertTrue(backend.data)
+            self.assertNotIn({"value": 1}, backend.data)
+
+
+if __name__ == "__main__":
+    unittest.main()